@@ -0,0 +1,282 @@
+"""
+Benchmarks for the driver, tag and NDEF hot paths.
+
+Runs on CPython against the simulated reader in nfc_sim. For every benchmark
+the SPI transactions, RF frames, simulated bus/RF time, wall-clock time and
+allocations are reported as JSON, so results of two branches can be diffed:
+
+    python bench.py                      # all benchmarks, JSON to stdout
+    python bench.py -o bench_output.txt  # write the results to a file
+    python bench.py -k ndef --repeat 10  # only benchmarks matching "ndef"
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from nfc_sim import SimulatedMFRC522, VirtualMifareClassic, VirtualNTAG
+from nfc_tools import AccessBits, CardGeometry, NFCReader, SectorTrailer, ValueBlock
+from nfc_type2 import Type2Tag
+from nfc_production import PayloadQueue, ProductionEncoder
+from ndef import MAD, NDEFMessage, NDEFRecord, NDEFTag
+
+UID = [0xDE, 0xAD, 0xBE, 0xEF]
+UID7 = [0x04, 0xDE, 0xAD, 0xBE, 0xEF, 0x12, 0x34]
+NDEF_KEY_A0 = bytes([0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5])
+NDEF_KEY_A1 = bytes([0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7])
+
+
+class Env():
+    """A simulated reader with one card in the field"""
+
+    def __init__(self, card=None, irq=True, hw_crc=False, baudrate=100000):
+        self.card = card if card is not None else VirtualMifareClassic(UID)
+        self.sim = SimulatedMFRC522([self.card], baudrate=baudrate)
+        # Simulated time only advances with bus traffic, keep the wall-clock
+        # timeout out of the way (the RC522 timer still ends unanswered commands)
+        self.rdr = NFCReader(spi_device=self.sim, irq=self.sim.irq if irq else None, hw_crc=hw_crc,
+                             timeout_ms=5000)
+        self.tag = None
+
+    def get_tag(self):
+        self.tag = self.rdr.get_tag()
+        return self.tag
+
+
+def ndef_card():
+    """A card formatted like an NFC Forum NDEF Mifare Classic tag"""
+    card = VirtualMifareClassic(UID)
+    for sector in range(card.sectors):
+        key_a = NDEF_KEY_A0 if sector == 0 else NDEF_KEY_A1
+        card.set_trailer(sector, key_a, card.ACCESS_TRANSPORT, b'\xff' * 6)
+    mad1, _ = MAD.for_ndef(CardGeometry.CLASSIC_1K).to_bytes()
+    card.set_block(1, mad1[:16])
+    card.set_block(2, mad1[16:])
+    return card
+
+
+def uri_message(n_records=1, length=24):
+    records = []
+    for i in range(n_records):
+        path = ("x" * length)[:max(0, length - 20)]
+        records.append(NDEFRecord.create_uri(f"https://example.com/{i:04d}/{path}"))
+    return NDEFMessage(records)
+
+
+def large_message(size):
+    rec = NDEFRecord()
+    rec.flags.tnf = 0x02
+    rec.record_type = 0x54
+    rec.record_payload = bytes(i & 0xFF for i in range(size))
+    return NDEFMessage([rec])
+
+
+class Benchmark():
+    def __init__(self, name, run, setup=None, params=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.params = params or {}
+
+
+def benchmarks(opts):
+    env_args = {"irq": not opts.no_irq, "hw_crc": opts.hw_crc, "baudrate": opts.baudrate}
+
+    def tag_env(card=None):
+        def setup():
+            env = Env(card() if card else None, **env_args)
+            env.get_tag()
+            return env
+        return setup
+
+    def untagged_env(card=None):
+        return lambda: Env(card() if card else None, **env_args)
+
+    def empty_env():
+        env = Env(**env_args)
+        env.sim.remove(env.card)
+        return env
+
+    yield Benchmark("reader.get_tag", lambda env: env.get_tag(), untagged_env())
+    yield Benchmark("reader.get_tag.no_tag", lambda env: env.get_tag(), empty_env)
+    yield Benchmark("tag.read_blocks.full_card",
+                    lambda env: env.tag.read_blocks(), tag_env())
+
+    yield Benchmark("type2.read_pages.ntag216",
+                    lambda env: Type2Tag(env.tag).read_pages(0, 231), tag_env(lambda: VirtualNTAG(UID7, 216)))
+
+    for size in (1, 16, 48, 160, 720):
+        yield Benchmark("tag.data_write", lambda env, size=size: env.tag.data_write(b'\x5a' * size),
+                        tag_env(), {"bytes": size})
+
+    def value_env():
+        env = tag_env()()
+        env.tag.format_value(4, 1000)
+        env.rdr.stop_crypto1()
+        env.get_tag() or env.get_tag()
+        return env
+
+    def read_modify_write(env):
+        value = ValueBlock.from_bytes(env.tag._read_block(4)).value
+        env.tag._write_block(4, ValueBlock(value - 1, 4).to_bytes())
+
+    yield Benchmark("tag.value.decrement", lambda env: env.tag.decrement(4, 1), value_env)
+    yield Benchmark("tag.value.read_modify_write", read_modify_write, value_env)
+
+    def ndef_trailers(sector):
+        if sector == 0:
+            return SectorTrailer(NDEF_KEY_A0, AccessBits.NDEF_MAD, gpb=0xC1)
+        return SectorTrailer(NDEF_KEY_A1, AccessBits.NDEF, gpb=0x40)
+
+    yield Benchmark("tag.rekey.full_card", lambda env: env.tag.rekey({s: ndef_trailers(s) for s in range(16)}),
+                    tag_env())
+
+    for n_records, length in ((1, 24), (8, 80)):
+        def write_then_read(env, n_records=n_records, length=length):
+            NDEFTag(env.tag).write_messages([uri_message(n_records, length)])
+            env.rdr.stop_crypto1()
+            env.get_tag() or env.get_tag()
+            return env
+
+        yield Benchmark("ndef.read_messages", lambda env: NDEFTag(env.tag).read_messages(),
+                        lambda write_then_read=write_then_read: write_then_read(tag_env(ndef_card)()),
+                        {"records": n_records, "uri_length": length})
+        yield Benchmark("ndef.write_messages",
+                        lambda env, n_records=n_records, length=length:
+                            NDEFTag(env.tag).write_messages([uri_message(n_records, length)]),
+                        tag_env(ndef_card), {"records": n_records, "uri_length": length})
+
+    def payload_chunks(size=640, chunk=64):
+        for i in range(0, size, chunk):
+            yield bytes(range(i & 0xFF, (i & 0xFF) + chunk))
+
+    def write_chunked(env):
+        NDEFTag(env.tag).write_chunked(0x54, payload_chunks(), tnf=0x01)
+        env.rdr.stop_crypto1()
+        env.get_tag() or env.get_tag()
+        return env
+
+    yield Benchmark("ndef.write_chunked", lambda env: NDEFTag(env.tag).write_chunked(0x54, payload_chunks(), tnf=0x01),
+                    tag_env(ndef_card), {"bytes": 640, "chunk": 64})
+    yield Benchmark("ndef.iter_payload", lambda env: sum(len(c) for c in NDEFTag(env.tag).iter_payload()),
+                    lambda: write_chunked(tag_env(ndef_card)()), {"bytes": 640, "chunk": 64})
+
+    for size in (720, 4096):
+        encoded = large_message(size).to_bytes()
+        yield Benchmark("ndef.parse_from_bytes",
+                        lambda data: NDEFMessage.parse_from_bytes(data, total_length=len(data)),
+                        lambda encoded=encoded: bytearray(encoded), {"bytes": size})
+        yield Benchmark("ndef.to_bytes", lambda msg: msg.to_bytes(),
+                        lambda size=size: large_message(size), {"bytes": size})
+
+    def card_cycle(env):
+        tag = env.get_tag()
+        NDEFTag(tag).write_messages([uri_message()])
+        NDEFTag(tag).read_messages()
+        env.rdr.stop_crypto1()
+
+    yield Benchmark("cycle.encode_card", card_cycle, untagged_env(ndef_card))
+
+    def production_cycle(env):
+        # Detect, write, verify, then the card leaves the field
+        encoder = ProductionEncoder(env.rdr, PayloadQueue("https://example.com/t/{serial:06d}"),
+                                    on_result=lambda result, tag: env.sim.remove(env.card))
+        encoder.encode_next(timeout=0)
+
+    yield Benchmark("cycle.production_encode", production_cycle, untagged_env(ndef_card))
+
+
+def measure(bench, repeat):
+    """Run a benchmark, return its result record"""
+
+    def setup():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return bench.setup() if bench.setup else None
+
+    walls = []
+    stats = None
+    sim_us = None
+    for _ in range(repeat):
+        state = setup()
+        sim = state.sim if isinstance(state, Env) else None
+        if sim is not None:
+            sim.reset_stats()
+            clock = sim.clock_us
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            bench.run(state)
+            walls.append(time.perf_counter() - start)
+        if sim is not None:
+            stats = sim.stats()
+            sim_us = sim.clock_us - clock
+
+    # Separate run for allocations, tracing distorts the wall-clock time
+    state = setup()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        bench.run(state)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    blocks = sum(max(0, s.count_diff) for s in after.compare_to(before, "lineno"))
+
+    walls.sort()
+    result = {
+        "name": bench.name,
+        "params": bench.params,
+        "wall_ms_median": round(walls[len(walls) // 2] * 1000, 3),
+        "wall_ms_min": round(walls[0] * 1000, 3),
+        "alloc_peak_bytes": peak,
+        "alloc_blocks": blocks,
+    }
+    if stats is not None:
+        result.update({
+            "spi_transactions": stats["transactions"],
+            "spi_bytes": stats["bytes"],
+            "rf_frames": stats["frames"],
+            "sim_ms": round(sim_us / 1000, 3),
+        })
+    if bench.name.startswith("cycle.") and sim_us:
+        result["cards_per_minute"] = round(60 * 1000000 / sim_us, 1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", dest="filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("-o", dest="output", help="write the JSON results to this file")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--label", default="", help="free-form label, e.g. the branch name")
+    parser.add_argument("--no-irq", action="store_true", help="poll ComIrqReg instead of using the IRQ pin")
+    parser.add_argument("--hw-crc", action="store_true", help="calculate CRC_A on the simulated RC522")
+    parser.add_argument("--baudrate", type=int, default=100000, help="simulated SPI clock")
+    opts = parser.parse_args(argv)
+
+    results = []
+    for bench in benchmarks(opts):
+        if opts.filter in bench.name:
+            results.append(measure(bench, opts.repeat))
+            print(f"[--] {bench.name} {bench.params or ''}", file=sys.stderr)
+
+    report = {
+        "label": opts.label,
+        "python": platform.python_version(),
+        "options": {"irq": not opts.no_irq, "hw_crc": opts.hw_crc, "baudrate": opts.baudrate},
+        "results": results,
+    }
+    out = json.dumps(report, indent=1)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
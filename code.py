@@ -1,7 +1,7 @@
 import board
 import digitalio
-import time
 
+from nfc_log import log, DEBUG
 from nfc_tools import NFCReader, NFCTag, Key, NFCException
 from ndef import NDEFTag
 
@@ -10,6 +10,8 @@ DEFAULTkeyB = Key([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], Key.B)
 NDEFkeyA0 = Key([0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5], Key.A)
 NDEFkeyA1 = Key([0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7], Key.A)
 
+log.level = DEBUG  # dump every block read or written
+
 rdr = NFCReader(board.SCK, board.MOSI, board.MISO, board.D2, board.D7)
 rdr.set_antenna_gain(0x07 << 4)
 led = digitalio.DigitalInOut(board.LED)
@@ -25,15 +27,14 @@ try:
 
             ntag = NDEFTag(tag)
             #ntag.clean()
-            ntag.read_records()
+            print(ntag.read_messages())
         except NFCException as e:
             print(e)
         
-        rdr.stop_crypto1()
         led.value = False
 
         print()
-        time.sleep(2.5)
+        rdr.wait_for_removal()
 
 except KeyboardInterrupt:
     print("Bye")
@@ -1,6 +1,6 @@
 """Utils for tags using the ndef formatting"""
 
-from nfc_tools import NFCTag, Key
+from nfc_tools import NFCTag, Key, AccessBits, SectorTrailer, LRUCache, NFCAuthenticationException, NFCReadingException, NFCWritingException
 from nfc_utils import bytes2str
 
 
@@ -60,6 +60,27 @@ class NDEFRecordHeader():
         return dat
 
 
+def _uri_prefix_index(types: dict) -> dict:
+    """Map the first character of every URI prefix to its (prefix, identifier) pairs, longest first"""
+
+    index = {}
+    for identifier, prefix in types.items():
+        if prefix:
+            index.setdefault(prefix[0], []).append((prefix, identifier))
+    for candidates in index.values():
+        candidates.sort(key=lambda c: -len(c[0]))
+    return index
+
+
+def _int_length(value: int) -> int:
+    """Bytes needed for a type or id stored as a big-endian int"""
+
+    n = 1
+    while value >> (8 * n):
+        n += 1
+    return n
+
+
 class NDEFRecord():
     """A NDEF record"""
 
@@ -107,6 +128,8 @@ class NDEFRecord():
         0x23: "urn:nfc:",
     }
 
+    _URI_PREFIX_INDEX = _uri_prefix_index(WELL_KNOWN_URI_TYPES)
+
     def __init__(self) -> None:
         self.flags: NDEFRecordHeader = NDEFRecordHeader()
         self.len_type: int = None
@@ -144,87 +167,136 @@ class NDEFRecord():
                 prefix = self.WELL_KNOWN_URI_TYPES[identifier]
                 url = self.record_payload[1:]
                 return prefix + bytes(url).decode("utf-8")
-        return self.record_payload
+            if wkt == 0x54:  # Text: status byte (encoding, language length), language, text
+                status = self.record_payload[0]
+                text = bytes(self.record_payload[1 + (status & 0x3F):])
+                return text.decode("utf-16" if status & 0x80 else "utf-8")
+        return bytes(self.record_payload)
 
     @classmethod
-    def from_bytes(cls, datastream) -> "NDEFRecord":
+    def parse(cls, buf, pos: int = 0) -> tuple:
+        """Parse a record at pos, return (record, position after the record)
+
+        The payload is a memoryview slice of buf, nothing is copied.
+        """
+
+        if not isinstance(buf, memoryview):
+            buf = memoryview(bytes(buf) if isinstance(buf, list) else buf)
+
         self = cls()
-        self.flags = NDEFRecordHeader.from_int(datastream.pop(0))
+        self.flags = NDEFRecordHeader.from_int(buf[pos])
         # record type length
-        self.len_type = datastream.pop(0)
+        self.len_type = buf[pos + 1]
+        pos += 2
         # record payload length
         if self.flags.sr:
-            self.len_payload = datastream.pop(0)
+            self.len_payload = buf[pos]
+            pos += 1
         else:
             self.len_payload = (
-                (datastream.pop(0) << 24) +
-                (datastream.pop(0) << 16) +
-                (datastream.pop(0) << 8) +
-                (datastream.pop(0))
+                (buf[pos] << 24) |
+                (buf[pos + 1] << 16) |
+                (buf[pos + 2] << 8) |
+                buf[pos + 3]
             )
+            pos += 4
         # record id length
         if self.flags.il:
-            self.len_id = datastream.pop(0)
+            self.len_id = buf[pos]
+            pos += 1
+
+        end = pos + self.len_type + (self.len_id if self.flags.il else 0) + self.len_payload
+        if end > len(buf):
+            raise ValueError("NDEF record is longer than the data!")
 
         # record type
         self.record_type = 0
-        for _ in range(self.len_type):
-            self.record_type = (self.record_type << 8) + datastream.pop(0)
+        for i in range(pos, pos + self.len_type):
+            self.record_type = (self.record_type << 8) + buf[i]
+        pos += self.len_type
         # record id
         if self.flags.il:
             self.record_id = 0
-            for _ in range(self.len_id):
-                self.record_id = (self.record_id << 8) + datastream.pop(0)
+            for i in range(pos, pos + self.len_id):
+                self.record_id = (self.record_id << 8) + buf[i]
+            pos += self.len_id
         else:
             self.record_id = None
         # record payload
-        self.record_payload = []
-        for _ in range(self.len_payload):
-            self.record_payload.append(datastream.pop(0))
-        self.record_payload = bytes(self.record_payload)
+        self.record_payload = buf[pos:end]
 
-        return self
+        return self, end
 
-    def to_bytes(self) -> bytes:
-        """Get the record in bytes"""
+    @classmethod
+    def from_bytes(cls, data) -> "NDEFRecord":
+        """Parse a single record from the start of data"""
+        return cls.parse(data)[0]
+
+    def encoded_size(self) -> int:
+        """Length of the encoded record in bytes"""
+
+        len_payload = len(self.record_payload)
+        size = 2 + (1 if len_payload < 256 else 4) + _int_length(self.record_type) + len_payload
+        if self.record_id is not None:
+            size += 1 + _int_length(self.record_id)
+        return size
 
+    def encode_into(self, buf, pos: int = 0) -> int:
+        """Encode the record into buf at pos, return the position after it
+
+        buf must have room for encoded_size() bytes. The MB/ME flags are
+        taken from self.flags, NDEFMessage sets them, and so is CF for
+        records that are one chunk of a chunked record.
+        """
+
+        self.len_type = _int_length(self.record_type)
+        self.len_payload = len(self.record_payload)
+        self.len_id = _int_length(self.record_id) if self.record_id is not None else None
         self.flags = NDEFRecordHeader(
             mb=self.flags.mb,
             me=self.flags.me,
-            cf=False,
-            sr=True if len(self.record_payload) < 256 else False,
-            il=True if self.record_id is not None else False,
+            cf=self.flags.cf,
+            sr=self.len_payload < 256,
+            il=self.record_id is not None,
             tnf=self.flags.tnf
         )
 
-        dat = [self.flags.to_int()]
-
+        buf[pos] = self.flags.to_int()
         # record type length
-        self.len_type = (self.record_type//256)+1
-        dat.append(self.len_type)
-        # record data length
-        self.len_payload = len(self.record_payload)
+        buf[pos + 1] = self.len_type
+        pos += 2
+        # record payload length
         if self.flags.sr:
-            dat.append(self.len_payload)
+            buf[pos] = self.len_payload
+            pos += 1
         else:
-            for i in range(3, -1, -1):
-                dat.append((self.len_payload >> (8 * i)) & 0xFF)
+            for i in range(4):
+                buf[pos + i] = (self.len_payload >> (8 * (3 - i))) & 0xFF
+            pos += 4
         # record id length
         if self.flags.il:
-            dat.append((self.record_id//256)+1)
+            buf[pos] = self.len_id
+            pos += 1
 
-        # record type payload
-        for i in range((self.len_type//8), -1, -1):
-            dat.append((self.record_type >> (8*i)) & 0xFFFFFF)
-        # record id payload
+        # record type
+        for i in range(self.len_type):
+            buf[pos + i] = (self.record_type >> (8 * (self.len_type - 1 - i))) & 0xFF
+        pos += self.len_type
+        # record id
         if self.flags.il:
-            for i in range(self.len_id, -1, -1):
-                dat.append((self.record_id >> (8*i)) & 0xFFFFFF)
-        # record data payload
-        for i in range(self.len_payload):
-            dat.append(self.record_payload[i])
+            for i in range(self.len_id):
+                buf[pos + i] = (self.record_id >> (8 * (self.len_id - 1 - i))) & 0xFF
+            pos += self.len_id
+        # record payload
+        buf[pos:pos + self.len_payload] = self.record_payload
+        return pos + self.len_payload
 
-        return bytes(dat)
+    def to_bytes(self) -> bytes:
+        """Get the record in bytes"""
+
+        buf = bytearray(self.encoded_size())
+        self.encode_into(buf)
+        return bytes(buf)
 
     # Record creation helpers
     @classmethod
@@ -235,17 +307,38 @@ class NDEFRecord():
         self.flags = NDEFRecordHeader(tnf=0x1)
         self.record_type = 0x55
 
-        identifier = 0x0
-        prefix = ""
-        for _identifier, _prefix in self.WELL_KNOWN_URI_TYPES.items():
-            if _prefix != "" and uri.startswith(_prefix):
-                identifier = _identifier
-                prefix = _prefix
+        # Longest matching abbreviation, only prefixes sharing the first character are compared
+        for prefix, identifier in self._URI_PREFIX_INDEX.get(uri[:1], ()):
+            if uri.startswith(prefix):
                 break
+        else:
+            prefix, identifier = "", 0x0
 
-        uri = uri[len(prefix):]
-        self.record_payload = bytes([identifier] +
-                                    list(uri.encode("utf-8")))
+        encoded = uri[len(prefix):].encode("utf-8")
+        payload = bytearray(1 + len(encoded))
+        payload[0] = identifier
+        payload[1:] = encoded
+        self.record_payload = payload
+
+        return self
+
+    @classmethod
+    def create_text(cls, text: str, lang: str = "en") -> "NDEFRecord":
+        """Create a UTF-8 Text record"""
+
+        self = cls()
+        self.flags = NDEFRecordHeader(tnf=0x1)
+        self.record_type = 0x54
+
+        lang = lang.encode("ascii")
+        encoded = text.encode("utf-8")
+        if len(lang) > 0x3F:
+            raise ValueError("Language code too long!")
+        payload = bytearray(1 + len(lang) + len(encoded))
+        payload[0] = len(lang)
+        payload[1:1 + len(lang)] = lang
+        payload[1 + len(lang):] = encoded
+        self.record_payload = payload
 
         return self
 
@@ -258,15 +351,41 @@ class NDEFMessage():
         return str(self.__dict__)
 
     @classmethod
-    def parse_from_bytes(cls, data: bytes, total_length: int = None) -> "NDEFRecord":
-        """Parse a NDEF message from a byte array"""
+    def parse_from_bytes(cls, data: bytes, total_length: int = None) -> "NDEFMessage":
+        """Parse a NDEF message from a byte array
+
+        Records reference data through memoryviews, keep it alive and unchanged.
+        The chunks of a chunked record (CF flag) are joined into one record,
+        its payload is a copy.
+        """
 
         self = cls()
         self.total_length = total_length
 
-        while True:
-            # data is being passed by reference
-            rec = NDEFRecord.from_bytes(data)
+        if not isinstance(data, memoryview):
+            data = memoryview(bytes(data) if isinstance(data, list) else data)
+        if total_length is not None:
+            data = data[:total_length]
+
+        pos = 0
+        chunks = None
+        while pos < len(data):
+            rec, pos = NDEFRecord.parse(data, pos)
+
+            if chunks is not None:
+                # Middle and terminating chunks carry only payload
+                chunks.append(bytes(rec.record_payload))
+                if rec.flags.cf:
+                    continue
+                head.record_payload = b''.join(chunks)
+                head.len_payload = len(head.record_payload)
+                head.flags.cf = False
+                head.flags.me = rec.flags.me
+                rec, chunks = head, None
+            elif rec.flags.cf:
+                head, chunks = rec, [bytes(rec.record_payload)]
+                continue
+
             self.records.append(rec)
 
             if rec.flags.me:
@@ -274,16 +393,258 @@ class NDEFMessage():
 
         return self
 
-    def to_bytes(self) -> bytes:
-        """Convert the message to bytes"""
+    def encoded_size(self) -> int:
+        """Length of the encoded message in bytes"""
+        return sum(rec.encoded_size() for rec in self.records)
 
-        dat = []
+    def encode_into(self, buf, pos: int = 0) -> int:
+        """Encode the message into buf at pos, return the position after it"""
+
+        last = len(self.records) - 1
         for i, rec in enumerate(self.records):
             rec.flags.mb = i == 0
-            rec.flags.me = i == len(self.records) - 1
-            dat.extend(rec.to_bytes())
+            rec.flags.me = i == last
+            pos = rec.encode_into(buf, pos)
+        return pos
 
-        return bytes(dat)
+    def to_bytes(self) -> bytes:
+        """Convert the message to bytes"""
+
+        buf = bytearray(self.encoded_size())
+        self.encode_into(buf)
+        return bytes(buf)
+
+
+def encode_tlvs(messages: list, block_size: int = 16) -> bytearray:
+    """Encode messages as NDEF message TLVs plus a terminator TLV
+
+    The exact size is computed first and everything is written into one
+    bytearray, zero-padded to whole blocks of block_size bytes.
+    """
+
+    sizes = [msg.encoded_size() for msg in messages]
+    total = 1 + sum(size + (4 if size > 0xFE else 2) for size in sizes)
+    buf = bytearray((total + block_size - 1) // block_size * block_size)
+
+    pos = 0
+    for msg, size in zip(messages, sizes):
+        buf[pos] = 0x03
+        if size > 0xFE:
+            buf[pos + 1] = 0xFF
+            buf[pos + 2] = size >> 8
+            buf[pos + 3] = size & 0xFF
+            pos += 4
+        else:
+            buf[pos + 1] = size
+            pos += 2
+        pos = msg.encode_into(buf, pos)
+    buf[pos] = 0xFE
+    return buf
+
+
+# NFC Forum AID of NDEF sectors in the MAD (stored as 03 E1)
+NDEF_AID = 0xE103
+
+
+def mad_crc(data) -> int:
+    """CRC-8 of a MAD (polynomial 0x1D, preset 0xC7), over everything after the CRC byte"""
+
+    crc = 0xC7
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1D) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class MAD():
+    """Mifare Application Directory: the application (AID) of every sector
+
+    MAD v1 (blocks 1 and 2) covers sectors 1-15, MAD v2 (blocks 64-66 in
+    sector 16 of a 4K card) adds sectors 17-39.
+    """
+
+    FREE = 0x0000
+    DEFECT = 0x0001
+    RESERVED = 0x0002
+    CARDHOLDER = 0x0004
+    NOT_APPLICABLE = 0x0005
+
+    MAD1_SECTORS = 16
+    MAD2_SECTOR = 16
+
+    # General purpose byte of the MAD sector trailer: DA (MAD available),
+    # MA (multi-application card) and the MAD version in the low bits
+    GPB_DA = 0x80
+    GPB_MA = 0x40
+
+    def __init__(self, aids: list, info: int = 0x01) -> None:
+        # aids[sector], None for the MAD sectors themselves
+        self.aids = aids
+        # Info byte, the sector of the card publisher
+        self.info = info
+
+    def __repr__(self) -> str:
+        return f"<MAD v{self.version} ndef_sectors={self.sectors()} />"
+
+    @property
+    def version(self) -> int:
+        return 2 if len(self.aids) > self.MAD1_SECTORS else 1
+
+    @classmethod
+    def gpb(cls, version: int) -> int:
+        """General purpose byte announcing a MAD of this version"""
+        return cls.GPB_DA | cls.GPB_MA | version
+
+    @staticmethod
+    def version_of(gpb: int) -> int:
+        """MAD version from a general purpose byte
+
+        The DA bit isn't required, so cards whose MAD was written without
+        touching the trailer keep working.
+        """
+        return gpb & 0x03
+
+    def sectors(self, aid: int = NDEF_AID) -> list:
+        """Sectors assigned to an application, in order"""
+        return [sector for sector, a in enumerate(self.aids) if a == aid]
+
+    @staticmethod
+    def _parse_aids(data, count) -> list:
+        if mad_crc(data[1:]) != data[0]:
+            raise ValueError("MAD CRC mismatch!")
+        return [data[2 + 2 * i] | (data[3 + 2 * i] << 8) for i in range(count)]
+
+    @classmethod
+    def from_bytes(cls, mad1, mad2=None) -> "MAD":
+        """Parse blocks 1-2 (32 bytes) and, for MAD v2, blocks 64-66 (48 bytes)
+
+        Raises ValueError if a CRC does not match.
+        """
+
+        mad1 = bytes(mad1)
+        aids = [None] + cls._parse_aids(mad1, 15)
+        if mad2 is not None:
+            aids += [None] + cls._parse_aids(bytes(mad2), 23)
+        return cls(aids, mad1[1] & 0x3F)
+
+    def _encode(self, first, count) -> bytearray:
+        buf = bytearray(2 + 2 * count)
+        buf[1] = self.info if first == 1 else 0x00
+        for i in range(count):
+            sector = first + i
+            aid = self.aids[sector] if sector < len(self.aids) else self.NOT_APPLICABLE
+            buf[2 + 2 * i] = aid & 0xFF
+            buf[3 + 2 * i] = aid >> 8
+        buf[0] = mad_crc(buf[1:])
+        return buf
+
+    def to_bytes(self) -> tuple:
+        """(blocks 1-2, blocks 64-66 or None for MAD v1)"""
+        mad2 = self._encode(self.MAD2_SECTOR + 1, 23) if self.version == 2 else None
+        return self._encode(1, 15), mad2
+
+    @classmethod
+    def for_ndef(cls, geometry, sectors: int = None) -> "MAD":
+        """A MAD assigning the first sectors (default: all) of a card to NDEF, the rest free"""
+
+        aids = []
+        for sector in range(min(geometry.sector_count, 40)):
+            if sector in geometry.mad_sectors:
+                aids.append(None)
+            elif sectors is None or sectors > 0:
+                aids.append(NDEF_AID)
+                sectors = None if sectors is None else sectors - 1
+            else:
+                aids.append(cls.FREE)
+        return cls(aids)
+
+
+class _AreaReader():
+    """Byte cursor over the NDEF area, holding only the chunk read last"""
+
+    def __init__(self, chunks) -> None:
+        self._chunks = chunks
+        self._buf = memoryview(b'')
+        self._pos = 0
+        # Bytes consumed from the start of the area
+        self.offset = 0
+
+    def _fill(self) -> None:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            raise NFCReadingException("[!<] NDEF data runs past the end of the NDEF area!")
+        self._buf = memoryview(chunk)
+        self._pos = 0
+
+    def byte(self) -> int:
+        if self._pos >= len(self._buf):
+            self._fill()
+        self._pos += 1
+        self.offset += 1
+        return self._buf[self._pos - 1]
+
+    def uint(self, n: int) -> int:
+        value = 0
+        for _ in range(n):
+            value = (value << 8) | self.byte()
+        return value
+
+    def take(self, n: int):
+        """Yield the next n bytes as memoryview pieces of the current chunk"""
+        while n:
+            if self._pos >= len(self._buf):
+                self._fill()
+            k = min(n, len(self._buf) - self._pos)
+            yield self._buf[self._pos:self._pos + k]
+            self._pos += k
+            self.offset += k
+            n -= k
+
+    def skip(self, n: int) -> None:
+        for _ in self.take(n):
+            pass
+
+
+class _AreaWriter():
+    """Writes the NDEF area front to back through a one block buffer
+
+    The first block is held back until close(), so the TLV length in it
+    can be filled in once the size is known.
+    """
+
+    def __init__(self, ndef, key) -> None:
+        self._ndef = ndef
+        self._key = key
+        self._block = bytearray(ndef.tag.BLOCK_SIZE)
+        self._fill = 0
+        self.index = 0
+        self.first = None
+
+    def write(self, data) -> None:
+        data = memoryview(data)
+        bs = len(self._block)
+        pos = 0
+        while pos < len(data):
+            k = min(bs - self._fill, len(data) - pos)
+            self._block[self._fill:self._fill + k] = data[pos:pos + k]
+            self._fill += k
+            pos += k
+            if self._fill == bs:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self.index == 0:
+            self.first = bytearray(self._block)
+        else:
+            self._ndef._write_area_block(self.index, self._block, self._key)
+        self.index += 1
+        self._fill = 0
+        self._block[:] = bytes(len(self._block))
+
+    def close(self) -> None:
+        if self._fill or self.index == 0:
+            self._flush()
 
 
 class NDEFTag():
@@ -291,48 +652,185 @@ class NDEFTag():
     KEYA1 = Key([0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7], Key.A)
     KEYB = Key([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], Key.B)
 
+    # Parsed MADs of recently seen tags by UID, False for tags without one
+    mad_cache = LRUCache(32)
+
     def __init__(self, tag: NFCTag):
         self.tag = tag
-        self._buffer = []
-        self._buf_next_block_index = 0
-
-    def format(self, key=KEYB):
-        self.tag._write_block(
-            0x01, b'\x14\x01\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1', key=key)
-        self.tag._write_block(
-            0x02, b'\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1\x03\xe1', key=key)
+        # NDEF area read so far, allocated per read_messages call
+        self._area = None
+        self._loaded = 0
+        # Blocks of the NDEF area, from the MAD
+        self._blocks = None
+
+    def format(self, key=KEYB, sectors: int = None):
+        """Write a MAD assigning the first `sectors` sectors (default: all) to NDEF, the rest free
+
+        Sector 0 then gets the MAD trailer: key A A0 A1 A2 A3 A4 A5, access
+        bits 78 77 88 and the MAD version in the general purpose byte. Key B
+        is `key` if it is a key B, the default key otherwise.
+        """
+
+        mad = MAD.for_ndef(self.tag.geometry, sectors)
+        mad1, mad2 = mad.to_bytes()
+        self.tag._write_block(0x01, mad1[:16], key=key)
+        self.tag._write_block(0x02, mad1[16:], key=key)
+        if mad2 is not None:
+            for i, blockaddr in enumerate(self.tag.geometry.sector_blocks(MAD.MAD2_SECTOR)[:3]):
+                self.tag._write_block(blockaddr, mad2[i * 16:(i + 1) * 16], key=key)
+        key_b = key if key.mode == Key.B else self.KEYB
+        trailer = SectorTrailer(self.KEYA0, AccessBits.NDEF_MAD, key_b, MAD.gpb(mad.version))
+        self.tag.write_trailer(0, trailer, key=key)
+        self.mad_cache.put(bytes(self.tag.raw_uid), mad)
+        self._blocks = None
 
     def clean(self, keyw0=KEYB, keyw1=KEYA1):
         self.tag.data_write(
-            b'\x03\x00\xFE', blocks=self.tag.MAIN_DATA_BLOCKS, key=keyw1)
-        self.tag.data_clear(blocks=self.tag.MAIN_DATA_BLOCKS[1::], key=keyw1)
-
-    def _read_next(self, key=KEYA1):
-        if len(self._buffer) == 0:
-            self._buffer.extend(self.tag._read_block(
-                self.tag.MAIN_DATA_BLOCKS[self._buf_next_block_index], key=key))
-            self._buf_next_block_index += 1
-        return self._buffer.pop(0)
-
-    def _read_next_n(self, n):
-        return [self._read_next() for _ in range(n)]
-
-    def read_messages(self) -> list[NDEFMessage]:
+            b'\x03\x00\xFE', blocks=self._ndef_blocks(), key=keyw1)
+        self.tag.data_clear(blocks=self._ndef_blocks()[1::], key=keyw1)
+
+    def read_mad(self) -> MAD | None:
+        """The MAD of the tag (cached by UID), None if it has no valid one"""
+        return self.tag.rdr._run(self._mad_steps())
+
+    def _mad_steps(self):
+        uid = bytes(self.tag.raw_uid)
+        mad = self.mad_cache.get(uid)
+        if mad is None:
+            mad, complete = yield from self._read_mad_steps()
+            # A sector that didn't authenticate may be a glitch, ask the card again next time
+            if complete:
+                self.mad_cache.put(uid, mad or False)
+        return mad or None
+
+    def _read_mad_blocks_steps(self, blocks):
+        """Read MAD blocks with the MAD key, None if the key doesn't open them
+
+        Reading errors are raised, they say nothing about the MAD.
+        """
+
+        data = bytearray()
+        for blockaddr in blocks:
+            try:
+                block = yield from self.tag._read_block_steps(blockaddr, key=self.KEYA0)
+            except NFCAuthenticationException:
+                # A failed authentication halts the tag
+                yield from self.tag._reselect_steps()
+                return None
+            if block is None:
+                raise NFCReadingException(f"[!<] 0x{blockaddr:02x}: Reading the MAD failed!")
+            data += bytes(block)
+        return data
+
+    def _read_mad_steps(self):
+        """The MAD (None if there is no valid one) and whether the card could tell
+
+        The trailer of sector 0 is read along with MAD v1, MAD v2 only when
+        its general purpose byte says so. A MAD v2 sector that doesn't open
+        leaves the MAD v1 sectors, a safe subset, and is not asked again.
+        """
+
+        sector0 = yield from self._read_mad_blocks_steps((0x01, 0x02, 0x03))
+        if sector0 is None:
+            return None, False
+        mad1 = sector0[:32]
+        try:
+            mad = MAD.from_bytes(mad1)
+        except ValueError:
+            return None, True
+
+        geometry = self.tag.geometry
+        if MAD.version_of(sector0[41]) == 2 and MAD.MAD2_SECTOR in geometry.mad_sectors:
+            mad2 = yield from self._read_mad_blocks_steps(geometry.sector_blocks(MAD.MAD2_SECTOR)[:3])
+            if mad2 is not None:
+                try:
+                    mad = MAD.from_bytes(mad1, mad2)
+                except ValueError:
+                    pass
+        return mad, True
+
+    def _ndef_blocks(self) -> list:
+        """Blocks of the NDEF area, in order"""
+        if self._blocks is None:
+            self.tag.rdr._run(self._ndef_blocks_steps())
+        return self._blocks
+
+    def _ndef_blocks_steps(self):
+        """Find the NDEF sectors in the MAD; without a MAD, every sector outside the MAD sectors"""
+
+        if self._blocks is None:
+            geometry = self.tag.geometry
+            mad = yield from self._mad_steps()
+            if mad is None:
+                self._blocks = geometry.app_data_blocks
+            else:
+                self._blocks = [blockaddr for sector in mad.sectors(NDEF_AID) if sector < geometry.sector_count
+                                for blockaddr in geometry.sector_blocks(sector) if geometry.is_data(blockaddr)]
+        return self._blocks
+
+    def _area_size(self) -> int:
+        """Size of the NDEF area in bytes"""
+        return len(self._ndef_blocks()) * self.tag.BLOCK_SIZE
+
+    def _load_steps(self, n, key=KEYA1):
+        """Read blocks until the first n bytes of the NDEF area are available
+
+        Returns False if the area is smaller than n bytes.
+        """
+
+        area = self._area
+        if n > len(area):
+            return False
+
+        bs = self.tag.BLOCK_SIZE
+        blocks = self._ndef_blocks()
+        while self._loaded < n:
+            blockaddr = blocks[self._loaded // bs]
+            data = yield from self.tag._read_block_steps(blockaddr, key=key)
+            if data is None:
+                raise NFCReadingException(f"[!<] 0x{blockaddr:02x}: Reading NDEF area failed!")
+            area[self._loaded:self._loaded + bs] = bytes(data)
+            self._loaded += bs
+        return True
+
+    def read_messages(self, key=KEYA1) -> list[NDEFMessage]:
+        """Read the NDEF messages, fetching only the blocks the TLVs cover"""
+        return self.tag.rdr._run(self._read_messages_steps(key))
+
+    def _read_messages_steps(self, key=KEYA1):
         messages = []
 
-        while len(self._buffer) > 0 or self._buf_next_block_index < len(self.tag.MAIN_DATA_BLOCKS):
-            tlv_type = self._read_next()
+        yield from self._ndef_blocks_steps()
+        self._area = bytearray(self._area_size())
+        self._loaded = 0
+        area = self._area
+        view = memoryview(area)
+
+        pos = 0
+        while (yield from self._load_steps(pos + 1, key)):
+            tlv_type = area[pos]
+            pos += 1
 
             if tlv_type == 0x00:
                 continue
             elif tlv_type == 0xFE:
                 break
 
-            tlv_len = self._read_next()
+            if not (yield from self._load_steps(pos + 1, key)):
+                break
+            tlv_len = area[pos]
+            pos += 1
             if tlv_len == 0xFF:
-                tlv_len = (self._read_next() << 8) + self._read_next()
+                if not (yield from self._load_steps(pos + 2, key)):
+                    break
+                tlv_len = (area[pos] << 8) + area[pos + 1]
+                pos += 2
 
-            data = self._read_next_n(tlv_len)
+            if not (yield from self._load_steps(pos + tlv_len, key)):
+                raise NFCReadingException(
+                    f"TLV 0x{tlv_type:02x} is longer ({tlv_len} bytes) than the NDEF area!")
+            data = view[pos:pos + tlv_len]
+            pos += tlv_len
 
             if tlv_type == 0x03:
                 messages.append(NDEFMessage.parse_from_bytes(
@@ -342,28 +840,155 @@ class NDEFTag():
 
         return messages
 
-    def write_messages(self, messages: list[NDEFMessage], key=KEYA1) -> bytes:
-        dat = []
-
-        for msg in messages:
-            msg_dat = msg.to_bytes()
-
-            # tlv type
-            dat.append(0x03)
-
-            # tlv length
-            if len(msg_dat) > 255:
-                dat.append(0xFF)
-                dat.append(len(msg_dat) >> 8)
-                dat.append(len(msg_dat) & 0xFF)
+    def write_messages(self, messages: list[NDEFMessage], key=KEYA1) -> bool:
+        return self.write(memoryview(self.encode_messages(messages)), key=key)
+
+    def encode_messages(self, messages: list[NDEFMessage]) -> bytearray:
+        """The NDEF area contents for messages, padded to whole blocks of the tag"""
+        return encode_tlvs(messages, self.tag.BLOCK_SIZE)
+
+    def verify(self, data, key=KEYA1) -> bool:
+        """Read back only the blocks `data` was written to and compare, e.g. after write"""
+        return self.tag.rdr._run(self._verify_steps(data, key))
+
+    def _verify_steps(self, data, key=KEYA1):
+        yield from self._ndef_blocks_steps()
+        bs = self.tag.BLOCK_SIZE
+        self._area = bytearray((len(data) + bs - 1) // bs * bs)
+        self._loaded = 0
+        yield from self._load_steps(len(self._area), key)
+        return self._area[:len(data)] == data
+
+    def _area_chunks(self, key=KEYA1):
+        """Yield the NDEF area in the order it is read from the tag"""
+
+        for blockaddr in self._ndef_blocks():
+            data = self.tag._read_block(blockaddr, key=key)
+            if data is None:
+                raise NFCReadingException(f"[!<] 0x{blockaddr:02x}: Reading NDEF area failed!")
+            yield bytes(data)
+
+    def _write_area_block(self, index, data, key=KEYA1) -> None:
+        """Write block number index of the NDEF area"""
+
+        blocks = self._ndef_blocks()
+        if index >= len(blocks):
+            raise ValueError(f"Data too long! Only {self._area_size()} bytes available!")
+        if not self.tag._write_block(blocks[index], data, key=key):
+            raise NFCWritingException(f"[>!] 0x{blocks[index]:02x}: Authentication failed!")
+
+    def iter_payload(self, record: int = 0, key=KEYA1):
+        """Yield the payload of a record of the first NDEF message in pieces
+
+        Blocks are read only as the payload reaches them, and the chunks of
+        a chunked record are followed one after another. The pieces are
+        memoryviews into the block read last, use them before asking for
+        the next one. An empty message, or a record past its last one,
+        yields nothing.
+        """
+
+        area = _AreaReader(self._area_chunks(key))
+        while True:
+            tlv_type = area.byte()
+            if tlv_type == 0x00:
+                continue
+            elif tlv_type == 0xFE:
+                return
+            tlv_len = area.byte()
+            if tlv_len == 0xFF:
+                tlv_len = area.uint(2)
+            if tlv_type == 0x03:
+                break
+            area.skip(tlv_len)
+
+        end = area.offset + tlv_len
+        index = 0
+        while area.offset < end:
+            flags = NDEFRecordHeader.from_int(area.byte())
+            len_type = area.byte()
+            len_payload = area.uint(1 if flags.sr else 4)
+            len_id = area.byte() if flags.il else 0
+            if area.offset + len_type + len_id + len_payload > end:
+                raise ValueError("NDEF record is longer than the NDEF message TLV!")
+            area.skip(len_type + len_id)
+
+            if index == record:
+                yield from area.take(len_payload)
             else:
-                dat.append(len(msg_dat))
+                area.skip(len_payload)
 
-            # data
-            dat.extend(msg_dat)
-
-        dat.append(0xFE)
-        self.write(bytes(dat), key=key)
+            if flags.cf:
+                # The next record is another chunk of this one
+                continue
+            if index == record or flags.me:
+                return
+            index += 1
+
+    def write_chunked(self, record_type: int, chunks, tnf: int = 0x02, key=KEYA1) -> int:
+        """Write a NDEF message of one record whose payload comes from an iterable of chunks
+
+        Every chunk becomes one record chunk (CF flag) and is written to the
+        tag as soon as it fills a block. Memory holds the current chunk, the
+        next one (to know whether the current one is the last), the block
+        being filled and the first block. The NDEF TLV length is filled in
+        last, by writing the first block at the end. Returns the size of the
+        message. `tnf` defaults to a media type, pass 0x01 for well-known
+        types like Text (0x54).
+
+        The first block is set to an empty NDEF message before streaming, so
+        a write aborted halfway (too long, card lost) leaves an empty tag
+        rather than the old header over new bytes.
+        """
+
+        empty = bytearray(self.tag.BLOCK_SIZE)
+        empty[0:3] = b'\x03\x00\xFE'
+        self._write_area_block(0, empty, key)
+
+        area = _AreaWriter(self, key)
+        # NDEF message TLV with a three byte length, known only at the end
+        area.write(b'\x03\xFF\x00\x00')
+
+        len_type = _int_length(record_type)
+        size = 0
+        chunks = iter(chunks)
+        chunk = next(chunks, b'')
+        first = True
+        while chunk is not None:
+            following = next(chunks, None)
+            last = following is None
+            flags = NDEFRecordHeader(mb=first, me=last, cf=not last, sr=len(chunk) < 256,
+                                     tnf=tnf if first else 0x06)
+
+            header = bytearray(6 + len_type)
+            header[0] = flags.to_int()
+            header[1] = len_type if first else 0
+            pos = 2
+            for i in range(1 if flags.sr else 4, 0, -1):
+                header[pos] = (len(chunk) >> (8 * (i - 1))) & 0xFF
+                pos += 1
+            if first:
+                for i in range(len_type):
+                    header[pos] = (record_type >> (8 * (len_type - 1 - i))) & 0xFF
+                    pos += 1
+
+            area.write(memoryview(header)[:pos])
+            area.write(chunk)
+            size += pos + len(chunk)
+            if size > 0xFFFE:
+                raise ValueError("NDEF message too long for a TLV!")
+            chunk = following
+            first = False
+
+        area.write(b'\xFE')
+        area.close()
+        area.first[2] = size >> 8
+        area.first[3] = size & 0xFF
+        self._write_area_block(0, area.first, key)
+        return size
 
     def write(self, data, key=KEYA1):
-        self.tag.data_write(data, blocks=self.tag.MAIN_DATA_BLOCKS, key=key)
+        return self.tag.rdr._run(self._write_steps(data, key))
+
+    def _write_steps(self, data, key=KEYA1):
+        blocks = yield from self._ndef_blocks_steps()
+        return (yield from self.tag._data_write_steps(data, blocks=blocks, key=key))
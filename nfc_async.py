@@ -0,0 +1,99 @@
+"""
+asyncio counterparts of the blocking reader, tag and NDEF operations
+
+They run the same code as the blocking calls and give control back to the
+event loop whenever a command is in flight on the RC522, so LEDs, network
+or other readers keep running while a card is polled, read or written.
+Works with CPython's asyncio and CircuitPython's asyncio library.
+"""
+
+import asyncio
+import time
+
+from nfc_log import log
+from nfc_tools import NFCReader, NFCTag
+from ndef import NDEFMessage, NDEFTag
+
+
+async def run_steps(steps):
+    """Drive a ``*_steps`` generator, yielding to the event loop while it waits"""
+
+    try:
+        while True:
+            next(steps)
+            await asyncio.sleep(0)
+    except StopIteration as e:
+        return e.value
+
+
+class AsyncNFCReader():
+    """Async wrapper around an NFCReader"""
+
+    def __init__(self, rdr: NFCReader):
+        self.rdr = rdr
+
+    async def get_tag(self) -> NFCTag | None:
+        """Get a tag if there is one, otherwise return None"""
+        return await run_steps(self.rdr._get_tag_steps())
+
+    async def scan_for_tag(self, timeout: float = None) -> NFCTag | None:
+        """Scan for a tag, sleeping between polls as the reader's scheduler says
+
+        Returns None if no tag showed up within `timeout` seconds.
+        """
+
+        rdr = self.rdr
+        log.info("[--] Scanning for tag...")
+
+        rdr.stop_crypto1()
+        scheduler = rdr.scheduler
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            tag = await self.get_tag()
+            if tag is not None:
+                scheduler.found()
+                return tag
+            scheduler.missed()
+            left_ms = None
+            if deadline is not None:
+                left_ms = (deadline - time.monotonic()) * 1000
+                if left_ms <= 0:
+                    return None
+            for seconds in scheduler._waits((rdr,), left_ms):
+                await asyncio.sleep(seconds)
+
+
+class AsyncNFCTag():
+    """Async wrapper around an NFCTag"""
+
+    def __init__(self, tag: NFCTag):
+        self.tag = tag
+
+    async def read_blocks(self, addresses=None, key=None) -> list:
+        if addresses is None:
+            addresses = range(self.tag.BLOCK_COUNT)
+        return await run_steps(self.tag._read_blocks_steps(addresses, key=key))
+
+    async def data_write(self, data, *, blocks=None, key=None, only_changed=True) -> bool:
+        """Write to the data blocks, see NFCTag.data_write"""
+        return await run_steps(self.tag._data_write_steps(data, blocks=blocks, key=key,
+                                                          only_changed=only_changed))
+
+    async def apply_deltas(self, deltas: dict, *, key=None) -> bool:
+        """Add deltas to value blocks on the card, see NFCTag.apply_deltas"""
+        return await run_steps(self.tag._apply_deltas_steps(deltas, key=key))
+
+
+class AsyncNDEFTag():
+    """Async wrapper around an NDEFTag"""
+
+    def __init__(self, tag):
+        # An NFCTag, or an NDEFTag (e.g. a Type2NDEFTag) to wrap as is
+        self.ndef = tag if isinstance(tag, NDEFTag) else NDEFTag(tag)
+
+    async def read_messages(self, key=NDEFTag.KEYA1) -> list[NDEFMessage]:
+        return await run_steps(self.ndef._read_messages_steps(key))
+
+    async def write_messages(self, messages: list[NDEFMessage], key=NDEFTag.KEYA1) -> bool:
+        return await run_steps(self.ndef._write_steps(memoryview(self.ndef.encode_messages(messages)), key))
@@ -7,11 +7,59 @@ LICENCE: MIT
 Modified by: https://github.com/rafaelurben/
 """
 
+import time
+
+from nfc_log import Metrics
+
 # 3rd party
-import busio
-import digitalio
-from adafruit_bus_device.spi_device import SPIDevice
-from microcontroller import Pin
+try:
+	import busio
+	import digitalio
+	from adafruit_bus_device.spi_device import SPIDevice
+	from microcontroller import Pin
+except ImportError:
+	# Not running on CircuitPython (e.g. with nfc_sim), pass ``spi_device`` instead
+	busio = digitalio = SPIDevice = None
+	Pin = object
+
+
+def hard_reset(rst):
+	"""Pulse the RST pin of RC522 boards, return the DigitalInOut driving it
+
+	Pass the result as ``rst`` to every reader wired to the same line, the
+	readers don't pulse a DigitalInOut they are given.
+	"""
+
+	if not hasattr(rst, "value"):
+		rst = digitalio.DigitalInOut(rst)
+		rst.switch_to_output()
+	rst.value = 0
+	rst.value = 1
+	return rst
+
+
+def _crc_a_table() -> tuple:
+	table = []
+	for i in range(256):
+		crc = i
+		for _ in range(8):
+			crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+		table.append(crc)
+	return tuple(table)
+
+
+# CRC_A: x^16 + x^12 + x^5 + 1, reflected (0x8408), preset 0x6363
+_CRC_A_TABLE = _crc_a_table()
+
+
+def crc_a(data) -> list:
+	"[ISO/IEC 14443-A] CRC_A of data, computed on the host (2 bytes, LSB first)"
+
+	crc = 0x6363
+	table = _CRC_A_TABLE
+	for b in data:
+		crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+	return [crc & 0xFF, crc >> 8]
 
 
 class MFRC522:
@@ -21,8 +69,18 @@ class MFRC522:
 	:param sck: The SPI Clock Pin. Typically ``board.SCK``.
 	:param mosi: The SPI MOSI Pin. Typically ``board.MOSI``.
 	:param miso: The SPI MISO Pin. Typically ``board.MISO``.
-	:param rst: The pin connected to the RST terminal on the RC522 board.
+	:param rst: The pin connected to the RST terminal on the RC522 board, pulsed once.
+		A ``digitalio.DigitalInOut`` is taken as already reset by its owner, see ``hard_reset``.
 	:param cs: The SPI chip select pin, connected to the SDA terminal on the RC522 board.
+	:param irq: Optional pin connected to the IRQ terminal. Command completion is then
+		detected on the pin instead of by polling ComIrqReg over SPI. An object with a
+		``value`` attribute (like ``digitalio.DigitalInOut``) is used as is.
+	:param spi_device: Use this SPIDevice-compatible object instead of creating one from
+		the pins, e.g. a ``nfc_sim.SimulatedMFRC522``.
+	:param timeout_ms: Host-side limit for waiting on a command, in milliseconds.
+	:param response_timeout_ms: Time the card gets to answer before the RC522 timer
+		reports "no tag", in milliseconds (0.5 ms resolution).
+	:param hw_crc: Let the RC522 coprocessor calculate CRC_A instead of the host.
 	"""
 
 	OK = "ok"
@@ -30,43 +88,149 @@ class MFRC522:
 	ERR_INVALOP = "invalid operation"
 	ERR_TIMEOUT = "timeout"
 	ERR = "unknown error"
+	ERR_COLLISION = "collision"
+
+	FIFO_SIZE = 64
+	MAX_BURST_REGS = 16
+
+	# ErrorReg, FIFOLevelReg, ControlReg: read together after a command finished
+	_STATUS_REGS = (0x06, 0x0A, 0x0C)
 
 	REQIDL = 0x26
 	REQALL = 0x52
 	AUTHENT1A = 0x60
 	AUTHENT1B = 0x61
 
-	def __init__(self, sck: Pin, mosi: Pin, miso: Pin, rst: Pin, cs: Pin):
-
-		self.cs = digitalio.DigitalInOut(cs)
-
-		self.rst = digitalio.DigitalInOut(rst)
-		self.rst.switch_to_output()
-
-		self.rst.value = 0
-		self.rst.value = 1
-
-		self.spi = busio.SPI(sck, MOSI=mosi, MISO=miso)
-		self.spi_device = SPIDevice(self.spi, self.cs)
+	# Mifare Classic value block commands
+	DECREMENT = 0xC0
+	INCREMENT = 0xC1
+	RESTORE = 0xC2
+	TRANSFER = 0xB0
+
+	def __init__(self, sck: Pin = None, mosi: Pin = None, miso: Pin = None, rst: Pin = None, cs: Pin = None,
+				 irq: Pin = None, *, spi=None, spi_device=None, timeout_ms: int = 50, response_timeout_ms: float = 15,
+				 hw_crc: bool = False, metrics: Metrics = None):
+
+		self.timeout_ms = timeout_ms
+		self.metrics = metrics if metrics is not None else Metrics()
+		self.hw_crc = hw_crc
+		self.response_timeout_ms = response_timeout_ms
+
+		self.irq = irq
+		if irq is not None and not hasattr(irq, "value"):
+			self.irq = digitalio.DigitalInOut(irq)
+			self.irq.switch_to_input()
+
+		if spi_device is None:
+			self.cs = cs if hasattr(cs, "value") else digitalio.DigitalInOut(cs)
+
+		self.rst = None
+		if rst is not None:
+			# An existing DigitalInOut belongs to the caller, e.g. shared by several readers
+			self.rst = rst if hasattr(rst, "value") else hard_reset(rst)
+
+		if spi_device is None:
+			# Readers sharing a bus pass the same ``spi``, each with its own ``cs``
+			self.spi = spi if spi is not None else busio.SPI(sck, MOSI=mosi, MISO=miso)
+			spi_device = SPIDevice(self.spi, self.cs)
+		self.spi_device = spi_device
+
+		# Preallocated SPI buffers, register access must not allocate
+		self._reg_out = bytearray(2)
+		self._reg_in = bytearray(2)
+		self._regs_out = bytearray(self.MAX_BURST_REGS + 1)
+		self._regs_in = bytearray(self.MAX_BURST_REGS + 1)
+		self._status = bytearray(len(self._STATUS_REGS))
+		self._crc_result = bytearray(2)
+
+		# Burst buffers for FIFODataReg: address byte + up to FIFO_SIZE data bytes.
+		# Reads clock out the FIFO read address once per byte.
+		self._fifo_wbuf = bytearray(self.FIFO_SIZE + 1)
+		self._fifo_wbuf[0] = (0x09 << 1) & 0x7e
+		self._fifo_rout = bytearray([((0x09 << 1) & 0x7e) | 0x80] * (self.FIFO_SIZE + 1))
+		self._fifo_rin = bytearray(self.FIFO_SIZE + 1)
+
+		# Bumped whenever the Crypto1 session may have changed (reset, REQA/WUPA,
+		# select, auth, stop_crypto1), so cached authentications can be invalidated.
+		self.auth_epoch = 0
+		# ATQA of the last REQA/WUPA answer (several tags answering OR their ATQAs)
+		self.atqa = None
 
 		self.init()
 
 	def _wreg(self, reg: int, val):
 		"Write a register"
 
+		buf = self._reg_out
+		buf[0] = (reg << 1) & 0x7e
+		buf[1] = val & 0xff
 		with self.spi_device as bus_device:
-			bus_device.write(b'%c' % int(0xff & ((reg << 1) & 0x7e)))
-			bus_device.write(b'%c' % int(0xff & val))
+			bus_device.write(buf)
 
 	def _rreg(self, reg: int):
 		"Read a register"
 
+		buf = self._reg_out
+		buf[0] = ((reg << 1) & 0x7e) | 0x80
+		buf[1] = 0x00
+		with self.spi_device as bus_device:
+			bus_device.write_readinto(buf, self._reg_in)
+
+		return self._reg_in[1]
+
+	def _wregs(self, pairs):
+		"Write several (register, value) pairs"
+
+		# Data bytes after the address all go to the same register, so every
+		# register needs its own transaction; they just share the buffers.
+		for reg, val in pairs:
+			self._wreg(reg, val)
+
+	def _rregs(self, regs, into: bytearray) -> bytearray:
+		"Read several registers in a single SPI transaction into a preallocated buffer"
+
+		n = len(regs)
+		if n > self.MAX_BURST_REGS:
+			raise ValueError("Too many registers for one burst!")
+
+		out = self._regs_out
+		for i in range(n):
+			out[i] = ((regs[i] << 1) & 0x7e) | 0x80
+		out[n] = 0x00
+
+		buf = self._regs_in
+		with self.spi_device as bus_device:
+			bus_device.write_readinto(out, buf, out_end=n + 1, in_end=n + 1)
+
+		for i in range(n):
+			into[i] = buf[i + 1]
+		return into
+
+	def _wfifo(self, data):
+		"Write data to the FIFO in a single SPI transaction"
+
+		n = len(data)
+		if n > self.FIFO_SIZE:
+			raise ValueError("Data does not fit into the FIFO!")
+
+		buf = self._fifo_wbuf
+		for i in range(n):
+			buf[i + 1] = data[i]
+
+		with self.spi_device as bus_device:
+			bus_device.write(buf, end=n + 1)
+
+	def _rfifo(self, n: int) -> list:
+		"Read n bytes from the FIFO in a single SPI transaction"
+
+		out = self._fifo_rout
+		# Every byte clocks in the value addressed by the previous one, 0x00 ends the read
+		out[n] = 0x00
 		with self.spi_device as bus_device:
-			bus_device.write(b'%c' % int(0xff & (((reg << 1) & 0x7e) | 0x80)))
-			val = bytearray(1)
-			bus_device.readinto(val)
+			bus_device.write_readinto(out, self._fifo_rin, out_end=n + 1, in_end=n + 1)
+		out[n] = out[0]
 
-		return val[0]
+		return list(self._fifo_rin[1:n + 1])
 
 	def _sflags(self, reg: int, mask: int):
 		"Set register flags."
@@ -78,11 +242,65 @@ class MFRC522:
 
 		self._wreg(reg, self._rreg(reg) & (~mask))
 
+	def _poll_irq(self, mask: int, deadline: int) -> int | None:
+		"""
+		Non-blocking check on the running command.
+
+		:return: The ComIrqReg value once one of the ``mask`` bits is set,
+		  0 while still waiting, or None if ``deadline`` passed.
+		"""
+
+		if self.irq is not None:
+			if not self.irq.value:
+				return self._rreg(0x04)
+		else:
+			n = self._rreg(0x04)
+			if n & mask:
+				return n
+		if time.monotonic_ns() > deadline:
+			return None
+		return 0
+
 	def _tocard(self, cmd: int, send):
+		return self._run(self._tocard_steps(cmd, send))
 
-		recv = []
-		bits = irq_en = wait_irq = 0
-		stat = self.ERR
+	def _tocard_steps(self, cmd: int, send):
+		"""
+		Generator version of ``_tocard``: yields while the command is in flight,
+		so the caller can drive other readers or tasks meanwhile.
+
+		:return: (stat, recv, bits) as the generator's return value
+		"""
+
+		start = time.monotonic_ns()
+		(irq_en, wait_irq) = self._tocard_start(cmd, send)
+		# Done when the command completed or the RC522 timer ran out (TimerIRq)
+		deadline = start + self.timeout_ms * 1000000
+		n = self._poll_irq(wait_irq | 0x01, deadline)
+		while n == 0:
+			yield
+			n = self._poll_irq(wait_irq | 0x01, deadline)
+		result = self._tocard_finish(cmd, n, irq_en, wait_irq)
+
+		metrics = self.metrics
+		metrics.timed("auths" if cmd == 0x0E else "transceives", start)
+		if result[0] not in (self.OK, self.ERR_NOTAG, self.ERR_COLLISION):
+			metrics.count("errors")
+		return result
+
+	def _run(self, steps):
+		"""Drive a ``*_steps`` generator to completion, return its value"""
+
+		try:
+			while True:
+				next(steps)
+		except StopIteration as e:
+			return e.value
+
+	def _tocard_start(self, cmd: int, send) -> tuple:
+		"""Load the FIFO and start a command, returns its (irq_en, wait_irq) masks"""
+
+		irq_en = wait_irq = 0
 
 		if cmd == 0x0E:
 			irq_en = 0x12
@@ -91,38 +309,48 @@ class MFRC522:
 			irq_en = 0x77
 			wait_irq = 0x30
 
-		self._wreg(0x02, irq_en | 0x80)
-		self._cflags(0x04, 0x80)
-		self._sflags(0x0A, 0x80)
+		if self.irq is not None:
+			# Only let completion and the timer drive the IRQ pin (active low)
+			self._wreg(0x02, wait_irq | 0x01 | 0x80)
+		else:
+			self._wreg(0x02, irq_en | 0x80)
+		self._wreg(0x04, 0x7F)  # clear all interrupt request bits
+		self._wreg(0x0A, 0x80)  # flush the FIFO
 		self._wreg(0x01, 0x00)
 
-		for c in send:
-			self._wreg(0x09, c)
+		self._wfifo(send)
 		self._wreg(0x01, cmd)
 
 		if cmd == 0x0C:
 			self._sflags(0x0D, 0x80)
 
-		i = 2000
-		while True:
-			n = self._rreg(0x04)
-			i -= 1
-			if ~((i != 0) and ~(n & 0x01) and ~(n & wait_irq)):
-				break
+		return irq_en, wait_irq
+
+	def _tocard_finish(self, cmd: int, n: int | None, irq_en: int, wait_irq: int):
+		"""Collect the result of a command given its final ComIrqReg value ``n``"""
+
+		recv = []
+		bits = 0
+		stat = self.ERR
 
 		self._cflags(0x0D, 0x80)
 
-		if i == 0:
+		if n is None:
+			self._wreg(0x01, 0x00)  # abort the command
 			stat = self.ERR_TIMEOUT
+		elif not n & wait_irq:
+			stat = self.ERR_NOTAG if cmd == 0x0C else self.ERR_TIMEOUT
 		else:
-			if (self._rreg(0x06) & 0x1B) == 0x00:
-				stat = self.OK
+			status = self._rregs(self._STATUS_REGS, self._status)
+			if (status[0] & 0x13) == 0x00:
+				# Colliding answers still land in the FIFO, anticollision needs them
+				stat = self.ERR_COLLISION if status[0] & 0x08 else self.OK
 
 				if n & irq_en & 0x01:
 					stat = self.ERR_NOTAG
 				elif cmd == 0x0C:
-					n = self._rreg(0x0A)
-					lbits = self._rreg(0x0C) & 0x07
+					n = status[1]
+					lbits = status[2] & 0x07
 					if lbits != 0:
 						bits = (n - 1) * 8 + lbits
 					else:
@@ -130,11 +358,10 @@ class MFRC522:
 
 					if n == 0:
 						n = 1
-					elif n > 16:
-						n = 16
+					elif n > self.FIFO_SIZE:
+						n = self.FIFO_SIZE
 
-					for _ in range(n):
-						recv.append(self._rreg(0x09))
+					recv = self._rfifo(n)
 
 				if recv == [0x04]:
 					stat = self.ERR_INVALOP
@@ -146,61 +373,96 @@ class MFRC522:
 	def _crc(self, data):
 		"Returns Cyclic Redundancy Check (2 bytes)"
 
-		self._cflags(0x05, 0x04)
-		self._sflags(0x0A, 0x80)
+		if self.hw_crc:
+			return self._crc_hw(data)
+		return crc_a(data)
 
-		for c in data:
-			self._wreg(0x09, c)
+	def _crc_hw(self, data):
+		"Returns Cyclic Redundancy Check (2 bytes), calculated by the RC522"
+
+		self._wreg(0x05, 0x04)  # clear CRCIRq
+		self._wreg(0x0A, 0x80)
+
+		self._wfifo(data)
 
 		self._wreg(0x01, 0x03)
 
-		i = 0xFF
-		while True:
-			n = self._rreg(0x05)
-			i -= 1
-			if not ((i != 0) and not (n & 0x04)):
+		# The coprocessor needs microseconds, less than one SPI round trip, so
+		# polling DivIrqReg beats reconfiguring the IRQ pin for it.
+		deadline = time.monotonic_ns() + self.timeout_ms * 1000000
+		while not self._rreg(0x05) & 0x04:
+			if time.monotonic_ns() > deadline:
 				break
 
-		return [self._rreg(0x22), self._rreg(0x21)]
+		# CRCResultRegL, CRCResultRegH
+		return list(self._rregs((0x22, 0x21), self._crc_result))
 
 	def init(self):
 
 		self.reset()
-		self._wreg(0x2A, 0x8D)
-		self._wreg(0x2B, 0x3E)
-		self._wreg(0x2D, 30)
-		self._wreg(0x2C, 0)
-		self._wreg(0x15, 0x40)
-		self._wreg(0x11, 0x3D)
+		self._wregs((
+			(0x2A, 0x8D),
+			(0x2B, 0x3E),
+			(0x15, 0x40),
+			(0x11, 0x3D),
+			(0x03, 0x80),  # IRQ pin as push-pull output
+		))
+		self.set_response_timeout(self.response_timeout_ms)
 		self.antenna_on()
 
+	def set_response_timeout(self, ms: float):
+		"""
+		Set how long the RC522 timer waits for an answer from the card.
+
+		With TPrescaler = 0xD3E (set in ``init``) the timer ticks every 0.5 ms.
+
+		:param ms: Timeout in milliseconds (0.5 - 32767).
+		"""
+
+		reload = max(1, min(0xFFFF, int(ms * 2)))
+		self.response_timeout_ms = ms
+		self._wreg(0x2C, reload >> 8)
+		self._wreg(0x2D, reload & 0xFF)
+
 	def reset(self):
+		self.auth_epoch += 1
 		self._wreg(0x01, 0x0F)
 
 	def antenna_on(self, on=True):
 
-		if on and ~(self._rreg(0x14) & 0x03):
-			self._sflags(0x14, 0x03)
-		else:
+		if not on:
+			# Cards in the field lose power, and with it their Crypto1 session
+			self.auth_epoch += 1
 			self._cflags(0x14, 0x03)
+		elif not self._rreg(0x14) & 0x03:
+			self._sflags(0x14, 0x03)
 
 	def request(self, mode):
 		"[ISO/IEC 14443] REQA (Request: 0x26) or WUPA (Wake-up: 0x52)"
+		return self._run(self._request_steps(mode))
 
+	def _request_steps(self, mode):
+		self.auth_epoch += 1
 		self._wreg(0x0D, 0x07)
-		(stat, recv, bits) = self._tocard(0x0C, [mode])
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, [mode])
+		if stat == self.ERR_COLLISION:
+			stat = self.OK  # several tags answered
 		if (stat != self.OK) | (bits != 0x10):
 			stat = self.ERR
+		else:
+			self.atqa = recv[0] | (recv[1] << 8)
 		return stat, bits
 
 	def anticoll(self):
 		"[ISO/IEC 14443] Anticollision CL1"
+		return self._run(self._anticoll_steps())
 
+	def _anticoll_steps(self):
 		ser_chk = 0
 		ser = [0x93, 0x20]
 
 		self._wreg(0x0D, 0x00)
-		(stat, recv, bits) = self._tocard(0x0C, ser)
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, ser)
 
 		if stat == self.OK:
 			if len(recv) == 5:
@@ -214,34 +476,178 @@ class MFRC522:
 
 	def select_tag(self, ser):
 		"[ISO/IEC 14443] Select CL1"
+		return self._run(self._select_tag_steps(ser))
 
+	def _select_tag_steps(self, ser):
+		self.auth_epoch += 1
+		self._wreg(0x0D, 0x00)  # full bytes, request() leaves TxLastBits at 7
 		buf = [0x93, 0x70] + ser[:5]
 		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
 		return self.OK if (stat == self.OK) and (bits == 0x18) else self.ERR
 
+	@staticmethod
+	def bcc(data) -> int:
+		"UID check byte: XOR of the bytes"
+
+		bcc = 0
+		for b in data:
+			bcc ^= b
+		return bcc
+
+	@staticmethod
+	def _cascade_levels(uid) -> list:
+		"UID bytes sent at each cascade level, with the cascade tag (0x88) for incomplete levels"
+
+		if len(uid) == 4:
+			return [list(uid)]
+		elif len(uid) == 7:
+			return [[0x88] + list(uid[:3]), list(uid[3:])]
+		elif len(uid) == 10:
+			return [[0x88] + list(uid[:3]), [0x88] + list(uid[3:6]), list(uid[6:])]
+		raise ValueError("UID must be 4, 7 or 10 bytes long!")
+
+	def select(self, uid=None):
+		"""
+		[ISO/IEC 14443] Anticollision and select over all cascade levels (CL1-CL3).
+
+		:param uid: UID (4, 7 or 10 bytes) of the tag to select, or None to
+		  resolve one of the tags in the field bit by bit.
+		:return: (stat, uid, sak)
+		"""
+		return self._run(self._select_steps(uid))
+
+	def _select_steps(self, uid=None):
+		self.auth_epoch += 1
+		levels = self._cascade_levels(uid) if uid is not None else None
+		result = []
+
+		for level, sel in enumerate((0x93, 0x95, 0x97)):
+			if levels is not None:
+				if level >= len(levels):
+					break
+				cl = levels[level] + [self.bcc(levels[level])]
+			else:
+				(stat, cl) = yield from self._anticoll_level_steps(sel)
+				if stat != self.OK:
+					return stat, None, None
+
+			self._wreg(0x0D, 0x00)
+			buf = [sel, 0x70] + cl
+			buf += self._crc(buf)
+			(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
+			if (stat != self.OK) or (bits != 0x18):
+				return self.ERR, None, None
+
+			sak = recv[0]
+			if not sak & 0x04:
+				return self.OK, result + cl[:4], sak
+			# Cascade bit set: the UID continues on the next level
+			result += cl[1:4]
+
+		return self.ERR, None, None
+
+	def _anticoll_level_steps(self, sel):
+		"""
+		Bit-level anticollision loop of one cascade level.
+
+		On a collision the known UID bits are extended up to the collided bit,
+		which is taken as 1, and the loop continues with the tags matching them.
+
+		:return: (stat, 5 CLn bytes including the BCC)
+		"""
+
+		cl = [0] * 5
+		known = 0
+		for _ in range(33):
+			nbytes = known // 8
+			nbits = known % 8
+			self._wreg(0x0D, (nbits << 4) | nbits)  # RxAlign, TxLastBits
+			send = [sel, ((2 + nbytes) << 4) | nbits] + cl[:nbytes + (1 if nbits else 0)]
+			(stat, recv, bits) = yield from self._tocard_steps(0x0C, send)
+			if stat != self.OK and stat != self.ERR_COLLISION:
+				return stat, None
+
+			# The first byte received completes the partial byte sent last
+			mask = (1 << nbits) - 1
+			for i in range(min(len(recv), 5 - nbytes)):
+				if i == 0:
+					cl[nbytes] = (cl[nbytes] & mask) | (recv[0] & ~mask & 0xFF)
+				else:
+					cl[nbytes + i] = recv[i]
+
+			if stat == self.OK:
+				break
+
+			coll = self._rreg(0x0E)
+			if coll & 0x20:
+				return self.ERR, None  # collision position not valid
+			bit = nbytes * 8 + (coll & 0x1F or 32) - 1
+			if bit < known or bit >= 40:
+				return self.ERR, None
+			cl[bit // 8] |= 1 << (bit % 8)
+			known = bit + 1
+		else:
+			return self.ERR, None
+
+		if self.bcc(cl[:4]) != cl[4]:
+			return self.ERR, None
+		return self.OK, cl
+
+	def halt(self):
+		"[ISO/IEC 14443] HLTA, puts the selected tag into HALT state"
+		return self._run(self._halt_steps())
+
+	def _halt_steps(self):
+		self.auth_epoch += 1
+		self._wreg(0x0D, 0x00)
+		buf = [0x50, 0x00]
+		buf += self._crc(buf)
+
+		# Tags never acknowledge a HLTA, don't wait the full response timeout
+		timeout = self.response_timeout_ms
+		self.set_response_timeout(1)
+		try:
+			(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
+		finally:
+			self.set_response_timeout(timeout)
+
+		return self.OK if stat == self.ERR_NOTAG else self.ERR
+
 	def auth(self, mode, addr, sect, ser):
 		"Authenticate using key A (0x60) or B (0x61)"
+		return self._run(self._auth_steps(mode, addr, sect, ser))
 
-		return self._tocard(0x0E, [mode, addr] + sect + ser[:4])[0]
+	def _auth_steps(self, mode, addr, sect, ser):
+		self.auth_epoch += 1
+		return (yield from self._tocard_steps(0x0E, [mode, addr] + sect + ser[:4]))[0]
 
 	def stop_crypto1(self):
+		self.auth_epoch += 1
 		self._cflags(0x08, 0x08)
 
 	def mifare_read(self, addr):
 		"[MIFARE] Read"
+		return self._run(self._mifare_read_steps(addr))
 
+	def _mifare_read_steps(self, addr):
+		start = time.monotonic_ns()
 		data = [0x30, addr]
 		data += self._crc(data)
-		(stat, recv, _) = self._tocard(0x0C, data)
-		return stat, recv
+		(stat, recv, _) = yield from self._tocard_steps(0x0C, data)
+		self.metrics.timed("reads", start)
+		# 16 data bytes followed by the CRC_A
+		return stat, recv[:16]
 
 	def mifare_write(self, addr, data):
 		"[MIFARE] Write"
+		return self._run(self._mifare_write_steps(addr, data))
 
+	def _mifare_write_steps(self, addr, data):
+		start = time.monotonic_ns()
 		buf = [0xA0, addr]
 		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
 
 		if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
 			stat = self.ERR
@@ -250,12 +656,112 @@ class MFRC522:
 			for i in range(16):
 				buf.append(data[i])
 			buf += self._crc(buf)
-			(stat, recv, bits) = self._tocard(0x0C, buf)
+			(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
 			if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
 				stat = self.ERR
 
+		self.metrics.timed("writes", start)
 		return stat
 
+	def mifare_increment(self, addr, delta):
+		"[MIFARE] Add delta to value block addr, the result goes to the transfer buffer"
+		return self._run(self._mifare_value_steps(self.INCREMENT, addr, delta))
+
+	def mifare_decrement(self, addr, delta):
+		"[MIFARE] Subtract delta from value block addr, the result goes to the transfer buffer"
+		return self._run(self._mifare_value_steps(self.DECREMENT, addr, delta))
+
+	def mifare_restore(self, addr):
+		"[MIFARE] Copy value block addr to the transfer buffer"
+		return self._run(self._mifare_value_steps(self.RESTORE, addr, 0))
+
+	def _mifare_value_steps(self, cmd, addr, operand):
+		start = time.monotonic_ns()
+		buf = [cmd, addr]
+		buf += self._crc(buf)
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
+
+		if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
+			stat = self.ERR if stat == self.OK else stat
+		else:
+			buf = [operand & 0xFF, (operand >> 8) & 0xFF, (operand >> 16) & 0xFF, (operand >> 24) & 0xFF]
+			buf += self._crc(buf)
+			# The card only answers the operand with a NAK, silence means success.
+			# A NAK missed by the short timeout still fails the TRANSFER after it.
+			timeout = self.response_timeout_ms
+			self.set_response_timeout(1)
+			try:
+				(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
+			finally:
+				# Also when the steps are closed early, e.g. a cancelled asyncio task
+				self.set_response_timeout(timeout)
+			stat = self.OK if stat == self.ERR_NOTAG else self.ERR
+
+		self.metrics.timed("values", start)
+		return stat
+
+	def mifare_transfer(self, addr):
+		"[MIFARE] Write the transfer buffer to value block addr"
+		return self._run(self._mifare_transfer_steps(addr))
+
+	def _mifare_transfer_steps(self, addr):
+		start = time.monotonic_ns()
+		buf = [self.TRANSFER, addr]
+		buf += self._crc(buf)
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
+		if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
+			stat = self.ERR if stat == self.OK else stat
+		self.metrics.timed("writes", start)
+		return stat
+
+	def mifare_ul_write(self, page, data):
+		"[MIFARE Ultralight / NTAG] Write one 4-byte page"
+		return self._run(self._mifare_ul_write_steps(page, data))
+
+	def _mifare_ul_write_steps(self, page, data):
+		start = time.monotonic_ns()
+		buf = [0xA2, page, data[0], data[1], data[2], data[3]]
+		buf += self._crc(buf)
+		(stat, recv, bits) = yield from self._tocard_steps(0x0C, buf)
+		if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
+			stat = self.ERR if stat == self.OK else stat
+		self.metrics.timed("writes", start)
+		return stat
+
+	def ntag_fast_read(self, start_page, end_page):
+		"""
+		[NTAG] FAST_READ pages ``start_page`` to ``end_page`` (inclusive).
+
+		The answer has to fit the FIFO with its CRC: at most 15 pages per call.
+		"""
+		return self._run(self._ntag_fast_read_steps(start_page, end_page))
+
+	def _ntag_fast_read_steps(self, start_page, end_page):
+		n = (end_page - start_page + 1) * 4
+		if n <= 0 or n + 2 > self.FIFO_SIZE:
+			raise ValueError("FAST_READ of 1 to 15 pages only!")
+
+		start = time.monotonic_ns()
+		buf = [0x3A, start_page, end_page]
+		buf += self._crc(buf)
+		(stat, recv, _) = yield from self._tocard_steps(0x0C, buf)
+		self.metrics.timed("reads", start)
+		if stat == self.OK and len(recv) < n:
+			stat = self.ERR
+		return stat, recv[:n]
+
+	def ntag_get_version(self):
+		"[NTAG] GET_VERSION, returns (stat, 8 version bytes)"
+		return self._run(self._ntag_get_version_steps())
+
+	def _ntag_get_version_steps(self):
+		buf = [0x60]
+		buf += self._crc(buf)
+		(stat, recv, _) = yield from self._tocard_steps(0x0C, buf)
+		if stat == self.OK and len(recv) < 8:
+			stat = self.ERR
+		return stat, recv[:8]
+
 	def set_antenna_gain(self, gain: int):
 		"""
 		Set the MFRC522 Receiver Gain
@@ -0,0 +1,126 @@
+"""
+Logging and performance counters for the reader, tag and NDEF code
+"""
+
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+
+def _print_sink(level: int, message: str) -> None:
+    print(message)
+
+
+class Logger():
+    """Leveled logger writing to a pluggable sink(level, message)
+
+    Messages below `level` are dropped before they are joined. Callers that
+    format expensive messages check `enabled(level)` first, so a disabled
+    level costs one comparison.
+    """
+
+    def __init__(self, level: int = INFO, sink=None):
+        self.level = level
+        self.sink = sink if sink is not None else _print_sink
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, *args) -> None:
+        if level >= self.level:
+            self.sink(level, " ".join(str(a) for a in args))
+
+    def debug(self, *args) -> None:
+        self.log(DEBUG, *args)
+
+    def info(self, *args) -> None:
+        self.log(INFO, *args)
+
+    def warning(self, *args) -> None:
+        self.log(WARNING, *args)
+
+    def error(self, *args) -> None:
+        self.log(ERROR, *args)
+
+
+# Shared by all modules, set `log.level` or `log.sink` to configure
+log = Logger()
+
+
+class Histogram():
+    """Fixed-bucket histogram of durations in microseconds"""
+
+    BOUNDS_US = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+    def __init__(self, bounds_us=BOUNDS_US):
+        self.bounds_us = bounds_us
+        # One bucket per upper bound, plus one for everything above
+        self.buckets = [0] * (len(bounds_us) + 1)
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def add(self, us: int) -> None:
+        bounds = self.bounds_us
+        i = 0
+        while i < len(bounds) and us > bounds[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_us": self.total_us,
+            "max_us": self.max_us,
+            "bounds_us": list(self.bounds_us),
+            "buckets": list(self.buckets),
+        }
+
+
+class Metrics():
+    """Counters and timing histograms of one reader
+
+    Counters: auths, reads, writes, values (increment/decrement/restore) and
+    transceives (RC522 commands), errors (commands that failed other than by
+    the card not answering), polls and tags (found). Auths, reads, writes,
+    values and transceives are also timed.
+    """
+
+    COUNTERS = ("auths", "reads", "writes", "values", "transceives", "errors", "polls", "tags")
+
+    def __init__(self, bounds_us=Histogram.BOUNDS_US):
+        self.bounds_us = bounds_us
+        self.reset()
+
+    def reset(self) -> None:
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.timings = {}
+        self.since = time.monotonic()
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name: str, start_ns: int) -> None:
+        """Count an operation that started at time.monotonic_ns() `start_ns`"""
+
+        self.counters[name] = self.counters.get(name, 0) + 1
+        hist = self.timings.get(name)
+        if hist is None:
+            hist = self.timings[name] = Histogram(self.bounds_us)
+        hist.add((time.monotonic_ns() - start_ns) // 1000)
+
+    def snapshot(self) -> dict:
+        """Counters and timings as plain dicts, e.g. for json.dumps"""
+        return {
+            "seconds": time.monotonic() - self.since,
+            "counters": dict(self.counters),
+            "timings": {name: hist.to_dict() for name, hist in self.timings.items()},
+        }
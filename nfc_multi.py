@@ -0,0 +1,80 @@
+"""
+Several MFRC522 readers polled together, e.g. antennas sharing one SPI bus
+"""
+
+import time
+
+from nfc_driver import hard_reset
+from nfc_log import log
+from nfc_tools import NFCReader, PollScheduler
+
+
+class ReaderGroup():
+    """Polls several readers in an interleaved round-robin
+
+    A poll starts the REQA/anticollision/select sequence on every reader and
+    keeps advancing the readers in turn. While one reader waits for its card
+    to answer, the bus serves the others, so the RF waits overlap.
+    """
+
+    def __init__(self, readers: list, scheduler: PollScheduler = None):
+        self.readers = list(readers)
+        self.scheduler = scheduler if scheduler is not None else PollScheduler()
+
+    def poll(self) -> list:
+        """Poll every reader once, returns (reader, NFCTag) events in reader order"""
+
+        steps = [rdr._get_tag_steps() for rdr in self.readers]
+        tags = [None] * len(steps)
+        pending = len(steps)
+        while pending:
+            for i, step in enumerate(steps):
+                if step is None:
+                    continue
+                try:
+                    next(step)
+                except StopIteration as e:
+                    tags[i] = e.value
+                    steps[i] = None
+                    pending -= 1
+
+        return [(rdr, tag) for rdr, tag in zip(self.readers, tags) if tag is not None]
+
+    def scan(self, timeout: float = None) -> list:
+        """Poll until a reader finds a tag, returns the events of that poll
+
+        Polls are spaced by the group's scheduler. Returns an empty list if no
+        tag showed up within `timeout` seconds.
+        """
+
+        log.info("[--] Scanning for tags on", len(self.readers), "readers...")
+
+        for rdr in self.readers:
+            rdr.stop_crypto1()
+        scheduler = self.scheduler
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            events = self.poll()
+            if events:
+                scheduler.found()
+                return events
+            scheduler.missed()
+            left_ms = None
+            if deadline is not None:
+                left_ms = (deadline - time.monotonic()) * 1000
+                if left_ms <= 0:
+                    return []
+            scheduler.wait(*self.readers, max_ms=left_ms)
+
+
+def shared_bus_readers(spi, chip_selects: list, irqs: list = None, rst=None, **kwargs) -> list:
+    """Create one NFCReader per chip select pin on an existing busio.SPI
+
+    A shared `rst` line is pulsed once, before the first reader initializes.
+    """
+
+    irqs = irqs if irqs is not None else [None] * len(chip_selects)
+    if rst is not None:
+        rst = hard_reset(rst)
+    return [NFCReader(spi=spi, cs=cs, irq=irq, rst=rst, **kwargs) for cs, irq in zip(chip_selects, irqs)]
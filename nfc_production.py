@@ -0,0 +1,280 @@
+"""
+Production encoding: one NDEF payload per card, verified, with statistics
+"""
+
+import os
+import time
+
+from nfc_log import log, Histogram
+from nfc_tools import NFCReader, NFCTag, NFCException, NFCWritingException
+from nfc_type2 import Type2Tag, Type2NDEFTag
+from ndef import NDEFMessage, NDEFRecord, NDEFTag
+
+
+class PayloadQueue():
+    """Payloads to encode, one per card, in order
+
+    `template` is a str.format template with the fields `serial` (the
+    running number) and `uid` (the card's UID in hex), e.g.
+    "https://example.com/t/{serial:06d}", or a list of such templates and
+    NDEFMessages to encode one after another. Templates become URI records,
+    pass `record` (e.g. NDEFRecord.create_text) for other record types.
+    """
+
+    def __init__(self, template, start: int = 1, count: int = None, record=NDEFRecord.create_uri):
+        self.template = template
+        self.start = start
+        if isinstance(template, (list, tuple)):
+            count = len(template) if count is None else min(count, len(template))
+        self.count = count
+        self.record = record
+        # Payloads encoded so far
+        self.position = 0
+
+    @property
+    def serial(self) -> int:
+        return self.start + self.position
+
+    def remaining(self) -> int | None:
+        """Payloads left, None for an endless template"""
+        return None if self.count is None else max(0, self.count - self.position)
+
+    def done(self) -> bool:
+        return self.count is not None and self.position >= self.count
+
+    def message(self, uid) -> NDEFMessage:
+        """The message for the next card"""
+
+        item = self.template
+        if isinstance(item, (list, tuple)):
+            item = item[self.position]
+        if isinstance(item, NDEFMessage):
+            return item
+        return NDEFMessage([self.record(item.format(serial=self.serial, uid=bytes(uid).hex()))])
+
+    def advance(self) -> None:
+        self.position += 1
+
+
+class EncodingProgress():
+    """UIDs of the encoded cards and the queue position, kept in a file
+
+    The file is append-only, one line "<position> <uid hex>" per card,
+    flushed right after the card is verified. A run started again picks up
+    where the last one stopped; a line cut short by a power loss is
+    ignored. On CircuitPython the filesystem has to be writable from code
+    (storage.remount in boot.py). Without a path nothing is persisted.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        # UID hex -> queue position it was encoded with
+        self.encoded = {}
+        # Queue position to continue with
+        self.position = 0
+        if path is not None:
+            self.load()
+
+    def __contains__(self, uid) -> bool:
+        return bytes(uid).hex() in self.encoded
+
+    def __len__(self) -> int:
+        return len(self.encoded)
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if not line.endswith("\n") or len(parts) != 2:
+                        continue
+                    try:
+                        position = int(parts[0])
+                        bytes.fromhex(parts[1])
+                    except ValueError:
+                        continue
+                    self.encoded[parts[1]] = position
+                    self.position = max(self.position, position + 1)
+        except OSError:
+            # Nothing encoded yet
+            pass
+
+    def record(self, uid, position: int) -> None:
+        uid = bytes(uid).hex()
+        self.encoded[uid] = position
+        self.position = max(self.position, position + 1)
+        if self.path is None:
+            return
+        with open(self.path, "a") as f:
+            f.write(f"{position} {uid}\n")
+            f.flush()
+        if hasattr(os, "sync"):
+            os.sync()
+
+
+class EncodingStats():
+    """Throughput, failures and per-stage latency of an encoding run
+
+    Results: encoded, skipped (already encoded) and failed cards. Stages:
+    detect (scan until a card answers), write, verify and removal; each
+    is timed. Write/verify count the attempts that failed there, removal
+    the cards still in the field after the removal timeout.
+    """
+
+    RESULTS = ("encoded", "skipped", "failed")
+    STAGES = ("detect", "write", "verify", "removal")
+    # Stages take milliseconds to seconds
+    BOUNDS_US = (10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2500000, 5000000, 10000000)
+
+    def __init__(self, bounds_us=BOUNDS_US):
+        self.bounds_us = bounds_us
+        self.reset()
+
+    def reset(self) -> None:
+        self.results = {name: 0 for name in self.RESULTS}
+        self.failures = {name: 0 for name in self.STAGES}
+        self.timings = {name: Histogram(self.bounds_us) for name in self.STAGES}
+        self.since = time.monotonic()
+
+    def count(self, result: str) -> None:
+        self.results[result] += 1
+
+    def failed(self, stage: str) -> None:
+        self.failures[stage] += 1
+
+    def timed(self, stage: str, start_ns: int) -> None:
+        """Time a stage that started at time.monotonic_ns() `start_ns`"""
+        self.timings[stage].add((time.monotonic_ns() - start_ns) // 1000)
+
+    def cards_per_minute(self) -> float:
+        seconds = time.monotonic() - self.since
+        return self.results["encoded"] * 60 / seconds if seconds > 0 else 0.0
+
+    def failure_rate(self) -> float:
+        """Share of the cards tried that ended up failed"""
+        tried = self.results["encoded"] + self.results["failed"]
+        return self.results["failed"] / tried if tried else 0.0
+
+    def snapshot(self) -> dict:
+        """Results, rates and timings as plain dicts, e.g. for json.dumps"""
+
+        # Attempts per stage, retries included
+        attempts = {name: hist.count + self.failures[name] for name, hist in self.timings.items()}
+        return {
+            "seconds": time.monotonic() - self.since,
+            "results": dict(self.results),
+            "cards_per_minute": self.cards_per_minute(),
+            "failure_rate": self.failure_rate(),
+            "stage_failure_rates": {name: self.failures[name] / attempts[name]
+                                    for name in self.STAGES if attempts[name]},
+            "failures": dict(self.failures),
+            "timings": {name: hist.to_dict() for name, hist in self.timings.items()},
+        }
+
+
+class ProductionEncoder():
+    """Write a queue of payloads to cards presented one after another
+
+    Every new card gets the next payload, which is read back from the
+    blocks just written before the card counts as encoded. Cards already
+    in `progress` are skipped, so a card put back on the reader isn't given
+    a second serial. `on_result(result, tag)` runs before waiting for the
+    card to be removed, e.g. to drive an LED. A card left in the field
+    longer than `removal_timeout` seconds is counted as a removal failure
+    and the encoder moves on; it is skipped or tried again when scanned.
+    """
+
+    def __init__(self, rdr: NFCReader, payloads: PayloadQueue, progress: EncodingProgress = None, *,
+                 key=NDEFTag.KEYA1, retries: int = 1, on_result=None, removal_timeout: float = 10):
+        self.rdr = rdr
+        self.payloads = payloads
+        self.progress = progress if progress is not None else EncodingProgress()
+        self.key = key
+        self.retries = retries
+        self.on_result = on_result
+        self.removal_timeout = removal_timeout
+        self.stats = EncodingStats()
+        # Resume after the last card recorded
+        payloads.position = max(payloads.position, self.progress.position)
+
+    def encode_next(self, timeout: float = None) -> str | None:
+        """Wait for a card, encode it and wait for its removal
+
+        Returns "encoded", "skipped" or "failed", or None if the queue is
+        empty or no card showed up within `timeout` seconds.
+        """
+
+        if self.payloads.done():
+            return None
+
+        start = time.monotonic_ns()
+        tag = self.rdr.scan_for_tag(timeout)
+        if tag is None:
+            return None
+        self.stats.timed("detect", start)
+
+        if tag.uid in self.progress:
+            log.info(f"[--] {tag}: already encoded, skipped")
+            result = "skipped"
+        else:
+            result = self._encode(tag)
+        self.stats.count(result)
+        if self.on_result is not None:
+            self.on_result(result, tag)
+
+        start = time.monotonic_ns()
+        if self.rdr.wait_for_removal(timeout=self.removal_timeout):
+            self.stats.timed("removal", start)
+        else:
+            log.warning(f"[!!] {tag}: still in the field after {self.removal_timeout} s")
+            self.stats.failed("removal")
+        return result
+
+    def _encode(self, tag: NFCTag) -> str:
+        ndef = Type2NDEFTag(tag) if Type2Tag.matches(tag) else NDEFTag(tag)
+        position = self.payloads.position
+        data = ndef.encode_messages([self.payloads.message(tag.uid)])
+
+        for attempt in range(self.retries + 1):
+            # A failed command halts the card
+            if attempt and not tag.reselect():
+                break
+            stage = "write"
+            try:
+                start = time.monotonic_ns()
+                if not ndef.write(memoryview(data), key=self.key):
+                    raise NFCWritingException("[>!] Writing NDEF area failed!")
+                self.stats.timed("write", start)
+
+                stage = "verify"
+                start = time.monotonic_ns()
+                verified = ndef.verify(data, key=self.key)
+                self.stats.timed("verify", start)
+            except ValueError as e:
+                # Payload too long for this card, retrying won't help
+                log.warning(f"[!!] {tag}: {e}")
+                self.stats.failed(stage)
+                break
+            except NFCException as e:
+                log.warning(f"[!!] {tag}: {e}")
+                self.stats.failed(stage)
+                continue
+
+            if verified:
+                self.progress.record(tag.uid, position)
+                self.payloads.advance()
+                log.info(f"[--] {tag}: encoded #{position}")
+                return "encoded"
+            log.warning(f"[!!] {tag}: read back differs from what was written!")
+            self.stats.failed("verify")
+        return "failed"
+
+    def run(self, timeout: float = None) -> dict:
+        """Encode cards until the queue is empty or no card came within `timeout` seconds
+
+        Returns the stats snapshot.
+        """
+
+        while self.encode_next(timeout) is not None:
+            pass
+        return self.stats.snapshot()
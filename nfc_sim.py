@@ -0,0 +1,902 @@
+"""
+Simulated RC522 reader and virtual Mifare cards.
+
+Lets the whole stack (nfc_driver, nfc_tools, ndef) run unmodified on CPython:
+
+    sim = SimulatedMFRC522([VirtualMifareClassic([0xDE, 0xAD, 0xBE, 0xEF])])
+    rdr = NFCReader(spi_device=sim)
+
+The simulator stands in for the SPIDevice the driver normally creates. It
+emulates the MFRC522 register file, FIFO and the Transceive, MFAuthent and
+CalcCRC commands, counts SPI transactions and keeps a simulated clock that
+models SPI and RF latency.
+"""
+
+# Card states (ISO/IEC 14443-3)
+IDLE = 0
+READY = 1
+ACTIVE = 2
+HALT = 3
+
+ACK = 0x0A
+NAK_INVALID = 0x04
+NAK_CRC = 0x05
+
+
+def crc_a(data) -> bytes:
+    """ISO/IEC 14443-A CRC (bitwise reference implementation)"""
+
+    crc = 0x6363
+    for b in data:
+        b ^= crc & 0xFF
+        b ^= (b << 4) & 0xFF
+        crc = (crc >> 8) ^ (b << 8) ^ (b << 3) ^ (b >> 4)
+    return bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+
+
+def _bits(data, nbits):
+    """Split data into a list of nbits bits, LSB first"""
+    return [(data[i >> 3] >> (i & 7)) & 1 for i in range(nbits)]
+
+
+def _pack(bits, offset=0):
+    """Pack a list of bits (LSB first) into bytes, starting at bit offset"""
+    out = bytearray((offset + len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            j = offset + i
+            out[j >> 3] |= 1 << (j & 7)
+    return out
+
+
+class VirtualCard():
+    """Base class for virtual ISO/IEC 14443-A cards
+
+    Handles the REQA/WUPA, anticollision, select and HLTA state machine.
+    Subclasses implement `_command` for frames received in ACTIVE state.
+    """
+
+    ATQA = 0x0044
+    SAK = 0x00
+
+    def __init__(self, uid):
+        uid = bytes(uid)
+        if len(uid) not in (4, 7, 10):
+            raise ValueError("UID must be 4, 7 or 10 bytes long")
+        self.uid = uid
+        self.state = IDLE
+        self.halted = False
+        self.level = 0
+        self.busy_us = 0
+
+    def __repr__(self):
+        return f'<{type(self).__name__} uid="{self.uid.hex()}" />'
+
+    def cascade_levels(self) -> list:
+        """UID CLn bytes (without BCC) for each cascade level"""
+        u = self.uid
+        if len(u) == 4:
+            return [u]
+        if len(u) == 7:
+            return [b'\x88' + u[:3], u[3:]]
+        return [b'\x88' + u[:3], b'\x88' + u[3:6], u[6:]]
+
+    @staticmethod
+    def _with_bcc(part):
+        bcc = 0
+        for b in part:
+            bcc ^= b
+        return bytes(part) + bytes([bcc])
+
+    def _reset(self):
+        self.state = HALT if self.halted else IDLE
+        self.level = 0
+
+    def power_off(self):
+        """Card left the field or lost power"""
+        self.state = IDLE
+        self.halted = False
+        self.level = 0
+
+    def receive(self, frame: bytes, nbits: int, crypto: bool):
+        """Process a frame from the reader
+
+        Returns (response, response_bits) or None if the card stays silent.
+        """
+
+        self.busy_us = 0
+
+        if nbits == 7:
+            cmd = frame[0] & 0x7F
+            if cmd == 0x26 and self.state == IDLE or cmd == 0x52 and self.state in (IDLE, HALT):
+                self.state = READY
+                self.level = 0
+                return self.ATQA.to_bytes(2, 'little'), 16
+            if self.state in (READY, ACTIVE):
+                self._reset()
+            return None
+
+        if self.state == READY:
+            if crypto:
+                return None
+            return self._anticollision(frame, nbits)
+
+        if self.state == ACTIVE:
+            if not self._crypto_matches(crypto):
+                self._reset()
+                return None
+            return self._command(frame, nbits)
+
+        return None
+
+    def _crypto_matches(self, crypto: bool) -> bool:
+        return not crypto
+
+    def _anticollision(self, frame, nbits):
+        levels = self.cascade_levels()
+        sel = frame[0]
+        if sel not in (0x93, 0x95, 0x97)[:len(levels)] or len(frame) < 2:
+            self._reset()
+            return None
+        level = (0x93, 0x95, 0x97).index(sel)
+        if level != self.level:
+            self._reset()
+            return None
+
+        clbytes = self._with_bcc(levels[level])
+        nvb = frame[1]
+
+        if nvb == 0x70:
+            if nbits != 9 * 8 or crc_a(frame[:7]) != frame[7:9] or frame[2:7] != clbytes:
+                return None
+            if level == len(levels) - 1:
+                self.state = ACTIVE
+                sak = self.SAK
+            else:
+                self.level += 1
+                sak = 0x04
+            return bytes([sak]) + crc_a([sak]), 24
+
+        # Anticollision: compare the known UID bits, answer with the rest
+        known = nbits - 16
+        if known < 0 or known > 40:
+            self._reset()
+            return None
+        mine = _bits(clbytes, 40)
+        if _bits(frame[2:], known) != mine[:known]:
+            return None
+        rest = mine[known:]
+        return _pack(rest), len(rest)
+
+
+class VirtualMifareClassic(VirtualCard):
+    """Virtual Mifare Classic card (Mini, 1K or 4K)
+
+    :param uid: 4 or 7 byte UID
+    :param size: Memory size in bytes: 320 (Mini), 1024 (1K) or 4096 (4K)
+    :param key_a: Initial key A of every sector
+    :param key_b: Initial key B of every sector
+    :param access: Initial access bytes 6-9 of every sector trailer
+    :param magic: Allow writing block 0 (like "magic" clone cards)
+    """
+
+    ACCESS_TRANSPORT = bytes([0xFF, 0x07, 0x80, 0x69])
+
+    SIZES = {
+        320: (5, 0x09, 0x0004),
+        1024: (16, 0x08, 0x0004),
+        4096: (40, 0x18, 0x0002),
+    }
+
+    # MF1S50 access conditions, indexed by (C1 << 2) | (C2 << 1) | C3
+    # Data blocks: (read, write, increment, decrement/transfer/restore)
+    # Values: "" never, "A" key A, "B" key B, "AB" both
+    DATA_ACCESS = [
+        ("AB", "AB", "AB", "AB"),   # 000
+        ("AB", "", "", "AB"),       # 001
+        ("AB", "", "", ""),         # 010
+        ("B", "B", "", ""),         # 011
+        ("AB", "B", "", ""),        # 100
+        ("B", "", "", ""),          # 101
+        ("AB", "B", "B", "AB"),     # 110
+        ("", "", "", ""),           # 111
+    ]
+    # Trailer: (key A write, access read, access write, key B read, key B write)
+    TRAILER_ACCESS = [
+        ("A", "A", "", "A", "A"),       # 000
+        ("A", "A", "A", "A", "A"),      # 001
+        ("", "A", "", "A", ""),         # 010
+        ("B", "AB", "B", "", "B"),      # 011
+        ("B", "AB", "", "", "B"),       # 100
+        ("", "AB", "B", "", ""),        # 101
+        ("", "AB", "", "", ""),         # 110
+        ("", "AB", "", "", ""),         # 111
+    ]
+
+    READ_US = 1000
+    WRITE_US = 2500
+    AUTH_US = 1500
+    VALUE_US = 1000
+
+    def __init__(self, uid, size=1024, key_a=b'\xff' * 6, key_b=b'\xff' * 6,
+                 access=ACCESS_TRANSPORT, magic=False):
+        super().__init__(uid)
+        if size not in self.SIZES:
+            raise ValueError("Size must be 320, 1024 or 4096")
+        self.sectors, self.SAK, self.ATQA = self.SIZES[size]
+        if len(self.uid) == 7:
+            self.ATQA |= 0x0040
+        self.magic = magic
+        self.size = size
+        self.blocks = bytearray(size)
+        self.auth = None
+        self._write_addr = None
+        # Pending value operation (command, block) waiting for its operand
+        self._value_op = None
+        # Internal transfer buffer of the value operations: (value, address byte)
+        self._transfer_buffer = None
+
+        manufacturer = bytearray(16)
+        if len(self.uid) == 4:
+            manufacturer[0:5] = self._with_bcc(self.uid)
+            manufacturer[5] = self.SAK
+            manufacturer[6:8] = self.ATQA.to_bytes(2, 'little')
+        else:
+            manufacturer[0:7] = self.uid
+            manufacturer[7] = self.SAK
+            manufacturer[8:10] = self.ATQA.to_bytes(2, 'little')
+        self.blocks[0:16] = manufacturer
+
+        for sector in range(self.sectors):
+            self.set_trailer(sector, key_a, access, key_b)
+
+    # Geometry
+
+    @property
+    def block_count(self) -> int:
+        return self.size // 16
+
+    @staticmethod
+    def sector_of(block: int) -> int:
+        return block // 4 if block < 128 else 32 + (block - 128) // 16
+
+    @staticmethod
+    def trailer_of(sector: int) -> int:
+        return sector * 4 + 3 if sector < 32 else 128 + (sector - 32) * 16 + 15
+
+    def _group(self, block: int) -> int:
+        """Access condition group (0-2 data, 3 trailer) of a block"""
+        if block < 128:
+            return block % 4
+        return min((block - 128) % 16 // 5, 3)
+
+    # Memory access helpers
+
+    def block(self, addr: int) -> bytes:
+        return bytes(self.blocks[addr * 16:(addr + 1) * 16])
+
+    def set_block(self, addr: int, data):
+        if len(data) != 16:
+            raise ValueError("Block data must be 16 bytes")
+        self.blocks[addr * 16:(addr + 1) * 16] = bytes(data)
+
+    def set_trailer(self, sector: int, key_a, access, key_b):
+        self.set_block(self.trailer_of(sector), bytes(key_a) + bytes(access) + bytes(key_b))
+
+    def _access_bits(self, sector: int, group: int):
+        """Access bits (C1C2C3) of a group, None if the trailer is corrupted"""
+        t = self.trailer_of(sector) * 16
+        b6, b7, b8 = self.blocks[t + 6], self.blocks[t + 7], self.blocks[t + 8]
+        if (b6 ^ (b7 >> 4)) & 0x0F != 0x0F or (b6 >> 4 ^ b8) & 0x0F != 0x0F or (b7 ^ (b8 >> 4)) & 0x0F != 0x0F:
+            return None
+        c1 = (b7 >> (4 + group)) & 1
+        c2 = (b8 >> group) & 1
+        c3 = (b8 >> (4 + group)) & 1
+        return (c1 << 2) | (c2 << 1) | c3
+
+    def _allowed(self, rule: str, key: str) -> bool:
+        return key in rule
+
+    def _key_b_readable(self, sector: int) -> bool:
+        bits = self._access_bits(sector, 3)
+        return bits is not None and self.TRAILER_ACCESS[bits][3] != ""
+
+    def _permission(self, block: int, op: int) -> bool:
+        """Check an operation on a data block against the access bits"""
+        if self.auth is None:
+            return False
+        sector, key = self.auth
+        if self.sector_of(block) != sector:
+            return False
+        if key == "B" and self._key_b_readable(sector):
+            return False
+        bits = self._access_bits(sector, self._group(block))
+        if bits is None:
+            return False
+        return self._allowed(self.DATA_ACCESS[bits][op], key)
+
+    # Commands
+
+    def _crypto_matches(self, crypto: bool) -> bool:
+        return crypto == (self.auth is not None)
+
+    def _reset(self):
+        super()._reset()
+        self.auth = None
+        self._write_addr = None
+        self._value_op = None
+        self._transfer_buffer = None
+
+    def power_off(self):
+        super().power_off()
+        self.auth = None
+        self._write_addr = None
+        self._value_op = None
+        self._transfer_buffer = None
+
+    def authenticate(self, cmd: int, addr: int, key, uid4) -> bool:
+        """MFAuthent from the reader, returns whether it succeeded"""
+
+        if self.state != ACTIVE or addr >= self.block_count or bytes(uid4) != self.uid[-4:]:
+            self._reset()
+            return False
+        sector = self.sector_of(addr)
+        t = self.trailer_of(sector) * 16
+        if cmd == 0x60:
+            expected, name = self.blocks[t:t + 6], "A"
+        elif cmd == 0x61:
+            expected, name = self.blocks[t + 10:t + 16], "B"
+        else:
+            self._reset()
+            return False
+        if bytes(key) != bytes(expected):
+            self._reset()
+            return False
+        self.auth = (sector, name)
+        self._write_addr = None
+        self._value_op = None
+        return True
+
+    def _nak(self, code=NAK_INVALID):
+        self._reset()
+        return bytes([code]), 4
+
+    def _command(self, frame, nbits):
+        if nbits % 8 or len(frame) < 3:
+            return self._nak(NAK_CRC)
+        if crc_a(frame[:-2]) != frame[-2:]:
+            return self._nak(NAK_CRC)
+        body = frame[:-2]
+
+        if self._write_addr is not None:
+            addr, self._write_addr = self._write_addr, None
+            return self._write_data(addr, body)
+        if self._value_op is not None:
+            (cmd, addr), self._value_op = self._value_op, None
+            return self._value_data(cmd, addr, body)
+
+        cmd = body[0]
+        if cmd == 0x50 and len(body) == 2:
+            self.halted = True
+            self._reset()
+            return None
+        if len(body) != 2 or body[1] >= self.block_count:
+            return self._nak()
+        addr = body[1]
+
+        if cmd == 0x30:
+            return self._read(addr)
+        if cmd == 0xA0:
+            if not self._can_write(addr):
+                return self._nak()
+            self._write_addr = addr
+            return bytes([ACK]), 4
+        if cmd in (0xC0, 0xC1, 0xC2):
+            # DECREMENT, INCREMENT, RESTORE: ACK, then the operand follows
+            if self._group(addr) == 3 or not self._permission(addr, 2 if cmd == 0xC1 else 3):
+                return self._nak()
+            self._value_op = (cmd, addr)
+            return bytes([ACK]), 4
+        if cmd == 0xB0:
+            return self._transfer(addr)
+        return self._nak()
+
+    def _read(self, addr):
+        if self.auth is None or self.sector_of(addr) != self.auth[0]:
+            return self._nak()
+        self.busy_us = self.READ_US
+        if self._group(addr) == 3:
+            data = self._read_trailer(addr)
+        elif self._permission(addr, 0):
+            data = self.block(addr)
+        else:
+            return self._nak()
+        return data + crc_a(data), 18 * 8
+
+    def _read_trailer(self, addr):
+        sector, key = self.auth
+        data = bytearray(16)
+        bits = self._access_bits(sector, 3)
+        if bits is None:
+            return bytes(data)
+        rules = self.TRAILER_ACCESS[bits]
+        raw = self.block(addr)
+        if self._allowed(rules[1], key):
+            data[6:10] = raw[6:10]
+        if self._allowed(rules[3], key):
+            data[10:16] = raw[10:16]
+        return bytes(data)
+
+    def _can_write(self, addr):
+        if self.auth is None or self.sector_of(addr) != self.auth[0]:
+            return False
+        if addr == 0:
+            return self.magic
+        if self._group(addr) == 3:
+            bits = self._access_bits(self.auth[0], 3)
+            rules = self.TRAILER_ACCESS[bits] if bits is not None else ("",) * 5
+            return any(self._allowed(rules[i], self.auth[1]) for i in (0, 2, 4))
+        return self._permission(addr, 1)
+
+    @staticmethod
+    def parse_value(data):
+        """(value, address byte) of a value block, None if the block is not one"""
+        v, inv, v2 = data[0:4], data[4:8], data[8:12]
+        a = data[12:16]
+        if v != v2 or any(x ^ y != 0xFF for x, y in zip(v, inv)):
+            return None
+        if a[0] != a[2] or a[1] != a[3] or a[0] ^ a[1] != 0xFF:
+            return None
+        return int.from_bytes(v, 'little', signed=True), a[0]
+
+    @staticmethod
+    def value_block(value: int, addr: int) -> bytes:
+        v = value.to_bytes(4, 'little', signed=True)
+        return v + bytes(b ^ 0xFF for b in v) + v + bytes([addr, addr ^ 0xFF, addr, addr ^ 0xFF])
+
+    def _value_data(self, cmd, addr, data):
+        if len(data) != 4:
+            return self._nak()
+        parsed = self.parse_value(self.block(addr))
+        if parsed is None:
+            return self._nak()
+        value, addr_byte = parsed
+        operand = int.from_bytes(data, 'little', signed=True)
+        if cmd == 0xC1:
+            value += operand
+        elif cmd == 0xC0:
+            value -= operand
+        if not -0x80000000 <= value <= 0x7FFFFFFF:
+            return self._nak()
+        self.busy_us = self.VALUE_US
+        self._transfer_buffer = (value, addr_byte)
+        # Success is silence, only errors are answered
+        return None
+
+    def _transfer(self, addr):
+        if self._transfer_buffer is None or self._group(addr) == 3 or not self._permission(addr, 3):
+            return self._nak()
+        value, addr_byte = self._transfer_buffer
+        self._transfer_buffer = None
+        self.busy_us = self.WRITE_US
+        self.set_block(addr, self.value_block(value, addr_byte))
+        return bytes([ACK]), 4
+
+    def _write_data(self, addr, data):
+        if len(data) != 16:
+            return self._nak()
+        self.busy_us = self.WRITE_US
+        if self._group(addr) == 3:
+            sector, key = self.auth
+            bits = self._access_bits(sector, 3)
+            rules = self.TRAILER_ACCESS[bits]
+            old = bytearray(self.block(addr))
+            if self._allowed(rules[0], key):
+                old[0:6] = data[0:6]
+            if self._allowed(rules[2], key):
+                old[6:10] = data[6:10]
+            if self._allowed(rules[4], key):
+                old[10:16] = data[10:16]
+            self.set_block(addr, old)
+        else:
+            self.set_block(addr, data)
+        return bytes([ACK]), 4
+
+
+class VirtualNTAG(VirtualCard):
+    """Virtual NTAG213/215/216 (NFC Forum Type 2) card
+
+    :param uid: 7 byte UID
+    :param model: 213, 215 or 216
+    :param ndef: Start with an empty NDEF message TLV
+    """
+
+    ATQA = 0x0044
+    SAK = 0x00
+
+    READ_US = 350
+    WRITE_US = 4100
+
+    # model: (pages, CC data area size / 8, GET_VERSION storage size byte)
+    MODELS = {
+        213: (45, 0x12, 0x0F),
+        215: (135, 0x3E, 0x11),
+        216: (231, 0x6D, 0x13),
+    }
+
+    def __init__(self, uid, model=213, ndef=True):
+        if len(uid) != 7:
+            raise ValueError("NTAG UIDs are 7 bytes long")
+        super().__init__(uid)
+        self.model = model
+        self.page_count, cc_size, self._storage = self.MODELS[model]
+        self.memory = bytearray(self.page_count * 4)
+        u = self.uid
+        self.memory[0:9] = u[0:3] + bytes([0x88 ^ u[0] ^ u[1] ^ u[2]]) + u[3:7] + bytes([u[3] ^ u[4] ^ u[5] ^ u[6]])
+        self.memory[12:16] = bytes([0xE1, 0x10, cc_size, 0x00])
+        if ndef:
+            self.memory[16:19] = b'\x03\x00\xfe'
+
+    def page(self, n) -> bytes:
+        return bytes(self.memory[n * 4:(n + 1) * 4])
+
+    def set_page(self, n, data):
+        self.memory[n * 4:(n + 1) * 4] = bytes(data).ljust(4, b'\x00')[:4]
+
+    def _nak(self, code=NAK_INVALID):
+        self._reset()
+        return bytes([code]), 4
+
+    def _command(self, frame, nbits):
+        if nbits % 8 or len(frame) < 3:
+            return self._nak(NAK_CRC)
+        if crc_a(frame[:-2]) != frame[-2:]:
+            return self._nak(NAK_CRC)
+        body = frame[:-2]
+        cmd = body[0]
+        pages = self.page_count
+
+        if cmd == 0x50 and len(body) == 2:
+            self.halted = True
+            self._reset()
+            return None
+        if cmd == 0x60 and len(body) == 1:
+            data = bytes([0x00, 0x04, 0x04, 0x02, 0x01, 0x00, self._storage, 0x03])
+            return data + crc_a(data), 10 * 8
+        if cmd == 0x30 and len(body) == 2 and body[1] < pages:
+            # Reads roll over to page 0 at the end of the memory
+            data = b''.join(self.page((body[1] + i) % pages) for i in range(4))
+            self.busy_us = self.READ_US
+            return data + crc_a(data), 18 * 8
+        if cmd == 0x3A and len(body) == 3 and body[1] <= body[2] < pages:
+            data = bytes(self.memory[body[1] * 4:(body[2] + 1) * 4])
+            self.busy_us = self.READ_US
+            return data + crc_a(data), (len(data) + 2) * 8
+        if cmd == 0xA2 and len(body) == 6 and 2 <= body[1] < pages:
+            addr = body[1]
+            if addr in (2, 3):
+                # Lock bytes and capability container are one-time programmable
+                old = self.page(addr)
+                data = bytes(old[i] | body[2 + i] for i in range(4))
+                if addr == 2:
+                    data = old[:2] + data[2:]
+            else:
+                data = body[2:6]
+            self.set_page(addr, data)
+            self.busy_us = self.WRITE_US
+            return bytes([ACK]), 4
+        return self._nak()
+
+
+class SimulatedPin():
+    """Stand-in for a DigitalInOut connected to the RC522 IRQ pin"""
+
+    def __init__(self, sim, read_us=2):
+        self._sim = sim
+        self._read_us = read_us
+
+    @property
+    def value(self) -> bool:
+        sim = self._sim
+        sim.clock_us += self._read_us
+        sim._settle()
+        regs = sim.regs
+        active = (regs[0x04] & regs[0x02] & 0x7F) or (regs[0x05] & regs[0x03] & 0x14)
+        # IRqInv (ComIEnReg bit 7) makes the pin active low
+        return (not active) if regs[0x02] & 0x80 else bool(active)
+
+
+class SimClock():
+    """Simulated time in microseconds, shared by readers on the same SPI bus"""
+
+    def __init__(self):
+        self.us = 0.0
+
+
+class SimulatedMFRC522():
+    """Software MFRC522 behind an SPIDevice-compatible interface
+
+    :param cards: Virtual cards in the field
+    :param baudrate: SPI clock used for the latency model
+    :param transaction_us: Fixed cost of one SPI transaction (chip select, locking)
+    :param clock: Pass the same SimClock to readers sharing a bus, so the
+      traffic to one of them advances the time of the others
+    """
+
+    FIFO_SIZE = 64
+
+    def __init__(self, cards=(), baudrate=100000, transaction_us=25, clock: SimClock = None):
+        self.cards = list(cards)
+        self.byte_us = 8 * 1000000 / baudrate
+        self.transaction_us = transaction_us
+        self.regs = bytearray(64)
+        self.fifo = bytearray()
+        self.clock = clock if clock is not None else SimClock()
+        self.irq = SimulatedPin(self)
+        self._pending = None
+        self._txn_first = True
+        self._txn_read = False
+        self._txn_addr = 0
+        self.reset_stats()
+        self._soft_reset()
+
+    @property
+    def clock_us(self) -> float:
+        return self.clock.us
+
+    @clock_us.setter
+    def clock_us(self, us: float):
+        self.clock.us = us
+
+    # Statistics
+
+    def reset_stats(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.frames = 0
+        self.commands = {}
+
+    def stats(self) -> dict:
+        return {
+            "transactions": self.transactions,
+            "bytes": self.bytes,
+            "frames": self.frames,
+            "commands": dict(self.commands),
+            "clock_us": round(self.clock_us),
+        }
+
+    # Field management
+
+    def present(self, card):
+        """Move a card into the field"""
+        if card not in self.cards:
+            card.power_off()
+            self.cards.append(card)
+
+    def remove(self, card):
+        """Take a card out of the field"""
+        if card in self.cards:
+            self.cards.remove(card)
+            card.power_off()
+
+    # SPIDevice interface
+
+    def __enter__(self):
+        self.transactions += 1
+        self.clock_us += self.transaction_us
+        self._txn_first = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def _clock(self, byte_out: int) -> int:
+        """Clock one byte over the bus, return the byte on MISO"""
+
+        self.bytes += 1
+        self.clock_us += self.byte_us
+        if self._txn_first:
+            self._txn_first = False
+            self._txn_read = bool(byte_out & 0x80)
+            self._txn_addr = (byte_out >> 1) & 0x3F
+            return 0
+        if self._txn_read:
+            val = self._read_reg(self._txn_addr)
+            self._txn_addr = (byte_out >> 1) & 0x3F
+            return val
+        self._write_reg(self._txn_addr, byte_out)
+        return 0
+
+    def write(self, buf, *, start=0, end=None):
+        end = len(buf) if end is None else end
+        for i in range(start, end):
+            self._clock(buf[i])
+
+    def readinto(self, buf, *, start=0, end=None, write_value=0):
+        end = len(buf) if end is None else end
+        for i in range(start, end):
+            buf[i] = self._clock(write_value)
+
+    def write_readinto(self, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        if out_end - out_start != in_end - in_start:
+            raise ValueError("buffer slices must be of equal length")
+        for i in range(out_end - out_start):
+            buffer_in[in_start + i] = self._clock(buffer_out[out_start + i])
+
+    # Register file
+
+    def _soft_reset(self):
+        self.regs[:] = bytes(64)
+        self.regs[0x01] = 0x20
+        self.regs[0x02] = 0x80
+        self.regs[0x04] = 0x14
+        self.regs[0x0A] = 0x00
+        self.regs[0x0C] = 0x10
+        self.regs[0x14] = 0x80
+        self.regs[0x21] = 0xFF
+        self.regs[0x22] = 0xFF
+        self.regs[0x37] = 0x92
+        self.fifo = bytearray()
+        self._pending = None
+
+    def _settle(self):
+        """Apply the IRQ bits of a finished command"""
+        if self._pending is not None and self.clock_us >= self._pending[0]:
+            _, com, div = self._pending
+            self._pending = None
+            self.regs[0x04] |= com
+            self.regs[0x05] |= div
+
+    def _read_reg(self, reg: int) -> int:
+        self._settle()
+        if reg == 0x09:
+            if not self.fifo:
+                return 0
+            val = self.fifo[0]
+            del self.fifo[0]
+            return val
+        if reg == 0x0A:
+            return len(self.fifo)
+        return self.regs[reg]
+
+    def _write_reg(self, reg: int, val: int):
+        self._settle()
+        regs = self.regs
+        if reg == 0x01:
+            regs[0x01] = val & 0x3F
+            self._command(val & 0x0F)
+        elif reg in (0x04, 0x05):
+            mask = val & 0x7F
+            if val & 0x80:
+                regs[reg] |= mask
+            else:
+                regs[reg] &= ~mask & 0xFF
+        elif reg == 0x08:
+            # Only MFCrypto1On can be cleared, it is set by MFAuthent
+            regs[0x08] = (regs[0x08] & (val | ~0x08)) & 0xFF
+        elif reg == 0x09:
+            if len(self.fifo) < self.FIFO_SIZE:
+                self.fifo.append(val)
+            else:
+                regs[0x06] |= 0x10
+        elif reg == 0x0A:
+            if val & 0x80:
+                self.fifo = bytearray()
+                regs[0x06] &= ~0x10 & 0xFF
+        elif reg == 0x0D:
+            start = val & 0x80 and not regs[0x0D] & 0x80
+            regs[0x0D] = val
+            if start and regs[0x01] & 0x0F == 0x0C:
+                self._transceive()
+        elif reg == 0x14:
+            if (regs[0x14] & 0x03) and not (val & 0x03):
+                for card in self.cards:
+                    card.power_off()
+            regs[0x14] = val
+        elif reg in (0x06, 0x37):
+            pass
+        else:
+            regs[reg] = val
+
+    # Commands
+
+    def _timer_us(self) -> float:
+        regs = self.regs
+        prescaler = ((regs[0x2A] & 0x0F) << 8) | regs[0x2B]
+        reload = (regs[0x2C] << 8) | regs[0x2D]
+        return (reload + 1) * (2 * prescaler + 1) / 13.56
+
+    def _schedule(self, delay_us, com=0, div=0):
+        self._pending = (self.clock_us + delay_us, com, div)
+
+    def _command(self, cmd: int):
+        self.commands[cmd] = self.commands.get(cmd, 0) + 1
+        if cmd == 0x0F:
+            self._soft_reset()
+        elif cmd == 0x03:
+            res = crc_a(self.fifo)
+            self.fifo = bytearray()
+            self.regs[0x22], self.regs[0x21] = res[0], res[1]
+            self._schedule(len(res) * 0.6, div=0x04)
+        elif cmd == 0x0E:
+            self._authenticate()
+        elif cmd == 0x0C:
+            self.regs[0x06] = 0
+            if self.regs[0x0D] & 0x80:
+                self._transceive()
+
+    def _antenna(self) -> bool:
+        return bool(self.regs[0x14] & 0x03)
+
+    def _rf_us(self, nbytes: int) -> float:
+        # 106 kbit/s, 9 bits per byte including parity, plus frame delay time
+        return nbytes * 9 * 1000000 / 106000 + 90
+
+    def _active_card(self):
+        active = [c for c in self.cards if c.state == ACTIVE]
+        return active[0] if len(active) == 1 else None
+
+    def _authenticate(self):
+        self.regs[0x06] = 0
+        data = bytes(self.fifo)
+        self.fifo = bytearray()
+        card = self._active_card() if self._antenna() else None
+        self.frames += 1
+        if (card is not None and len(data) >= 12 and hasattr(card, "authenticate")
+                and card.authenticate(data[0], data[1], data[2:8], data[8:12])):
+            self.regs[0x08] |= 0x08
+            self._schedule(self._rf_us(4) + card.AUTH_US, com=0x10)
+        else:
+            self._schedule(self._timer_us(), com=0x01)
+
+    def _transceive(self):
+        regs = self.regs
+        regs[0x06] = 0
+        regs[0x0E] = 0x20
+        framing = regs[0x0D]
+        tx_last = framing & 0x07
+        rx_align = (framing >> 4) & 0x07
+        data = bytes(self.fifo)
+        self.fifo = bytearray()
+        nbits = len(data) * 8 if tx_last == 0 else (len(data) - 1) * 8 + tx_last
+        crypto = bool(regs[0x08] & 0x08)
+        self.frames += 1
+
+        responses = []
+        busy = 0
+        if self._antenna() and data:
+            for card in list(self.cards):
+                res = card.receive(data, nbits, crypto)
+                if res is not None:
+                    responses.append(res)
+                    busy = max(busy, card.busy_us)
+
+        tx_us = self._rf_us(len(data))
+        if not responses:
+            self._schedule(tx_us + self._timer_us(), com=0x41)
+            return
+
+        length = max(n for _, n in responses)
+        merged = [0] * length
+        collision = None
+        for resp, n in responses:
+            for i, bit in enumerate(_bits(resp, n)):
+                if collision is None and any(
+                        i < m and _bits(r, m)[i] != bit for r, m in responses):
+                    collision = i
+                merged[i] |= bit
+
+        if collision is not None:
+            regs[0x06] |= 0x08
+            pos = rx_align + collision + 1
+            regs[0x0E] = 0 if pos == 32 else (pos if pos < 32 else 0x20)
+
+        out = _pack(merged, rx_align)
+        total = rx_align + length
+        self.fifo = out[:self.FIFO_SIZE]
+        if len(out) > self.FIFO_SIZE:
+            regs[0x06] |= 0x10
+        regs[0x0C] = (regs[0x0C] & 0xF8) | (total % 8)
+        self._schedule(tx_us + self._rf_us(len(out)) + busy, com=0x60)
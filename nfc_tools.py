@@ -1,10 +1,12 @@
 """
-Tools for Mifare 1k NFC cards
+Tools for Mifare Classic NFC cards
 """
 
 import math
+import time
 
 from nfc_driver import MFRC522
+from nfc_log import log, DEBUG
 from nfc_utils import int2hex, list2hex, bytes2str
 
 
@@ -40,141 +42,730 @@ class Key():
         self.key = key
         self.mode = mode
 
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Key) and self.mode == other.mode and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash((self.mode, tuple(self.key)))
+
+    def __repr__(self) -> str:
+        return f'<Key mode="{"A" if self.mode == self.A else "B"}" key="{list2hex(self.key)}" />'
+
     @classmethod
     def default(cls):
         return cls([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
 
 
+# Well-known keys tried during key discovery, key A first
+DEFAULT_KEY_DICTIONARY = [
+    Key([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], Key.A),  # factory default
+    Key([0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7], Key.A),  # NDEF sectors
+    Key([0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5], Key.A),  # MAD sector
+    Key([0x00, 0x00, 0x00, 0x00, 0x00, 0x00], Key.A),
+    Key([0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5], Key.A),
+    Key([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], Key.B),
+    Key([0x00, 0x00, 0x00, 0x00, 0x00, 0x00], Key.B),
+    Key([0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5], Key.B),
+]
+
+
+class LRUCache():
+    """Small bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, size: int = 32):
+        self.size = size
+        self._data = {}
+        self._order = []
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._order.remove(key)
+        self._order.append(key)
+        return self._data[key]
+
+    def put(self, key, value) -> None:
+        if key in self._data:
+            self._order.remove(key)
+        elif len(self._order) >= self.size:
+            del self._data[self._order.pop(0)]
+        self._data[key] = value
+        self._order.append(key)
+
+    def pop(self, key, default=None):
+        if key in self._data:
+            self._order.remove(key)
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._order.clear()
+
+
+class CardGeometry():
+    """Sector layout of a Mifare Classic card
+
+    Sectors 0-31 have 4 blocks, sectors 32-39 (4K only) have 16; the last
+    block of a sector is its trailer. Lookups go through tables built once
+    per geometry.
+    """
+
+    _DATA, _TRAILER, _MANUFACTURER = 0, 1, 2
+
+    def __init__(self, name: str, sectors: int, mad_sectors: tuple = (0,)):
+        self.name = name
+        self.sector_count = sectors
+        self.block_count = min(sectors, 32) * 4 + max(0, sectors - 32) * 16
+        # Sectors holding the MIFARE Application Directory, not application data
+        self.mad_sectors = mad_sectors
+
+        self._first = []
+        self._sector = bytearray(self.block_count)
+        self._kind = bytearray(self.block_count)
+        block = 0
+        for sector in range(sectors):
+            size = 4 if sector < 32 else 16
+            self._first.append(block)
+            self._sector[block:block + size] = bytes([sector]) * size
+            self._kind[block + size - 1] = self._TRAILER
+            block += size
+        self._first.append(block)
+        self._kind[0] = self._MANUFACTURER
+
+        self.data_blocks = [b for b in range(self.block_count) if self._kind[b] == self._DATA]
+        # Data blocks of sector 0, next to the manufacturer block
+        self.first_data_blocks = [b for b in self.data_blocks if self._sector[b] == 0]
+        self.main_data_blocks = self.data_blocks[len(self.first_data_blocks):]
+        # Data blocks outside the MAD sectors
+        self.app_data_blocks = [b for b in self.data_blocks if self._sector[b] not in mad_sectors]
+
+    def __repr__(self) -> str:
+        return f"<CardGeometry {self.name}: {self.sector_count} sectors, {self.block_count} blocks>"
+
+    def sector(self, blockaddr: int) -> int:
+        return self._sector[blockaddr]
+
+    def sector_blocks(self, sector: int) -> range:
+        return range(self._first[sector], self._first[sector + 1])
+
+    def trailer(self, sector: int) -> int:
+        return self._first[sector + 1] - 1
+
+    def is_trailer(self, blockaddr: int) -> bool:
+        return self._kind[blockaddr] == self._TRAILER
+
+    def is_data(self, blockaddr: int) -> bool:
+        """Whether a block holds data (not the manufacturer block or a trailer)"""
+        return 0 <= blockaddr < self.block_count and self._kind[blockaddr] == self._DATA
+
+    @classmethod
+    def from_sak(cls, sak: int = None, atqa: int = None) -> "CardGeometry":
+        """Geometry of a card judging by its SAK, the ATQA decides if the SAK is unknown
+
+        Unknown cards are treated as 1K.
+        """
+
+        geometry = cls.BY_SAK.get(sak)
+        if geometry is None and atqa is not None and atqa & 0x0F == 0x02:
+            geometry = cls.CLASSIC_4K
+        return geometry or cls.CLASSIC_1K
+
+
+CardGeometry.MINI = CardGeometry("Mifare Classic Mini", 5)
+CardGeometry.CLASSIC_1K = CardGeometry("Mifare Classic 1K", 16)
+CardGeometry.PLUS_2K = CardGeometry("Mifare Plus 2K", 32, (0, 16))
+CardGeometry.CLASSIC_4K = CardGeometry("Mifare Classic 4K", 40, (0, 16))
+CardGeometry.BY_SAK = {
+    0x09: CardGeometry.MINI,
+    0x08: CardGeometry.CLASSIC_1K,
+    0x28: CardGeometry.CLASSIC_1K,  # emulated (e.g. JCOP)
+    0x88: CardGeometry.CLASSIC_1K,  # Infineon
+    0x10: CardGeometry.PLUS_2K,
+    0x11: CardGeometry.CLASSIC_4K,  # Mifare Plus 4K in SL2
+    0x18: CardGeometry.CLASSIC_4K,
+    0x38: CardGeometry.CLASSIC_4K,  # emulated
+    0x98: CardGeometry.CLASSIC_4K,
+}
+
+
+class TagSnapshot():
+    """Memory image of a whole Mifare Classic tag, with per-block read status and the keys used
+
+    The ATQA and SAK of the tag it came from tell the card type, None if unknown.
+    """
+
+    MAGIC = b'NFCS'
+    VERSION = 2
+
+    # Block status
+    UNREAD = 0
+    OK = 1
+    AUTH_FAILED = 2
+    READ_FAILED = 3
+
+    # ATQA / SAK stored for "unknown"
+    _NO_ATQA = 0xFFFF
+    _NO_SAK = 0xFF
+
+    def __init__(self, uid, atqa: int = None, sak: int = None, block_count=64, block_size=16):
+        self.uid = bytes(uid)
+        self.atqa = atqa
+        self.sak = sak
+        self.block_count = block_count
+        self.block_size = block_size
+        self.image = bytearray(block_count * block_size)
+        self.status = bytearray(block_count)
+        self.keys = {}  # sector -> Key that authenticated it
+
+    def __repr__(self) -> str:
+        read = sum(1 for s in self.status if s == self.OK)
+        sak = "?" if self.sak is None else f"0x{self.sak:02x}"
+        return f'<TagSnapshot uid="0x{self.uid.hex()}" sak="{sak}" blocks="{read}/{self.block_count}" />'
+
+    def block(self, blockaddr) -> memoryview:
+        """Contents of a block (a view into the image)"""
+        bs = self.block_size
+        return memoryview(self.image)[blockaddr * bs:(blockaddr + 1) * bs]
+
+    @property
+    def complete(self) -> bool:
+        """Whether every block was read"""
+        return all(s == self.OK for s in self.status)
+
+    def to_bytes(self) -> bytes:
+        """Serialize: header, UID, ATQA, SAK, status bytes, image, key map"""
+
+        out = bytearray(self.MAGIC)
+        out.append(self.VERSION)
+        out.append(len(self.uid))
+        out.extend(self.uid)
+        out.extend((self._NO_ATQA if self.atqa is None else self.atqa).to_bytes(2, 'big'))
+        out.append(self._NO_SAK if self.sak is None else self.sak)
+        out.extend(self.block_count.to_bytes(2, 'big'))
+        out.append(self.block_size)
+        out.extend(self.status)
+        out.extend(self.image)
+        out.append(len(self.keys))
+        for sector in sorted(self.keys):
+            key = self.keys[sector]
+            out.append(sector)
+            out.append(key.mode)
+            out.extend(bytes(key.key))
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data) -> "TagSnapshot":
+        """Parse a snapshot; version 1 snapshots (without ATQA and SAK) are still read"""
+
+        data = memoryview(data)
+        if len(data) < 6 or bytes(data[0:4]) != cls.MAGIC or data[4] not in (1, cls.VERSION):
+            raise ValueError("Not a tag snapshot (or unsupported version)!")
+        # Version 1 stored the REQA answer length in place of ATQA and SAK
+        header = 5 if data[4] == 1 else 6
+
+        pos = 5
+        uid_length = data[pos]
+        pos += 1
+        if len(data) < pos + uid_length + header:
+            raise ValueError("Tag snapshot truncated in the header!")
+        uid = bytes(data[pos:pos + uid_length])
+        pos += uid_length
+        atqa = sak = None
+        if header == 6:
+            atqa = (data[pos] << 8) | data[pos + 1]
+            atqa = None if atqa == cls._NO_ATQA else atqa
+            sak = None if data[pos + 2] == cls._NO_SAK else data[pos + 2]
+        pos += header - 3
+        block_count = (data[pos] << 8) | data[pos + 1]
+        block_size = data[pos + 2]
+        pos += 3
+
+        # Status bytes, image and the key count
+        end = pos + block_count + block_count * block_size + 1
+        if len(data) < end or len(data) != end + 8 * data[end - 1]:
+            raise ValueError(f"Tag snapshot has {len(data)} bytes, expected {end} plus 8 per key!")
+
+        self = cls(uid, atqa, sak, block_count, block_size)
+        self.status[:] = data[pos:pos + block_count]
+        pos += block_count
+        self.image[:] = data[pos:pos + block_count * block_size]
+        pos += block_count * block_size
+
+        for _ in range(data[pos]):
+            sector, mode = data[pos + 1], data[pos + 2]
+            self.keys[sector] = Key(bytes(data[pos + 3:pos + 9]), mode)
+            pos += 8
+        return self
+
+
+class ValueBlock():
+    """Mifare Classic value block: a signed 32 bit value stored three times
+    (once inverted) and an address byte stored four times (twice inverted)"""
+
+    def __init__(self, value: int, addr: int = 0):
+        if not -0x80000000 <= value <= 0x7FFFFFFF:
+            raise ValueError("Value must fit a signed 32 bit integer!")
+        self.value = value
+        self.addr = addr & 0xFF
+
+    def __repr__(self) -> str:
+        return f'<ValueBlock value="{self.value}" addr="0x{self.addr:02x}" />'
+
+    def to_bytes(self) -> bytes:
+        v = self.value.to_bytes(4, 'little', signed=True)
+        inv = bytes(b ^ 0xFF for b in v)
+        a = self.addr
+        return v + inv + v + bytes([a, a ^ 0xFF, a, a ^ 0xFF])
+
+    @classmethod
+    def from_bytes(cls, data) -> "ValueBlock":
+        """Parse a value block, ValueError if the redundant copies don't match"""
+
+        data = bytes(data)
+        if len(data) != 16:
+            raise ValueError("Value blocks are 16 bytes long!")
+        v, inv, v2, a = data[0:4], data[4:8], data[8:12], data[12:16]
+        if v != v2 or any(x ^ y != 0xFF for x, y in zip(v, inv)) \
+                or a[0] != a[2] or a[1] != a[3] or a[0] ^ a[1] != 0xFF:
+            raise ValueError(f"Not a value block: {data.hex()}")
+        return cls(int.from_bytes(v, 'little', signed=True), a[0])
+
+
+class AccessBits():
+    """Access conditions of a sector trailer (bytes 6-8)
+
+    One condition (C1 << 2 | C2 << 1 | C3) per block group: 0-2 are the
+    data blocks, 3 the trailer. Every bit is stored twice, once inverted.
+    """
+
+    def __init__(self, conditions=(0, 0, 0, 1)):
+        conditions = tuple(conditions)
+        if len(conditions) != 4 or not all(0 <= c <= 7 for c in conditions):
+            raise ValueError("Access conditions must be 4 values between 0 and 7!")
+        self.conditions = conditions
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, AccessBits) and self.conditions == other.conditions
+
+    def __repr__(self) -> str:
+        return f'<AccessBits conditions="{"".join(f"{c:03b} " for c in self.conditions).strip()}" ' \
+               f'bytes="{self.to_bytes().hex()}" />'
+
+    def to_bytes(self) -> bytes:
+        c1 = c2 = c3 = 0
+        for group, c in enumerate(self.conditions):
+            c1 |= (c >> 2 & 1) << group
+            c2 |= (c >> 1 & 1) << group
+            c3 |= (c & 1) << group
+        return bytes([
+            ((c2 ^ 0x0F) << 4) | (c1 ^ 0x0F),
+            (c1 << 4) | (c3 ^ 0x0F),
+            (c3 << 4) | c2,
+        ])
+
+    @classmethod
+    def from_bytes(cls, data) -> "AccessBits":
+        """Decode bytes 6-8 of a trailer, ValueError if the inverted bits don't match
+
+        A trailer with invalid access bits blocks its sector for good.
+        """
+
+        b6, b7, b8 = data[0], data[1], data[2]
+        c1, c2, c3 = b7 >> 4, b8 & 0x0F, b8 >> 4
+        if (b6 & 0x0F) ^ c1 != 0x0F or (b6 >> 4) ^ c2 != 0x0F or (b7 & 0x0F) ^ c3 != 0x0F:
+            raise ValueError(f"Invalid access bits: {bytes(data[:3]).hex()}")
+        return cls(((c1 >> g & 1) << 2 | (c2 >> g & 1) << 1 | (c3 >> g & 1)) for g in range(4))
+
+
+AccessBits.TRANSPORT = AccessBits((0, 0, 0, 1))   # FF 07 80: key A does everything
+AccessBits.NDEF = AccessBits((0, 0, 0, 3))        # 7F 07 88: NDEF sectors, key B manages the trailer
+AccessBits.NDEF_MAD = AccessBits((4, 4, 4, 3))    # 78 77 88: MAD sectors, read-only with key A
+
+
+class SectorTrailer():
+    """Last block of a sector: key A, access bits, general purpose byte and key B"""
+
+    def __init__(self, key_a, access: AccessBits = None, key_b=None, gpb: int = 0x69):
+        self.key_a = self._key_bytes(key_a)
+        self.access = access if access is not None else AccessBits.TRANSPORT
+        self.key_b = self._key_bytes(key_b if key_b is not None else Key.default())
+        self.gpb = gpb
+
+    @staticmethod
+    def _key_bytes(key) -> bytes:
+        key = bytes(key.key) if isinstance(key, Key) else bytes(key)
+        if len(key) != 6:
+            raise ValueError("Key must be 6 bytes long")
+        return key
+
+    def __repr__(self) -> str:
+        return f'<SectorTrailer key_a="{self.key_a.hex()}" access="{self.access.to_bytes().hex()}" ' \
+               f'gpb="0x{self.gpb:02x}" key_b="{self.key_b.hex()}" />'
+
+    def to_bytes(self) -> bytes:
+        return self.key_a + self.access.to_bytes() + bytes([self.gpb]) + self.key_b
+
+    @classmethod
+    def from_bytes(cls, data) -> "SectorTrailer":
+        """Parse a trailer; read back from a card, key A (and often key B) are zeros"""
+        data = bytes(data)
+        if len(data) != 16:
+            raise ValueError("Sector trailers are 16 bytes long!")
+        return cls(data[0:6], AccessBits.from_bytes(data[6:9]), data[10:16], data[9])
+
+
 class NFCTag():
-    """Class representing a Mifare 1k NFC tag"""
+    """Class representing a Mifare Classic (Mini, 1K or 4K) NFC tag"""
 
     BLOCK_SIZE = 16
 
-    FIRST_DATA_BLOCKS = [
-        0x01, 0x02,
-    ]
-
-    MAIN_DATA_BLOCKS = [
-        0x04, 0x05, 0x06,
-        0x08, 0x09, 0x0A,
-        0x0C, 0x0D, 0x0E,
-        0x10, 0x11, 0x12,
-        0x14, 0x15, 0x16,
-        0x18, 0x19, 0x1A,
-        0x1C, 0x1D, 0x1E,
-        0x20, 0x21, 0x22,
-        0x24, 0x25, 0x26,
-        0x28, 0x29, 0x2A,
-        0x2C, 0x2D, 0x2E,
-        0x30, 0x31, 0x32,
-        0x34, 0x35, 0x36,
-        0x38, 0x39, 0x3A,
-        0x3C, 0x3D, 0x3E,
-    ]
-
-    DATA_BLOCKS = FIRST_DATA_BLOCKS + MAIN_DATA_BLOCKS
-
-    def __init__(self, rdr: MFRC522, raw_uid, tag_type):
+    # Block maps of a 1K card, instances use the ones of their geometry
+    FIRST_DATA_BLOCKS = CardGeometry.CLASSIC_1K.first_data_blocks
+    MAIN_DATA_BLOCKS = CardGeometry.CLASSIC_1K.main_data_blocks
+    DATA_BLOCKS = CardGeometry.CLASSIC_1K.data_blocks
+    BLOCK_COUNT = CardGeometry.CLASSIC_1K.block_count
+
+    # Discovered key maps ({sector: Key}) of recently seen tags, by UID
+    key_cache = LRUCache(32)
+
+    def __init__(self, rdr: MFRC522, raw_uid, tag_type, key_dictionary: list = None, sak: int = None,
+                 atqa: int = None):
         self.rdr = rdr
+        # UID (4, 7 or 10 bytes) followed by its BCC
         self.raw_uid = raw_uid
+        self.uid = list(raw_uid[:-1])
         self.tag_type = tag_type
+        self.sak = sak
+        self.atqa = atqa
+        self.geometry = CardGeometry.from_sak(sak, atqa)
+        self.FIRST_DATA_BLOCKS = self.geometry.first_data_blocks
+        self.MAIN_DATA_BLOCKS = self.geometry.main_data_blocks
+        self.DATA_BLOCKS = self.geometry.data_blocks
+        self.BLOCK_COUNT = self.geometry.block_count
+        # Keys to try for sectors accessed without an explicit key (None: default key only)
+        self.key_dictionary = key_dictionary
+        self.key_map = self.key_cache.get(bytes(raw_uid)) or {}
+        # (reader auth epoch, sector, key mode, key) of the current Crypto1 session
+        self._auth_session = None
+        # Known block contents (blockaddr -> 16 bytes) seen during this session
+        self._image = {}
 
     def __str__(self):
-        u = self.raw_uid
-        return f'<NFCTag type="0x{self.tag_type:02x}" uid="0x{u[0]:02x}{u[1]:02x}{u[2]:02x}{u[3]:02x}" />'
+        uid = "".join(f"{b:02x}" for b in self.uid)
+        return f'<NFCTag type="0x{self.tag_type:02x}" uid="0x{uid}" />'
+
+    def _sector(self, blockaddr) -> int:
+        return self.geometry.sector(blockaddr)
+
+    @staticmethod
+    def _sector_key(sector, keys) -> Key | None:
+        """Pick the key for a sector from a Key, a {sector: Key} dict or None (default key)"""
+        if isinstance(keys, dict):
+            return keys.get(sector)
+        return keys
+
+    def _sector_blocks(self, sector) -> range:
+        return self.geometry.sector_blocks(sector)
+
+    def reselect(self) -> bool:
+        """Wake up and select this tag again, e.g. after a failed authentication halted it"""
+        return self.rdr._run(self._reselect_steps())
+
+    def _reselect_steps(self):
+        self._invalidate_auth()
+        self.rdr.stop_crypto1()
+        for _ in range(2):
+            # The first WUPA may only knock an active tag back to idle
+            stat, _ = yield from self.rdr._request_steps(MFRC522.REQALL)
+            if stat == MFRC522.OK:
+                (stat, _, _) = yield from self.rdr._select_steps(self.uid)
+                return stat == MFRC522.OK
+        return False
+
+    def _is_trailer(self, blockaddr) -> bool:
+        return self.geometry.is_trailer(blockaddr)
+
+    def invalidate_image(self, blockaddr=None) -> None:
+        """Forget the cached contents of a block (or all blocks), e.g. after another writer changed the tag"""
+        if blockaddr is None:
+            self._image.clear()
+        else:
+            self._image.pop(blockaddr, None)
+
+    def _invalidate_auth(self) -> None:
+        """Forget the current authentication, the next block access re-authenticates"""
+        self._auth_session = None
+
+    def _remember_key(self, sector, key: Key) -> None:
+        if self.key_map.get(sector) != key:
+            self.key_map[sector] = key
+        self.key_cache.put(bytes(self.raw_uid), self.key_map)
+
+    def _authenticate_discover_steps(self, blockaddr):
+        """Authenticate with the known key of the sector, else walk the key dictionary"""
+
+        sector = self._sector(blockaddr)
+        known = self.key_map.get(sector)
+        candidates = self.key_dictionary
+        if known is not None:
+            candidates = [known] + [k for k in candidates if k != known]
+
+        for key in candidates:
+            try:
+                yield from self._authenticate_block_steps(blockaddr, key)
+            except NFCAuthenticationException:
+                # A failed authentication halts the tag
+                if not (yield from self._reselect_steps()):
+                    raise NFCAuthenticationException(
+                        f"[!!] 0x{blockaddr:02x}: Tag lost during key discovery!")
+                continue
+            self._remember_key(sector, key)
+            return True
+
+        self.key_map.pop(sector, None)
+        raise NFCAuthenticationException(
+            f"[!!] 0x{blockaddr:02x}: No key in the dictionary opens sector {sector}!")
+
+    def discover_keys(self, sectors=None, dictionary: list = None) -> dict:
+        """Find a working key for every sector, returns the key map {sector: Key}
+
+        Sectors no key opens are left out.
+        """
+
+        if dictionary is not None:
+            self.key_dictionary = dictionary
+        elif self.key_dictionary is None:
+            self.key_dictionary = DEFAULT_KEY_DICTIONARY
+
+        if sectors is None:
+            sectors = range(self.geometry.sector_count)
+        for sector in sectors:
+            try:
+                self.rdr._run(self._authenticate_discover_steps(self.geometry.trailer(sector)))
+            except NFCAuthenticationException:
+                pass
+        return self.key_map
 
     def _authenticate_block(self, blockaddr, key: Key = None) -> bool:
-        if key is None:
+        """Authenticate the sector of a block, unless it already is with the same key"""
+        return self.rdr._run(self._authenticate_block_steps(blockaddr, key))
+
+    def _authenticate_block_steps(self, blockaddr, key: Key = None):
+        if key is None and self.key_dictionary is not None:
+            return (yield from self._authenticate_discover_steps(blockaddr))
+        elif key is None:
             key = Key.default()
         elif not isinstance(key, Key):
             raise ValueError("Key must be an instance of Key!")
 
-        stat = self.rdr.auth(key.mode, blockaddr, key.key, self.raw_uid)
+        session = (self.rdr.auth_epoch, self._sector(blockaddr), key.mode, tuple(key.key))
+        if session == self._auth_session:
+            return True
+
+        self._auth_session = None
+        # Tags with 7 or 10 byte UIDs authenticate with the last 4 bytes
+        stat = yield from self.rdr._auth_steps(key.mode, blockaddr, key.key, self.uid[-4:])
         if not (stat == MFRC522.OK):
             raise NFCAuthenticationException(
                 f"[!!] 0x{blockaddr:02x}: Authentication failed! ({stat})")
+        # auth() bumped the epoch, remember the session it started
+        self._auth_session = (self.rdr.auth_epoch,) + session[1:]
         return True
 
     def _print_block(self, blockaddr, data, sign='<<', additional='') -> None:
-        print(
+        log.debug(
             f"[{sign}] 0x{int2hex(blockaddr)}: {list2hex(data)} {bytes2str(data)}", additional)
 
-    def _write_block(self, blockaddr, data, *, key=None, force=False) -> bool:
-        if not force and blockaddr not in self.DATA_BLOCKS:
+    def _write_block(self, blockaddr, data, *, key=None, force=False, only_changed=True) -> bool:
+        """Write a block, skipped if only_changed and the block is known to hold data already"""
+        return self.rdr._run(self._write_block_steps(blockaddr, data, key=key, force=force,
+                                                     only_changed=only_changed))
+
+    def _write_block_steps(self, blockaddr, data, *, key=None, force=False, only_changed=True):
+        if not force and not self.geometry.is_data(blockaddr):
             raise ValueError(
                 f"Operation CANCELLED! Writing block {blockaddr} could make the tag unusable! Use force=true with caution!")
         elif len(data) > 16:
             raise ValueError("Must be 16 bytes!")
-        elif len(data) < 16:
-            data += b'\x00' * (16 - len(data))
 
-        if not self._authenticate_block(blockaddr, key):
+        if len(data) < 16:
+            data = bytes(data) + b'\x00' * (16 - len(data))
+        if self._is_trailer(blockaddr):
+            AccessBits.from_bytes(data[6:9])
+
+        if only_changed and self._image.get(blockaddr) == data:
+            return True
+
+        if not (yield from self._authenticate_block_steps(blockaddr, key)):
             return False
 
-        stat = self.rdr.mifare_write(blockaddr, data)
+        stat = yield from self.rdr._mifare_write_steps(blockaddr, data)
         if stat != MFRC522.OK:
+            # A failed command drops the card out of the authenticated state,
+            # and the block may or may not have been programmed
+            self._invalidate_auth()
+            self._image.pop(blockaddr, None)
             raise NFCWritingException(
                 f"[>!] 0x{blockaddr:02x}: Writing failed! ({stat})")
 
-        self._print_block(blockaddr, data, '>>')
+        if not self._is_trailer(blockaddr):
+            self._image[blockaddr] = bytes(data)
+        if log.enabled(DEBUG):
+            self._print_block(blockaddr, data, '>>')
         return True
 
-    def _clear_block(self, blockaddr, *, key=None, force=False) -> bool:
-        return self._write_block(blockaddr, b'\x00' * 16, key=key, force=force)
+    def _clear_block(self, blockaddr, *, key=None, force=False, only_changed=True) -> bool:
+        return self._write_block(blockaddr, b'\x00' * 16, key=key, force=force, only_changed=only_changed)
 
     def _read_block(self, blockaddr, *, key=None) -> list | None:
-        if not self._authenticate_block(blockaddr, key=key):
+        return self.rdr._run(self._read_block_steps(blockaddr, key=key))
+
+    def _read_block_steps(self, blockaddr, *, key=None):
+        if not (yield from self._authenticate_block_steps(blockaddr, key=key)):
             return None
 
-        stat, data = self.rdr.mifare_read(blockaddr)
+        stat, data = yield from self.rdr._mifare_read_steps(blockaddr)
         if stat != MFRC522.OK:
+            self._invalidate_auth()
             raise NFCReadingException(
                 f"[!<] 0x{blockaddr:02x}: Reading failed! ({stat})")
 
         if len(data) != 16:
-            print(
+            self._invalidate_auth()
+            log.warning(
                 f"[!<] 0x{blockaddr:02x}: Reading failed! (invalid data length: {len(data)} ({data}))")
             return None
 
-        self._print_block(blockaddr, data, '<<')
+        # Trailers read back with masked keys, they can't be compared against
+        if not self._is_trailer(blockaddr):
+            self._image[blockaddr] = bytes(data)
+        if log.enabled(DEBUG):
+            self._print_block(blockaddr, data, '<<')
         return data
 
     def _override_block(self, blockaddr, data, pos=0, key=None, force=False) -> bool:
         if len(data) + pos > 16:
             raise ValueError("Must be 16 bytes!")
 
-        olddata = self._read_block(blockaddr, key) or b'\x00' * 16
+        olddata = self._image.get(blockaddr) or bytes(self._read_block(blockaddr, key=key) or 16)
+
+        newdata = olddata[:pos] + bytes(data) + olddata[pos + len(data):]
+        return self._write_block(blockaddr, newdata, key=key, force=force)
+
+    def format_value(self, blockaddr, value: int = 0, *, key=None) -> bool:
+        """Turn a data block into a value block holding value"""
+        return self._write_block(blockaddr, ValueBlock(value, blockaddr).to_bytes(), key=key)
+
+    def read_value(self, blockaddr, *, key=None) -> int:
+        """Value of a value block, ValueError if the block is not one"""
+        data = self._read_block(blockaddr, key=key)
+        if data is None:
+            raise NFCReadingException(f"[!<] 0x{blockaddr:02x}: Reading failed!")
+        return ValueBlock.from_bytes(data).value
+
+    def increment(self, blockaddr, delta: int, *, key=None, transfer_to=None) -> bool:
+        """Add delta to a value block on the card (into transfer_to, default: the same block)"""
+        return self.rdr._run(self._value_steps(MFRC522.INCREMENT, blockaddr, delta, key, transfer_to))
+
+    def decrement(self, blockaddr, delta: int, *, key=None, transfer_to=None) -> bool:
+        """Subtract delta from a value block on the card (into transfer_to, default: the same block)"""
+        return self.rdr._run(self._value_steps(MFRC522.DECREMENT, blockaddr, delta, key, transfer_to))
+
+    def copy_value(self, blockaddr, transfer_to, *, key=None) -> bool:
+        """Copy a value block to another block of its sector (RESTORE + TRANSFER), e.g. as a backup"""
+        return self.rdr._run(self._value_steps(MFRC522.RESTORE, blockaddr, 0, key, transfer_to))
+
+    def _value_steps(self, cmd, blockaddr, delta, key=None, transfer_to=None):
+        if transfer_to is None:
+            transfer_to = blockaddr
+        geometry = self.geometry
+        if not geometry.is_data(blockaddr) or not geometry.is_data(transfer_to):
+            raise ValueError(f"Value operations need data blocks, not 0x{blockaddr:02x}/0x{transfer_to:02x}!")
+        if geometry.sector(blockaddr) != geometry.sector(transfer_to):
+            raise ValueError("The transfer target must be in the same sector!")
+        if not 0 <= delta <= 0x7FFFFFFF:
+            raise ValueError("Delta must be between 0 and 2^31 - 1!")
+
+        yield from self._authenticate_block_steps(blockaddr, key)
+        stat = yield from self.rdr._mifare_value_steps(cmd, blockaddr, delta)
+        if stat == MFRC522.OK:
+            stat = yield from self.rdr._mifare_transfer_steps(transfer_to)
+        self._image.pop(transfer_to, None)
+        if stat != MFRC522.OK:
+            # A NAK drops the card out of the authenticated state
+            self._invalidate_auth()
+            raise NFCWritingException(
+                f"[>!] 0x{blockaddr:02x}: Value operation 0x{cmd:02x} failed! ({stat})")
+        if log.enabled(DEBUG):
+            log.debug(f"[>>] 0x{int2hex(transfer_to)}: value 0x{cmd:02x} {delta}")
+        return True
+
+    def apply_deltas(self, deltas: dict, *, key=None) -> bool:
+        """Add signed deltas ({blockaddr: delta}) to value blocks, on the card
+
+        Blocks are processed in order, so each sector is authenticated once.
+        key is a Key, a {sector: Key} dict or None like for snapshot().
+        """
+        return self.rdr._run(self._apply_deltas_steps(deltas, key=key))
+
+    def _apply_deltas_steps(self, deltas: dict, *, key=None):
+        for blockaddr in sorted(deltas):
+            delta = deltas[blockaddr]
+            if delta == 0:
+                continue
+            sector_key = self._sector_key(self._sector(blockaddr), key)
+            cmd = MFRC522.INCREMENT if delta > 0 else MFRC522.DECREMENT
+            yield from self._value_steps(cmd, blockaddr, abs(delta), sector_key)
+        return True
 
-        newdata = olddata[:pos] + list(data) + olddata[pos + len(data):]
-        return self._write_block(blockaddr, newdata, key, force)
+    def read_blocks(self, addresses=None, key=None) -> list:
+        """Read blocks in order (default: the whole card), stops at the first failing one"""
+        if addresses is None:
+            addresses = range(self.BLOCK_COUNT)
+        return self.rdr._run(self._read_blocks_steps(addresses, key=key))
 
-    def read_blocks(self, addresses=range(0x00, 0x40), key=None) -> list:
+    def _read_blocks_steps(self, addresses, key=None):
         data = []
 
         for i in addresses:
-            block = self._read_block(i, key=key)
+            block = yield from self._read_block_steps(i, key=key)
             if not block:
                 break
             data.append(block)
         return data
 
-    def data_read(self, *, blocks=DATA_BLOCKS, key=None) -> list:
+    def data_read(self, *, blocks=None, key=None) -> list:
         """Read all data blocks (excluding the empty keyb blocks)"""
-        return self.read_blocks(blocks, key=key)
+        return self.read_blocks(self.DATA_BLOCKS if blocks is None else blocks, key=key)
 
-    def data_clear(self, *, blocks=DATA_BLOCKS, key=None) -> bool:
-        """Clear all data blocks (excluding the empty keyb blocks)"""
-        for i in blocks:
-            if not self._clear_block(i, key=key):
+    def data_clear(self, *, blocks=None, key=None, only_changed=True) -> bool:
+        """Clear all data blocks (excluding the empty keyb blocks), skipping blocks known to be empty"""
+        for i in self.DATA_BLOCKS if blocks is None else blocks:
+            if not self._clear_block(i, key=key, only_changed=only_changed):
                 return False
         return True
 
-    def data_write(self, data, *, blocks=DATA_BLOCKS, key=None) -> bool:
-        """Write to all data blocks (only if needed, excluding the empty keyb blocks)"""
+    def data_write(self, data, *, blocks=None, key=None, only_changed=True) -> bool:
+        """Write to all data blocks (only if needed, excluding the empty keyb blocks)
+
+        With only_changed, blocks read or written earlier in this session are
+        compared first and only written if their contents differ.
+        """
+        return self.rdr._run(self._data_write_steps(data, blocks=blocks, key=key, only_changed=only_changed))
+
+    def _data_write_steps(self, data, *, blocks=None, key=None, only_changed=True):
+        if blocks is None:
+            blocks = self.DATA_BLOCKS
         if isinstance(data, str):
             data = data.encode('utf-8')
-        elif not isinstance(data, bytes):
-            raise ValueError("Data must be a string or bytes!")
+        elif not isinstance(data, (bytes, bytearray, memoryview)):
+            raise ValueError("Data must be a string, bytes, bytearray or memoryview!")
 
         bs = self.BLOCK_SIZE
 
@@ -185,37 +776,358 @@ class NFCTag():
                 f"Data too long! {blocks_required} blocks required, but only {blocks_available} available!")
 
         for i in range(blocks_required):
-            if not self._write_block(blocks[i], data[i*bs:(i+1)*bs], key=key):
+            if not (yield from self._write_block_steps(blocks[i], data[i*bs:(i+1)*bs], key=key,
+                                                       only_changed=only_changed)):
                 return False
         return True
 
+    def read_trailer(self, sector, *, key=None) -> SectorTrailer:
+        """Read the trailer of a sector; key A reads back as zeros"""
+        data = self._read_block(self.geometry.trailer(sector), key=key)
+        if data is None:
+            raise NFCReadingException(f"[!<] Reading the trailer of sector {sector} failed!")
+        return SectorTrailer.from_bytes(data)
+
+    def write_trailer(self, sector, trailer: SectorTrailer, *, key=None, verify=True) -> bool:
+        """Write the trailer of a sector, see rekey"""
+        return self.rdr._run(self._write_trailer_steps(sector, trailer, key, verify))
+
+    def _write_trailer_steps(self, sector, trailer: SectorTrailer, key=None, verify=True):
+        blockaddr = self.geometry.trailer(sector)
+        data = trailer.to_bytes()
+        if not (yield from self._write_block_steps(blockaddr, data, key=key, force=True, only_changed=False)):
+            raise NFCWritingException(f"[>!] Writing the trailer of sector {sector} failed!")
+
+        new_key = Key(trailer.key_a, Key.A)
+        if verify:
+            # Authenticating with the new key A proves it, the access bits are compared
+            self._invalidate_auth()
+            try:
+                readback = yield from self._read_block_steps(blockaddr, key=new_key)
+            except NFCException as e:
+                raise NFCWritingException(
+                    f"[>!] Sector {sector}: the new trailer does not verify! ({e})")
+            if readback is None or bytes(readback[6:10]) != data[6:10]:
+                raise NFCWritingException(f"[>!] Sector {sector}: access bits read back differently!")
+        self._remember_key(sector, new_key)
+        return True
+
+    def rekey(self, trailer, keys=None, *, sectors=None, verify=True) -> list:
+        """Write new trailers (keys and access bits) to many sectors, e.g. to personalise factory cards
+
+        :param trailer: A SectorTrailer for all sectors or a {sector: SectorTrailer} dict
+        :param keys: Current keys: a Key, a {sector: Key} dict or None for the default key
+        :param sectors: Sectors to re-key (default: those of a trailer dict, else all)
+        :param verify: After each write, authenticate with the new key A and compare the access bits
+
+        Sectors are re-keyed in order with one authentication each, the first
+        failure raises before the next sector is touched. Returns the sectors.
+        """
+        return self.rdr._run(self._rekey_steps(trailer, keys, sectors, verify))
+
+    def _rekey_steps(self, trailer, keys=None, sectors=None, verify=True):
+        if sectors is None:
+            sectors = sorted(trailer) if isinstance(trailer, dict) else range(self.geometry.sector_count)
+
+        done = []
+        for sector in sectors:
+            new = trailer[sector] if isinstance(trailer, dict) else trailer
+            try:
+                yield from self._write_trailer_steps(sector, new, self._sector_key(sector, keys), verify)
+            except NFCException as e:
+                raise NFCWritingException(f"{e} Sectors re-keyed before: {done}")
+            done.append(sector)
+            if log.enabled(DEBUG):
+                log.debug(f"[>>] Sector {sector} re-keyed")
+        return done
+
+    def snapshot(self, keys=None, *, sectors=None) -> TagSnapshot:
+        """Read every block into a TagSnapshot, with one authentication per sector
+
+        :param keys: A Key for all sectors, a {sector: Key} dict or None for the default key
+        :param sectors: Sectors to read (default: all)
+
+        Sectors that fail are marked in the snapshot's status and skipped.
+        """
+
+        snap = TagSnapshot(self.uid, self.atqa, self.sak, self.BLOCK_COUNT, self.BLOCK_SIZE)
+        bs = self.BLOCK_SIZE
+
+        if sectors is None:
+            sectors = range(self.geometry.sector_count)
+
+        for sector in sectors:
+            key = self._sector_key(sector, keys)
+            for blockaddr in self._sector_blocks(sector):
+                try:
+                    data = self._read_block(blockaddr, key=key)
+                except NFCAuthenticationException:
+                    for b in self._sector_blocks(sector):
+                        snap.status[b] = TagSnapshot.AUTH_FAILED
+                    self.reselect()
+                    break
+                except NFCReadingException:
+                    data = None
+                    self.reselect()
+
+                if data is None:
+                    snap.status[blockaddr] = TagSnapshot.READ_FAILED
+                    continue
+                snap.image[blockaddr * bs:(blockaddr + 1) * bs] = bytes(data)
+                snap.status[blockaddr] = TagSnapshot.OK
+            else:
+                if key is None:
+                    key = self.key_map.get(sector) if self.key_dictionary is not None else Key.default()
+                snap.keys[sector] = key
+
+        return snap
+
+    def restore(self, snapshot: TagSnapshot, keys=None, *, include_trailers=False, include_block0=False) -> bool:
+        """Write a snapshot back (or clone it onto another tag)
+
+        :param keys: Keys of this tag: a Key, a {sector: Key} dict or None for the default key
+        :param include_trailers: Also write the sector trailers. Key A is taken from the
+            snapshot's key map, access bits and key B from the image. Use with caution!
+        :param include_block0: Also write the manufacturer block (only "magic" tags allow this)
+
+        Only blocks read successfully into the snapshot are written. The trailer
+        of a sector is written after its data blocks, as it may change the keys.
+        A snapshot of another card type (SAK) is refused.
+        """
+
+        if snapshot.sak is not None and self.sak is not None and snapshot.sak != self.sak:
+            raise ValueError(f"Snapshot of a different card type (SAK 0x{snapshot.sak:02x}, "
+                             f"this tag 0x{self.sak:02x})!")
+        if snapshot.block_count > self.BLOCK_COUNT or snapshot.block_size != self.BLOCK_SIZE:
+            raise ValueError("Snapshot does not fit on this tag!")
+
+        bs = self.BLOCK_SIZE
+        for sector in range(self.geometry.sector_count):
+            if self.geometry.trailer(sector) >= snapshot.block_count:
+                break
+            key = self._sector_key(sector, keys)
+            for blockaddr in self._sector_blocks(sector):
+                if snapshot.status[blockaddr] != TagSnapshot.OK:
+                    continue
+                data = snapshot.image[blockaddr * bs:(blockaddr + 1) * bs]
+                if self._is_trailer(blockaddr):
+                    if not include_trailers:
+                        continue
+                    data = self._restored_trailer(snapshot, sector, data)
+                elif blockaddr == 0 and not include_block0:
+                    continue
+                self._write_block(blockaddr, data, key=key, force=True)
+        return True
+
+    @staticmethod
+    def _restored_trailer(snapshot, sector, data) -> bytes:
+        """Trailer bytes with key A (which always reads back masked) taken from the key map"""
+        known = snapshot.keys.get(sector)
+        if known is None or known.mode != Key.A:
+            raise ValueError(f"Key A of sector {sector} is unknown, can't restore its trailer!")
+        return bytes(known.key) + bytes(data[6:16])
+
+
+class PollScheduler():
+    """Spacing of the polls of NFCReader.scan_for_tag
+
+    Polls every `interval_ms`, backs off by `backoff` up to `max_interval_ms`
+    once `idle_polls` polls in a row found nothing, and polls every
+    `fast_interval_ms` for `fast_polls` polls after a tag left the field.
+    A card presented to an idle reader waits up to `max_interval_ms` to be
+    seen: the default of 100 ms keeps that below what a person notices,
+    raise it (e.g. 500) to save more power where latency doesn't matter.
+    With `antenna_off`, the field is switched off during waits of at least
+    `antenna_off_min_ms` and switched on again `settle_ms` before the poll,
+    so tags are powered up when the REQA goes out.
+    """
+
+    def __init__(self, interval_ms: float = 50, max_interval_ms: float = 100, backoff: float = 1.5,
+                 idle_polls: int = 20, fast_interval_ms: float = 5, fast_polls: int = 40,
+                 antenna_off: bool = False, antenna_off_min_ms: float = 100, settle_ms: float = 5,
+                 sleep=None):
+        self.interval_ms = interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.backoff = backoff
+        self.idle_polls = idle_polls
+        self.fast_interval_ms = fast_interval_ms
+        self.fast_polls = fast_polls
+        self.antenna_off = antenna_off
+        self.antenna_off_min_ms = antenna_off_min_ms
+        self.settle_ms = settle_ms
+        # Takes seconds, like time.sleep
+        self.sleep = sleep if sleep is not None else time.sleep
+        self.found()
+
+    def delay_ms(self) -> float:
+        """Wait before the next poll"""
+        return self.fast_interval_ms if self._fast else self._delay_ms
+
+    def found(self) -> None:
+        """A poll found a tag"""
+        self._misses = 0
+        self._fast = 0
+        self._delay_ms = self.interval_ms
+
+    def missed(self) -> None:
+        """A poll found no tag"""
+        if self._fast:
+            self._fast -= 1
+            return
+        self._misses += 1
+        if self._misses >= self.idle_polls:
+            self._delay_ms = min(self.max_interval_ms, self._delay_ms * self.backoff)
+
+    def left(self) -> None:
+        """The tag left the field, the next one is likely to follow soon"""
+        self.found()
+        self._fast = self.fast_polls
+
+    def wait(self, *readers: MFRC522, max_ms: float = None) -> None:
+        for seconds in self._waits(readers, max_ms):
+            self.sleep(seconds)
+
+    def _waits(self, readers, max_ms: float = None):
+        """Pauses (in seconds) before the next poll, switching the antennas in between
+
+        The whole wait is capped at `max_ms`, e.g. the time left until a timeout.
+        """
+        delay = self.delay_ms()
+        if max_ms is not None and delay > max_ms:
+            delay = max_ms
+        if self.antenna_off and delay >= self.antenna_off_min_ms:
+            for rdr in readers:
+                rdr.antenna_on(False)
+            yield (delay - self.settle_ms) / 1000
+            for rdr in readers:
+                rdr.antenna_on()
+            yield self.settle_ms / 1000
+        elif delay > 0:
+            yield delay / 1000
+
 
 class NFCReader(MFRC522):
     "Class based functions for the MFRC522"
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, key_dictionary: list = None, scheduler: PollScheduler = None, **kwargs):
         super().__init__(*args, **kwargs)
-        print("[--] NFC Reader initialized!")
+        # Passed on to found tags, enables key discovery (see NFCTag.discover_keys)
+        self.key_dictionary = key_dictionary
+        self.scheduler = scheduler if scheduler is not None else PollScheduler()
+        log.info("[--] NFC Reader initialized!")
+
+    def tag_present(self) -> bool:
+        """Check for a tag in the field with a single WUPA, without anticollision or select
+
+        A tag left in READY state by the previous WUPA ignores the next one,
+        so a miss is retried once.
+        """
+
+        for _ in range(2):
+            if self.request(MFRC522.REQALL)[0] == MFRC522.OK:
+                return True
+        return False
 
     def get_tag(self) -> NFCTag | None:
         """Get a tag if there is one, otherwise return None"""
+        return self._run(self._get_tag_steps())
 
-        (stat, tag_type) = self.request(MFRC522.REQALL)
+    def _get_tag_steps(self):
+        self.metrics.count("polls")
+        (stat, tag_type) = yield from self._request_steps(MFRC522.REQALL)
         if stat == MFRC522.OK:
-            (stat, raw_uid) = self.anticoll()
-            if stat == MFRC522.OK:
-                if self.select_tag(raw_uid) == MFRC522.OK:
-                    tag = NFCTag(self, raw_uid, tag_type)
-                    print("[++] Found tag:", tag)
-                    return tag
+            return (yield from self._found_tag_steps(tag_type))
         return None
 
-    def scan_for_tag(self) -> NFCTag:
-        """Scan for a tag and return a NFCTag object if found"""
+    def _found_tag_steps(self, tag_type):
+        """Anticollision and select after a tag answered a REQA/WUPA"""
+
+        (stat, uid, sak) = yield from self._select_steps()
+        if stat != MFRC522.OK:
+            return None
+        tag = NFCTag(self, uid + [self.bcc(uid)], tag_type, self.key_dictionary, sak=sak, atqa=self.atqa)
+        self.metrics.count("tags")
+        log.info("[++] Found tag:", tag)
+        return tag
+
+    def inventory(self, max_tags: int = 16) -> list:
+        """Find every tag in the field
+
+        Selects one tag at a time with bit-level anticollision and halts it,
+        until no tag answers anymore. The tags are left halted; tag.reselect()
+        wakes and selects one of them again.
+        """
+        return self._run(self._inventory_steps(max_tags))
 
-        print("[--] Scanning for tag...")
+    def _inventory_steps(self, max_tags: int):
+        self.stop_crypto1()
+        tags = []
+
+        # The first WUPA may only knock an active tag back to idle
+        for _ in range(2):
+            (stat, tag_type) = yield from self._request_steps(MFRC522.REQALL)
+            if stat == MFRC522.OK:
+                break
+
+        while stat == MFRC522.OK and len(tags) < max_tags:
+            tag = yield from self._found_tag_steps(tag_type)
+            if tag is None:
+                break
+            tags.append(tag)
+            yield from self._halt_steps()
+            # REQA: the halted tags stay silent, the ones the HLTA reset to idle answer
+            (stat, tag_type) = yield from self._request_steps(MFRC522.REQIDL)
+
+        return tags
+
+    def scan_for_tag(self, timeout: float = None) -> NFCTag | None:
+        """Scan for a tag and return a NFCTag object if found
+
+        Polls are spaced by the reader's scheduler. Returns None if no tag
+        showed up within `timeout` seconds.
+        """
+
+        log.info("[--] Scanning for tag...")
+
+        # A tag still authenticated from the last session doesn't answer otherwise
+        self.stop_crypto1()
+        scheduler = self.scheduler
+        deadline = None if timeout is None else time.monotonic() + timeout
 
         while True:
             tag = self.get_tag()
             if tag is not None:
+                scheduler.found()
                 return tag
+            scheduler.missed()
+            left_ms = None
+            if deadline is not None:
+                left_ms = (deadline - time.monotonic()) * 1000
+                if left_ms <= 0:
+                    return None
+            scheduler.wait(self, max_ms=left_ms)
+
+    def wait_for_removal(self, misses: int = 2, timeout: float = None) -> bool:
+        """Block until the tag in the field is gone, then poll fast for the next one
+
+        Returns False if the tag was still there after `timeout` seconds.
+        """
+
+        self.stop_crypto1()
+        scheduler = self.scheduler
+        deadline = None if timeout is None else time.monotonic() + timeout
+        missed = 0
+        while missed < misses:
+            if self.tag_present():
+                missed = 0
+                seconds = scheduler.interval_ms / 1000
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return False
+                    seconds = min(seconds, left)
+                scheduler.sleep(seconds)
+            else:
+                missed += 1
+        scheduler.left()
+        return True
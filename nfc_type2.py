@@ -0,0 +1,259 @@
+"""
+NFC Forum Type 2 tags: Mifare Ultralight and NTAG21x
+"""
+
+from nfc_driver import MFRC522
+from nfc_log import log, DEBUG
+from nfc_tools import NFCTag, NFCReadingException, NFCWritingException
+from nfc_utils import list2hex
+from ndef import NDEFTag
+
+
+class CapabilityContainer():
+    """Type 2 tag capability container (page 3)"""
+
+    MAGIC = 0xE1
+
+    def __init__(self, data):
+        data = bytes(data[:4])
+        if len(data) != 4 or data[0] != self.MAGIC:
+            raise ValueError(f"Not an NDEF formatted Type 2 tag (capability container {data.hex()})!")
+        self.version = data[1]
+        # Size of the data area in bytes
+        self.data_size = data[2] * 8
+        self.access = data[3]
+
+    def __str__(self):
+        return f'<CapabilityContainer version="{self.version >> 4}.{self.version & 0x0F}" size="{self.data_size}" access="0x{self.access:02x}" />'
+
+    @property
+    def readable(self) -> bool:
+        return self.access >> 4 == 0
+
+    @property
+    def writable(self) -> bool:
+        return self.access & 0x0F == 0
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.MAGIC, self.version, self.data_size // 8, self.access])
+
+
+class Type2Tag():
+    """Mifare Ultralight / NTAG21x tag: 4-byte pages, no authentication
+
+    Wraps the NFCTag found by the reader (SAK 0x00).
+    """
+
+    PAGE_SIZE = 4
+    BLOCK_SIZE = PAGE_SIZE
+    FIRST_DATA_PAGE = 4
+    # A FAST_READ answer has to fit the 64 byte FIFO together with its CRC
+    FAST_READ_PAGES = 15
+
+    # GET_VERSION storage size byte: (model, CC data area size / 8)
+    MODELS = {
+        0x0B: ("NTAG210", 0x06),
+        0x0E: ("NTAG212", 0x10),
+        0x0F: ("NTAG213", 0x12),
+        0x11: ("NTAG215", 0x3E),
+        0x13: ("NTAG216", 0x6D),
+    }
+
+    def __init__(self, tag: NFCTag):
+        self.tag = tag
+        self.rdr = tag.rdr
+        self.uid = tag.uid
+        self.cc = None
+        # Whether the tag knows FAST_READ, None until tried
+        self.fast_read = None
+        # Known page contents (page -> 4 bytes) seen during this session
+        self._image = {}
+
+    def __str__(self):
+        uid = "".join(f"{b:02x}" for b in self.uid)
+        return f'<Type2Tag uid="0x{uid}" />'
+
+    @staticmethod
+    def matches(tag: NFCTag) -> bool:
+        """Whether a found tag is a Type 2 tag, judging by its SAK"""
+        return tag.sak is not None and tag.sak & 0x7F == 0x00
+
+    def _reselect_steps(self):
+        # A NAK sends the tag back to idle
+        if not (yield from self.tag._reselect_steps()):
+            raise NFCReadingException("[!!] Tag lost!")
+
+    def _print_pages(self, page, data, sign='<<') -> None:
+        for i in range(0, len(data), self.PAGE_SIZE):
+            log.debug(f"[{sign}] p{page + i // self.PAGE_SIZE:03d}: {list2hex(data[i:i + self.PAGE_SIZE])}")
+
+    def _remember(self, page, data) -> None:
+        ps = self.PAGE_SIZE
+        for i in range(len(data) // ps):
+            self._image[page + i] = bytes(data[i * ps:(i + 1) * ps])
+
+    def invalidate_image(self) -> None:
+        """Forget the cached page contents, e.g. after another writer changed the tag"""
+        self._image.clear()
+
+    def version(self) -> str | None:
+        """Model name from GET_VERSION, None for tags without it (e.g. the first Ultralight)"""
+        return self.rdr._run(self._version_steps())
+
+    def _version_steps(self):
+        stat, data = yield from self.rdr._ntag_get_version_steps()
+        if stat != MFRC522.OK:
+            yield from self._reselect_steps()
+            return None
+        model = self.MODELS.get(data[6])
+        return model[0] if model else f"unknown (0x{data[6]:02x})"
+
+    def read_pages(self, page, count) -> bytes:
+        """Read `count` pages starting at `page`, with FAST_READ where the tag supports it"""
+        return self.rdr._run(self._read_pages_steps(page, count))
+
+    def _read_pages_steps(self, page, count):
+        ps = self.PAGE_SIZE
+        out = bytearray(count * ps)
+        done = 0
+
+        while done < count:
+            n = min(count - done, self.FAST_READ_PAGES)
+            if n > 4 and self.fast_read is not False:
+                stat, data = yield from self.rdr._ntag_fast_read_steps(page + done, page + done + n - 1)
+                if stat == MFRC522.OK:
+                    self.fast_read = True
+                elif self.fast_read is None and stat != MFRC522.ERR_TIMEOUT:
+                    # Unknown command on this tag, fall back to READ
+                    self.fast_read = False
+                    yield from self._reselect_steps()
+                    continue
+            else:
+                # READ returns 4 pages
+                n = min(n, 4)
+                stat, data = yield from self.rdr._mifare_read_steps(page + done)
+
+            if stat != MFRC522.OK:
+                raise NFCReadingException(f"[!<] p{page + done:03d}: Reading failed! ({stat})")
+            out[done * ps:(done + n) * ps] = bytes(data[:n * ps])
+            done += n
+
+        self._remember(page, out)
+        if log.enabled(DEBUG):
+            self._print_pages(page, out)
+        return bytes(out)
+
+    def write_pages(self, page, data, only_changed=True) -> bool:
+        """Write data to consecutive pages starting at `page`, padded to whole pages
+
+        With only_changed, pages known to hold the data already are skipped.
+        """
+        return self.rdr._run(self._write_pages_steps(page, data, only_changed))
+
+    def _write_pages_steps(self, page, data, only_changed=True):
+        if page < 2:
+            raise ValueError("Pages 0 and 1 hold the UID and can't be written!")
+
+        ps = self.PAGE_SIZE
+        data = bytes(data)
+        if len(data) % ps:
+            data += b'\x00' * (ps - len(data) % ps)
+
+        for i in range(len(data) // ps):
+            chunk = data[i * ps:(i + 1) * ps]
+            if only_changed and self._image.get(page + i) == chunk:
+                continue
+            stat = yield from self.rdr._mifare_ul_write_steps(page + i, chunk)
+            if stat != MFRC522.OK:
+                self._image.pop(page + i, None)
+                raise NFCWritingException(f"[>!] p{page + i:03d}: Writing failed! ({stat})")
+            self._image[page + i] = chunk
+            if log.enabled(DEBUG):
+                self._print_pages(page + i, chunk, '>>')
+        return True
+
+    def read_cc(self) -> CapabilityContainer:
+        """Read and parse the capability container"""
+        return self.rdr._run(self._read_cc_steps())
+
+    def _read_cc_steps(self):
+        if self.cc is None:
+            # READ of page 3 brings the first data pages along
+            data = yield from self._read_pages_steps(3, 4)
+            self.cc = CapabilityContainer(data[:4])
+        return self.cc
+
+
+class Type2NDEFTag(NDEFTag):
+    """NDEF messages on a Type 2 tag
+
+    The NDEF area starts at page 4, its size comes from the capability
+    container. Type 2 tags have no keys, the key arguments are ignored.
+    """
+
+    def __init__(self, tag):
+        super().__init__(tag if isinstance(tag, Type2Tag) else Type2Tag(tag))
+
+    def format(self, key=None):
+        """Write the capability container of a blank NTAG, then an empty NDEF message"""
+
+        stat, data = self.tag.rdr.ntag_get_version()
+        if stat != MFRC522.OK or data[6] not in Type2Tag.MODELS:
+            raise NFCWritingException("[!!] Unknown tag model, can't format it!")
+        self.tag.write_pages(3, bytes([CapabilityContainer.MAGIC, 0x10, Type2Tag.MODELS[data[6]][1], 0x00]))
+        self.tag.cc = None
+        self.clean()
+
+    def clean(self, keyw0=None, keyw1=None):
+        """Write an empty NDEF message to the first data page, the rest of the area is left as is"""
+        self.write(b'\x03\x00\xFE\x00')
+
+    def _area_size(self) -> int:
+        return self.tag.cc.data_size
+
+    def _ndef_blocks_steps(self):
+        # No MAD, the capability container describes the NDEF area
+        cc = yield from self.tag._read_cc_steps()
+        if not cc.readable:
+            raise NFCReadingException("[!!] NDEF area is not readable!")
+        return None
+
+    def _load_steps(self, n, key=None):
+        area = self._area
+        if n > len(area):
+            return False
+
+        if self._loaded < n:
+            # Read ahead a full FAST_READ, the next TLV bytes usually follow closely
+            ps = Type2Tag.PAGE_SIZE
+            start = self._loaded
+            end = max(n, start + ps * Type2Tag.FAST_READ_PAGES)
+            end = min(len(area), (end + ps - 1) // ps * ps)
+            data = yield from self.tag._read_pages_steps(Type2Tag.FIRST_DATA_PAGE + start // ps, (end - start) // ps)
+            area[start:end] = data
+            self._loaded = end
+        return True
+
+    def _area_chunks(self, key=None):
+        cc = self.tag.read_cc()
+        if not cc.readable:
+            raise NFCReadingException("[!!] NDEF area is not readable!")
+        pages = cc.data_size // Type2Tag.PAGE_SIZE
+        for page in range(0, pages, Type2Tag.FAST_READ_PAGES):
+            yield self.tag.read_pages(Type2Tag.FIRST_DATA_PAGE + page, min(Type2Tag.FAST_READ_PAGES, pages - page))
+
+    def _write_area_block(self, index, data, key=None) -> None:
+        cc = self.tag.read_cc()
+        if not cc.writable:
+            raise NFCWritingException("[!!] NDEF area is read-only!")
+        if index >= cc.data_size // Type2Tag.PAGE_SIZE:
+            raise ValueError(f"Data too long! Only {cc.data_size} bytes available!")
+        self.tag.write_pages(Type2Tag.FIRST_DATA_PAGE + index, data)
+
+    def _write_steps(self, data, key=None):
+        cc = yield from self.tag._read_cc_steps()
+        if not cc.writable:
+            raise NFCWritingException("[!!] NDEF area is read-only!")
+        if len(data) > cc.data_size:
+            raise ValueError(f"Data too long! {len(data)} bytes, but only {cc.data_size} available!")
+        return (yield from self.tag._write_pages_steps(Type2Tag.FIRST_DATA_PAGE, data))
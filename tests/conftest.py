@@ -0,0 +1,29 @@
+"""
+Fixtures for the tests, which run the whole stack against nfc_sim on CPython
+"""
+
+import os
+import sys
+
+import pytest
+
+# Appended: the repo root holds code.py, which would shadow the standard library module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nfc_log import log, OFF  # noqa: E402
+from nfc_sim import SimulatedMFRC522  # noqa: E402
+from nfc_tools import NFCReader  # noqa: E402
+
+log.level = OFF
+
+
+@pytest.fixture
+def field():
+    """Build a simulated reader with cards in the field: ``sim, rdr = field(card, ...)``"""
+
+    def make(*cards, **kwargs):
+        sim = SimulatedMFRC522(list(cards))
+        # Simulated time only advances with bus traffic, keep the wall-clock timeout out of the way
+        rdr = NFCReader(spi_device=sim, irq=sim.irq, timeout_ms=5000, **kwargs)
+        return sim, rdr
+    return make
@@ -0,0 +1,32 @@
+import asyncio
+
+from nfc_async import AsyncNDEFTag, AsyncNFCReader, AsyncNFCTag
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import Key
+from ndef import NDEFMessage, NDEFRecord, NDEFTag
+
+
+def test_async_scan_write_read(field):
+    card = VirtualMifareClassic([0xDE, 0xAD, 0xBE, 0xEF])
+    for sector in range(card.sectors):
+        key_a = NDEFTag.KEYA0 if sector == 0 else NDEFTag.KEYA1
+        card.set_trailer(sector, bytes(key_a.key), card.ACCESS_TRANSPORT, b'\xff' * 6)
+    NDEFTag.mad_cache.clear()
+    sim, rdr = field(card)
+    message = NDEFMessage([NDEFRecord.create_uri("https://example.com/async")])
+
+    async def main():
+        tag = await AsyncNFCReader(rdr).scan_for_tag(timeout=1)
+        ndef = AsyncNDEFTag(tag)
+        await ndef.write_messages([message])
+        return (await ndef.read_messages())[0].records[0].payload
+
+    assert asyncio.run(main()) == "https://example.com/async"
+
+
+def test_async_apply_deltas(field):
+    sim, rdr = field(VirtualMifareClassic([0x01, 0x02, 0x03, 0x04]))
+    tag = rdr.get_tag()
+    tag.format_value(4, 5, key=Key.default())
+    asyncio.run(AsyncNFCTag(tag).apply_deltas({4: -2}, key=Key.default()))
+    assert tag.read_value(4, key=Key.default()) == 3
@@ -0,0 +1,32 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import CardGeometry, Key
+
+
+def test_from_sak():
+    assert CardGeometry.from_sak(0x09) is CardGeometry.MINI
+    assert CardGeometry.from_sak(0x08) is CardGeometry.CLASSIC_1K
+    assert CardGeometry.from_sak(0x18) is CardGeometry.CLASSIC_4K
+    # Unknown SAK: the 1K layout this code was written for
+    assert CardGeometry.from_sak(None) is CardGeometry.CLASSIC_1K
+
+
+def test_4k_layout():
+    geometry = CardGeometry.CLASSIC_4K
+    assert geometry.block_count == 256
+    assert geometry.sector(127) == 31 and geometry.sector(128) == 32 and geometry.sector(255) == 39
+    assert geometry.trailer(31) == 127 and geometry.trailer(32) == 143 and geometry.trailer(39) == 255
+    assert geometry.is_trailer(143) and geometry.is_data(142) and not geometry.is_data(0)
+    # 3360 bytes of NDEF area outside the MAD sectors 0 and 16
+    assert len(geometry.app_data_blocks) * 16 == 3360
+
+
+@pytest.mark.parametrize("size, blocks", [(320, 20), (1024, 64), (4096, 256)])
+def test_tag_geometry_from_the_card(field, size, blocks):
+    card = VirtualMifareClassic([0x01, 0x02, 0x03, 0x04], size)
+    card.set_block(blocks - 2, b'last data block!')
+    sim, rdr = field(card)
+    tag = rdr.get_tag()
+    assert tag.BLOCK_COUNT == blocks
+    assert bytes(tag.read_blocks([blocks - 2], key=Key.default())[0]) == b'last data block!'
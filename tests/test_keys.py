@@ -0,0 +1,37 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import AccessBits, Key, NFCWritingException, SectorTrailer
+
+UID = [0xDE, 0xAD, 0xBE, 0xEF]
+NEW_KEY = Key([0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7])
+
+
+@pytest.mark.parametrize("access, encoded", [(AccessBits.TRANSPORT, "ff0780"), (AccessBits.NDEF, "7f0788"),
+                                             (AccessBits.NDEF_MAD, "787788")])
+def test_access_bits(access, encoded):
+    assert access.to_bytes().hex() == encoded
+    assert AccessBits.from_bytes(bytes.fromhex(encoded)) == access
+
+
+def test_inconsistent_access_bits():
+    with pytest.raises(ValueError):
+        AccessBits.from_bytes(b'\xff\xff\xff')
+
+
+def test_rekey_whole_card(field):
+    card = VirtualMifareClassic(UID)
+    sim, rdr = field(card)
+    tag = rdr.get_tag()
+    done = tag.rekey(SectorTrailer(NEW_KEY, AccessBits.NDEF), Key.default())
+    assert done == list(range(16))
+    assert card.block(7)[:6] == bytes(NEW_KEY.key)
+    assert tag.read_trailer(1, key=NEW_KEY).access == AccessBits.NDEF
+
+
+def test_rekey_reports_sectors_done(field):
+    card = VirtualMifareClassic(UID)
+    card.set_trailer(4, b'\x11' * 6, card.ACCESS_TRANSPORT, b'\xff' * 6)
+    sim, rdr = field(card)
+    with pytest.raises(NFCWritingException, match=r"\[0, 1, 2, 3\]"):
+        rdr.get_tag().rekey(SectorTrailer(NEW_KEY, AccessBits.NDEF), Key.default())
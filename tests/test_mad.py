@@ -0,0 +1,100 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import CardGeometry, Key
+from ndef import MAD, NDEFTag, NDEFMessage, NDEFRecord
+
+UID = [0xDE, 0xAD, 0xBE, 0xEF]
+KEY_A0 = bytes(NDEFTag.KEYA0.key)
+KEY_A1 = bytes(NDEFTag.KEYA1.key)
+
+
+@pytest.fixture(autouse=True)
+def empty_mad_cache():
+    NDEFTag.mad_cache.clear()
+
+
+def ndef_card(size=1024, mad=None, gpb=0x69, locked=()):
+    """NDEF keys in every sector, `locked` sectors keyed for another application"""
+
+    card = VirtualMifareClassic(UID, size)
+    for sector in range(card.sectors):
+        key_a = KEY_A0 if sector in (0, 16) else KEY_A1
+        if sector in locked:
+            key_a = b'\x11' * 6
+        card.set_trailer(sector, key_a, card.ACCESS_TRANSPORT[:3] + bytes([gpb if sector == 0 else 0x69]),
+                         b'\xff' * 6)
+    if mad is not None:
+        mad1, mad2 = mad.to_bytes()
+        card.set_block(1, mad1[:16])
+        card.set_block(2, mad1[16:])
+        for i in range(3 if mad2 else 0):
+            card.set_block(64 + i, mad2[i * 16:(i + 1) * 16])
+    return card
+
+
+def reselected(rdr):
+    rdr.stop_crypto1()
+    return rdr.get_tag() or rdr.get_tag()
+
+
+def test_crc_and_round_trip():
+    mad1, mad2 = MAD.for_ndef(CardGeometry.CLASSIC_1K).to_bytes()
+    assert mad1[:2] == b'\x14\x01' and mad1[2:] == b'\x03\xe1' * 15 and mad2 is None
+    mad = MAD.for_ndef(CardGeometry.CLASSIC_4K, 20)
+    assert MAD.from_bytes(*mad.to_bytes()).aids == mad.aids
+    with pytest.raises(ValueError):
+        MAD.from_bytes(b'\x00' + mad1[1:])
+
+
+def test_only_ndef_sectors_are_used(field):
+    mad = MAD.for_ndef(CardGeometry.CLASSIC_1K, 3)
+    for sector in range(4, 16):
+        mad.aids[sector] = 0x4810
+    sim, rdr = field(ndef_card(mad=mad, locked=range(4, 16)))
+    ndef = NDEFTag(rdr.get_tag())
+    assert ndef.read_mad().sectors() == [1, 2, 3]
+    ndef.write_messages([NDEFMessage([NDEFRecord.create_uri("https://example.com/mixed")])])
+    with pytest.raises(ValueError):
+        ndef.write_messages([NDEFMessage([NDEFRecord.create_uri("https://example.com/" + "x" * 200)])])
+
+
+def test_format_4k_writes_mad2_and_gpb(field):
+    card = ndef_card(4096)
+    sim, rdr = field(card)
+    NDEFTag(rdr.get_tag()).format(key=NDEFTag.KEYA0, sectors=20)
+    assert card.block(3)[9] == MAD.gpb(2)
+
+    NDEFTag.mad_cache.clear()
+    mad = NDEFTag(reselected(rdr)).read_mad()
+    assert mad.version == 2
+    assert mad.sectors() == list(range(1, 16)) + list(range(17, 22))
+
+
+def test_mad1_gpb_skips_sector_16(field):
+    sim, rdr = field(ndef_card(4096, MAD.for_ndef(CardGeometry.CLASSIC_4K), gpb=0xC1))
+    tag = rdr.get_tag()
+    rdr.metrics.reset()
+    mad = NDEFTag(tag).read_mad()
+    assert mad.version == 1
+    assert rdr.metrics.counters["auths"] == 1
+
+
+def test_unreadable_mad2_is_cached_as_mad1(field):
+    sim, rdr = field(ndef_card(4096, MAD.for_ndef(CardGeometry.CLASSIC_4K), gpb=0xC2, locked=(16,)))
+    mad = NDEFTag(rdr.get_tag()).read_mad()
+    assert mad.version == 1 and mad.sectors() == list(range(1, 16))
+
+    tag = reselected(rdr)
+    rdr.metrics.reset()
+    assert NDEFTag(tag).read_mad() is mad
+    assert rdr.metrics.counters["auths"] == 0
+
+
+def test_failed_mad_authentication_is_not_cached(field):
+    sim, rdr = field(VirtualMifareClassic(UID))
+    tag = rdr.get_tag()
+    assert NDEFTag(tag).read_mad() is None
+    assert NDEFTag.mad_cache.get(bytes(tag.raw_uid)) is None
+    # Without a MAD every sector outside the MAD sectors holds NDEF data
+    assert NDEFTag(tag)._ndef_blocks() == CardGeometry.CLASSIC_1K.app_data_blocks
@@ -0,0 +1,67 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic
+from ndef import MAD, NDEFMessage, NDEFRecord, NDEFTag
+from nfc_tools import CardGeometry
+
+UID = [0xDE, 0xAD, 0xBE, 0xEF]
+
+
+@pytest.fixture
+def ndef(field):
+    card = VirtualMifareClassic(UID)
+    for sector in range(card.sectors):
+        key_a = NDEFTag.KEYA0 if sector == 0 else NDEFTag.KEYA1
+        card.set_trailer(sector, bytes(key_a.key), card.ACCESS_TRANSPORT, b'\xff' * 6)
+    mad1, _ = MAD.for_ndef(CardGeometry.CLASSIC_1K).to_bytes()
+    card.set_block(1, mad1[:16])
+    card.set_block(2, mad1[16:])
+    NDEFTag.mad_cache.clear()
+    sim, rdr = field(card)
+    return NDEFTag(rdr.get_tag())
+
+
+def uri(path):
+    return NDEFMessage([NDEFRecord.create_uri("https://example.com/" + path)])
+
+
+def test_write_read_messages(ndef):
+    ndef.write_messages([uri("a"), uri("b" * 100)])
+    messages = ndef.read_messages()
+    assert [m.records[0].payload for m in messages] == ["https://example.com/a", "https://example.com/" + "b" * 100]
+
+
+def test_iter_payload_of_empty_message(ndef):
+    # An empty message TLV, followed by bytes that look like a record header
+    ndef.write(b'\x03\x00\xFE\xD1\x01\x05U')
+    assert list(ndef.iter_payload()) == []
+
+
+def test_iter_payload_past_the_last_record(ndef):
+    ndef.write_messages([uri("only")])
+    assert list(ndef.iter_payload(record=1)) == []
+    assert b''.join(ndef.iter_payload()) == b'\x04example.com/only'
+
+
+def test_iter_payload_record_longer_than_tlv(ndef):
+    # Short record announcing 16 payload bytes inside a 5 byte TLV
+    ndef.write(b'\x03\x05\xD1\x01\x10U\x04' + bytes(16) + b'\xFE')
+    with pytest.raises(ValueError):
+        list(ndef.iter_payload())
+
+
+def test_write_chunked_round_trip(ndef):
+    chunks = [bytes((i + j) & 0xFF for j in range(64)) for i in range(0, 320, 64)]
+    size = ndef.write_chunked(0x54, iter(chunks), tnf=0x01)
+    assert size > 320
+    assert b''.join(bytes(piece) for piece in ndef.iter_payload()) == b''.join(chunks)
+    record = ndef.read_messages()[0].records[0]
+    assert record.flags.tnf == 0x01 and record.record_type == 0x54
+    assert bytes(record.record_payload) == b''.join(chunks)
+
+
+def test_aborted_write_chunked_leaves_an_empty_message(ndef):
+    ndef.write_messages([uri("old")])
+    with pytest.raises(ValueError):
+        ndef.write_chunked(0x54, (b'x' * 200 for _ in range(10)), tnf=0x01)
+    assert ndef.read_messages()[0].records == []
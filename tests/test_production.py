@@ -0,0 +1,107 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic, VirtualNTAG
+from nfc_production import EncodingProgress, PayloadQueue, ProductionEncoder
+from nfc_tools import CardGeometry
+from nfc_type2 import Type2NDEFTag
+from ndef import MAD, NDEFTag
+
+TEMPLATE = "https://example.com/t/{serial:04d}?u={uid}"
+
+
+@pytest.fixture(autouse=True)
+def empty_mad_cache():
+    NDEFTag.mad_cache.clear()
+
+
+def ndef_card(uid, key_a=bytes(NDEFTag.KEYA1.key)):
+    card = VirtualMifareClassic(uid)
+    for sector in range(card.sectors):
+        card.set_trailer(sector, bytes(NDEFTag.KEYA0.key) if sector == 0 else key_a, card.ACCESS_TRANSPORT,
+                         b'\xff' * 6)
+    mad1, _ = MAD.for_ndef(CardGeometry.CLASSIC_1K).to_bytes()
+    card.set_block(1, mad1[:16])
+    card.set_block(2, mad1[16:])
+    return card
+
+
+class Line():
+    """Puts cards on the reader one by one, the operator takes each off when told the result"""
+
+    def __init__(self, field):
+        self.sim, self.rdr = field()
+        self.card = None
+
+    def encoder(self, payloads, progress=None, **kwargs):
+        return ProductionEncoder(self.rdr, payloads, progress, on_result=self.take_off, **kwargs)
+
+    def take_off(self, result, tag):
+        self.sim.remove(self.card)
+
+    def encode(self, encoder, card):
+        self.card = card
+        self.sim.present(card)
+        return encoder.encode_next(timeout=0.5)
+
+
+def test_encode_skip_and_fail(field, tmp_path):
+    line = Line(field)
+    a, b = ndef_card([1, 2, 3, 4]), ndef_card([5, 6, 7, 8])
+    wrong_key = ndef_card([9, 9, 9, 9], key_a=b'\x00' * 6)
+    ntag = VirtualNTAG([0x04, 1, 2, 3, 4, 5, 6], 213)
+    payloads = PayloadQueue(TEMPLATE, start=100, count=4)
+    encoder = line.encoder(payloads, EncodingProgress(str(tmp_path / "progress.txt")))
+
+    results = [line.encode(encoder, card) for card in (a, a, wrong_key, b, ntag)]
+    assert results == ["encoded", "skipped", "failed", "encoded", "encoded"]
+    assert payloads.position == 3
+
+    stats = encoder.stats.snapshot()
+    assert stats["results"] == {"encoded": 3, "skipped": 1, "failed": 1}
+    assert stats["failures"]["write"] == 2  # first try and one retry
+    assert stats["timings"]["verify"]["count"] == 3
+
+    line.sim.present(b)
+    uri = NDEFTag(line.rdr.get_tag()).read_messages()[0].records[0].payload
+    assert uri == "https://example.com/t/0101?u=05060708"
+    line.sim.remove(b)
+    line.sim.present(ntag)
+    line.rdr.stop_crypto1()
+    tag = line.rdr.get_tag() or line.rdr.get_tag()
+    assert Type2NDEFTag(tag).read_messages()[0].records[0].payload.startswith("https://example.com/t/0102")
+
+
+def test_resume_after_power_cycle(field, tmp_path):
+    path = str(tmp_path / "progress.txt")
+    line = Line(field)
+    first = line.encoder(PayloadQueue(TEMPLATE, count=3), EncodingProgress(path))
+    assert line.encode(first, ndef_card([1, 2, 3, 4])) == "encoded"
+    # Power lost while the next line was written
+    with open(path, "a") as f:
+        f.write("1 0506")
+
+    payloads = PayloadQueue(TEMPLATE, count=3)
+    progress = EncodingProgress(path)
+    again = line.encoder(payloads, progress)
+    assert payloads.position == 1 and len(progress) == 1
+    assert line.encode(again, ndef_card([1, 2, 3, 4])) == "skipped"
+    assert line.encode(again, ndef_card([5, 6, 7, 8])) == "encoded"
+    assert payloads.position == 2
+
+
+def test_card_left_on_the_reader(field):
+    sim, rdr = field(ndef_card([1, 2, 3, 4]))
+    encoder = ProductionEncoder(rdr, PayloadQueue(TEMPLATE, count=2), removal_timeout=0.05)
+    assert encoder.encode_next(timeout=0) == "encoded"
+    assert encoder.stats.failures["removal"] == 1
+
+
+def test_verify_detects_other_data(field):
+    sim, rdr = field(ndef_card([1, 2, 3, 4]))
+    ndef = NDEFTag(rdr.get_tag())
+    payloads = PayloadQueue(TEMPLATE)
+    data = ndef.encode_messages([payloads.message(b'\x01\x02\x03\x04')])
+    ndef.write(data)
+    assert ndef.verify(data)
+    payloads.advance()
+    assert not ndef.verify(ndef.encode_messages([payloads.message(b'\x01\x02\x03\x04')]))
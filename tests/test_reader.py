@@ -0,0 +1,53 @@
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import PollScheduler
+
+UID = [0xDE, 0xAD, 0xBE, 0xEF]
+
+
+def test_inventory_finds_every_tag(field):
+    uids = [[0x01, 0x02, 0x03, 0x04], [0x01, 0x02, 0x83, 0x04], [0x71, 0x02, 0x03, 0x04]]
+    sim, rdr = field(*(VirtualMifareClassic(uid) for uid in uids))
+    found = rdr.inventory()
+    assert sorted(tag.uid for tag in found) == sorted(uids)
+
+
+def test_cancelled_halt_restores_response_timeout(field):
+    sim, rdr = field(VirtualMifareClassic(UID))
+    assert rdr.get_tag() is not None
+    timeout = rdr.response_timeout_ms
+    steps = rdr._halt_steps()
+    while rdr.response_timeout_ms != 1:
+        next(steps)
+    steps.close()
+    assert rdr.response_timeout_ms == timeout
+
+
+def test_idle_backoff_stays_short():
+    scheduler = PollScheduler(sleep=lambda seconds: None)
+    for _ in range(200):
+        scheduler.missed()
+    assert scheduler.delay_ms() == 100
+
+
+def test_scan_wait_is_capped_at_the_timeout(field):
+    slept = []
+    sim, rdr = field(scheduler=PollScheduler(interval_ms=400, sleep=slept.append))
+    assert rdr.scan_for_tag(timeout=0.1) is None
+    assert slept and max(slept) <= 0.1
+
+
+def test_cascade_levels(field):
+    for uid in ([0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66], list(range(1, 11))):
+        sim, rdr = field(VirtualMifareClassic(uid))
+        tag = rdr.get_tag()
+        assert tag.uid == uid
+        assert tag.read_blocks([1]) is not None
+
+
+def test_inventory_resolves_colliding_long_uids(field):
+    uids = [[0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66], [0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x67],
+            [0x04, 0x11, 0x23, 0x33, 0x44, 0x55, 0x66], list(range(1, 11)), [0x11, 0x22, 0x33, 0x44]]
+    sim, rdr = field(*(VirtualMifareClassic(uid) for uid in uids))
+    found = rdr.inventory()
+    assert sorted(tag.uid for tag in found) == sorted(uids)
+    assert found[0].reselect()
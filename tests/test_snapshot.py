@@ -0,0 +1,55 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import Key, TagSnapshot
+
+UID = [0x01, 0x02, 0x03, 0x04]
+
+
+def snapshot_of(field, card):
+    sim, rdr = field(card)
+    return rdr.get_tag().snapshot(Key.default())
+
+
+def test_round_trip(field):
+    snap = snapshot_of(field, VirtualMifareClassic(UID))
+    assert snap.uid == bytes(UID) and snap.sak == 0x08 and snap.atqa == 0x0004
+    again = TagSnapshot.from_bytes(snap.to_bytes())
+    assert (again.uid, again.atqa, again.sak) == (snap.uid, snap.atqa, snap.sak)
+    assert again.to_bytes() == snap.to_bytes() and again.complete
+
+
+@pytest.mark.parametrize("cut", [3, 5, 8, 12, 100, -1])
+def test_truncated_input(field, cut):
+    data = snapshot_of(field, VirtualMifareClassic(UID)).to_bytes()
+    with pytest.raises(ValueError):
+        TagSnapshot.from_bytes(data[:cut])
+
+
+def test_version_1_still_reads():
+    snap = TagSnapshot(UID, block_count=4)
+    data = bytearray(snap.to_bytes())
+    data[4] = 1
+    # Version 1: two bytes of REQA answer length in place of ATQA and SAK
+    pos = 6 + len(UID)
+    data[pos:pos + 3] = b'\x00\x10'
+    old = TagSnapshot.from_bytes(data)
+    assert old.uid == bytes(UID) and old.sak is None and old.block_count == 4
+
+
+def test_restore_refuses_other_card_type(field):
+    mini = snapshot_of(field, VirtualMifareClassic(UID, 320))
+    assert mini.sak == 0x09
+    sim, rdr = field(VirtualMifareClassic([0x05, 0x06, 0x07, 0x08]))
+    with pytest.raises(ValueError):
+        rdr.get_tag().restore(mini, Key.default())
+
+
+def test_restore_onto_same_type(field):
+    source = VirtualMifareClassic(UID)
+    source.set_block(4, b'A' * 16)
+    snap = snapshot_of(field, source)
+    target = VirtualMifareClassic([0x05, 0x06, 0x07, 0x08])
+    sim, rdr = field(target)
+    rdr.get_tag().restore(snap, Key.default())
+    assert target.block(4) == b'A' * 16
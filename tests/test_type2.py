@@ -0,0 +1,19 @@
+from nfc_sim import VirtualNTAG
+from nfc_type2 import Type2NDEFTag
+
+from ndef import NDEFMessage, NDEFRecord
+
+UID7 = [0x04, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06]
+
+
+def test_clean_writes_one_page(field):
+    card = VirtualNTAG(UID7, 216)
+    sim, rdr = field(card)
+    ndef = Type2NDEFTag(rdr.get_tag())
+    ndef.write_messages([NDEFMessage([NDEFRecord.create_uri("https://example.com/a/long/path")])])
+
+    rdr.metrics.reset()
+    ndef.clean()
+    assert rdr.metrics.counters["writes"] == 1
+    assert card.page(4) == b'\x03\x00\xfe\x00'
+    assert ndef.read_messages()[0].records == []
@@ -0,0 +1,52 @@
+import pytest
+
+from nfc_sim import VirtualMifareClassic
+from nfc_tools import Key, NFCWritingException
+
+UID = [0xDE, 0xAD, 0xBE, 0xEF]
+
+
+def value_tag(field, value=10):
+    sim, rdr = field(VirtualMifareClassic(UID))
+    tag = rdr.get_tag()
+    tag.format_value(4, value, key=Key.default())
+    return rdr, tag
+
+
+def test_decrement_increment(field):
+    rdr, tag = value_tag(field)
+    tag.decrement(4, 3)
+    tag.increment(4, 1)
+    assert tag.read_value(4) == 8
+
+
+def test_apply_deltas(field):
+    rdr, tag = value_tag(field)
+    tag.format_value(8, 0, key=Key.default())
+    tag.apply_deltas({4: -1, 8: +2})
+    assert tag.read_value(4) == 9
+    assert tag.read_value(8) == 2
+
+
+def test_copy_value(field):
+    rdr, tag = value_tag(field)
+    tag.copy_value(4, 5)
+    assert tag.read_value(5) == 10
+
+
+def test_value_op_on_data_block_fails(field):
+    rdr, tag = value_tag(field)
+    tag.data_write(b'not a value', blocks=[6], key=Key.default())
+    with pytest.raises(NFCWritingException):
+        tag.decrement(6, 1)
+
+
+def test_cancelled_value_op_restores_response_timeout(field):
+    rdr, tag = value_tag(field)
+    timeout = rdr.response_timeout_ms
+    steps = rdr._mifare_value_steps(rdr.DECREMENT, 4, 1)
+    # Stop while the operand is in flight with the short timeout
+    while rdr.response_timeout_ms != 1:
+        next(steps)
+    steps.close()
+    assert rdr.response_timeout_ms == timeout